@@ -2,6 +2,7 @@ import dash
 import dash_bootstrap_components as dbc
 
 from src.core.layout import layout
+from src.core.api import register_api
 
 # Initialize the Dash app
 app = dash.Dash(
@@ -9,10 +10,14 @@ app = dash.Dash(
     external_stylesheets=[dbc.themes.BOOTSTRAP],
 )
 app.title = "HLA-typing"  # Sets the browser tab title
+server = app.server  # The WSGI app, e.g. for gunicorn app:server
 
 # Define the app layout
 app.layout = layout()
 
+# Register the API routes
+register_api(app.server)
+
 
 # Run the Dash app
 if __name__ == '__main__':
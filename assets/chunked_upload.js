@@ -0,0 +1,113 @@
+// Chunked, resumable upload of HLA-LA output files and whole-plate archives to /api/uploads.
+// Dash serves every script in assets/, the button is found by event delegation since the
+// layout is rendered after this script runs.
+
+(function () {
+    const chunkSize = 4 * 1024 * 1024;
+    const maxRetries = 5;
+
+    function setStatus(text) {
+        const status = document.getElementById("chunked-upload-status");
+        if (status) status.textContent = text;
+    }
+
+    // Returns a genotype check finding as a sentence, as src/utils/download_report_table.py words it
+    function flagMessage(flag) {
+        const loci = flag.discordant_loci.join(", ");
+        if (flag.kind === "swap") {
+            return `Possible sample swap: '${flag.sample}' differs from the earlier sample '${flag.other}' at ${loci}.`;
+        }
+        if (flag.kind === "duplicate") {
+            return `Possible duplicate patient: '${flag.sample}' is identical to '${flag.other}'.`;
+        }
+        return `Possible duplicate patient: '${flag.sample}' matches '${flag.other}' except at ${loci}.`;
+    }
+
+    async function sha256(blob) {
+        const digest = await crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, "0")).join("");
+    }
+
+    async function request(url, options) {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                const response = await fetch(url, options);
+                if (response.ok || (response.status < 500 && response.status !== 422) || attempt >= maxRetries) {
+                    return response;
+                }
+            } catch (error) {
+                if (attempt >= maxRetries) throw error;
+            }
+            await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** attempt));
+        }
+    }
+
+    // Returns the status of an earlier upload of the same file, or starts a new one
+    async function resumeOrStart(file) {
+        const key = `hla-upload:${file.name}:${file.size}:${file.lastModified}`;
+        const uploadId = localStorage.getItem(key);
+        if (uploadId) {
+            const response = await request(`/api/uploads/${uploadId}`);
+            if (response.ok) return [key, await response.json()];
+        }
+
+        const response = await request("/api/uploads", {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify({filename: file.name, size: file.size, chunk_size: chunkSize}),
+        });
+        if (!response.ok) throw new Error((await response.json()).error);
+        const status = await response.json();
+        localStorage.setItem(key, status.upload_id);
+        return [key, status];
+    }
+
+    async function upload(file) {
+        const [key, status] = await resumeOrStart(file);
+        const missing = status.missing;
+        let done = status.chunks - missing.length;
+
+        for (const index of missing) {
+            const chunk = file.slice(index * status.chunk_size, (index + 1) * status.chunk_size);
+            const response = await request(`/api/uploads/${status.upload_id}/chunks/${index}`, {
+                method: "PUT",
+                headers: {"X-Chunk-SHA256": await sha256(chunk)},
+                body: chunk,
+            });
+            if (!response.ok) throw new Error((await response.json()).error);
+            done += 1;
+            setStatus(`Uploading ${file.name}: ${Math.round((100 * done) / status.chunks)}%`);
+        }
+
+        setStatus(`Ingesting ${file.name}...`);
+        const response = await request(`/api/uploads/${status.upload_id}/complete`, {method: "POST"});
+        const summary = await response.json();
+        if (!response.ok) throw new Error(summary.error);
+        localStorage.removeItem(key);
+
+        // Hand the summary to Dash, which reloads the cohort grids
+        if (window.dash_clientside && window.dash_clientside.set_props) {
+            window.dash_clientside.set_props("chunked-upload-summary", {data: summary});
+        }
+
+        setStatus(
+            `${file.name}: ${summary.added.length} added, ${summary.replaced.length} replaced, ` +
+            `${summary.skipped.length} already up to date, ${summary.errors.length} failed.` +
+            summary.fingerprint_flags.map((flag) => ` ${flagMessage(flag)}`).join("")
+        );
+    }
+
+    // Dash has no file input component, so the button opens a file picker of its own
+    document.addEventListener("click", (event) => {
+        if (!event.target.closest("#chunked-upload-button")) return;
+        const input = document.createElement("input");
+        input.type = "file";
+        input.accept = ".txt,.tsv,.json,.zip,.tar,.gz,.tgz";
+        input.addEventListener("change", () => {
+            if (!input.files.length) return;
+            const file = input.files[0];
+            upload(file).catch((error) => setStatus(`Could not upload ${file.name}: ${error.message}`));
+        });
+        input.click();
+    });
+})();
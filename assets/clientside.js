@@ -0,0 +1,57 @@
+// Clientside callbacks for presentation-only updates, registered in src/core/layout.py.
+// They reshape data the browser already holds, so they need no server round-trip.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    hla: {
+        // Filters the records of the loaded data table by the QC rule of src/utils/qc_rules.py:
+        // Q1 >= min_q1 and (proportionkMersCovered >= min_kmers or AverageCoverage > min_coverage),
+        // where metrics the record's caller does not report do not fail it. callerMetrics holds the
+        // metrics of each caller, records of other callers are held to all the rules
+        filter_qc: function (loaded, show, loci, minQ1, minKmers, minCoverage, callerMetrics) {
+            const records = (loaded && loaded.props && loaded.props.data) || [];
+            const normalize = (locus) => String(locus).replace(/^HLA-/, "");
+            const metrics = callerMetrics || {};
+            const reports = (record, metric) => !(record.Caller in metrics) || metrics[record.Caller].includes(metric);
+            const selected = new Set(loci || []);
+
+            const rows = [];
+            for (const record of records) {
+                if (selected.size && !selected.has(normalize(record.Locus))) continue;
+
+                const passed = (!reports(record, "Q1") || parseFloat(record.Q1) >= (minQ1 ?? -Infinity)) && (
+                    parseFloat(record.proportionkMersCovered) >= (minKmers ?? -Infinity) ||
+                    parseFloat(record.AverageCoverage) > (minCoverage ?? -Infinity) ||
+                    (!reports(record, "proportionkMersCovered") && !reports(record, "AverageCoverage"))
+                );
+                if ((show === "failed" && passed) || (show === "passed" && !passed)) continue;
+
+                rows.push(Object.assign({}, record, {QC_PASSED: String(passed)}));
+            }
+
+            const columns = records.length
+                ? Object.keys(records[0]).concat("QC_PASSED").map((name) => ({name: name, id: name}))
+                : [];
+            const count = records.length ? `${rows.length} of ${records.length} HLA types shown` : "No file uploaded yet.";
+
+            return [rows, columns, count];
+        },
+
+        // Opens the download alert whenever the server sets a new message
+        open_alert: function (children) {
+            return Boolean(children && children.length);
+        },
+
+        // Fetches the separated and concatenated cohort views. The responses must be revalidated,
+        // so the browser cache sends their ETag and an unchanged view is answered with 304.
+        load_cohort_grids: async function () {
+            const load = async (view) => {
+                const response = await fetch(`/api/cohort/${view}`);
+                if (!response.ok) return [[], []];
+                const snapshot = await response.json();
+                return [snapshot.rowData, snapshot.columnDefs];
+            };
+            const [separated, concatenated] = await Promise.all([load("separated"), load("concatenated")]);
+            return separated.concat(concatenated);
+        },
+    },
+});
@@ -0,0 +1,315 @@
+# This file contains the load test harness, replaying the upload callback chain of many users against a local server
+#
+# Usage:
+#   python load_test.py --users 30 --iterations 5 --workers 4
+#   python load_test.py --url http://127.0.0.1:8050 --users 30   # against a running server
+#
+# Without --url a server is started in a temporary directory, so the trial workbooks it writes
+# do not touch data/outputs. It runs under gunicorn with --workers processes when gunicorn is
+# installed, and under the threaded Dash development server otherwise.
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Built in imports
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import importlib.util
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+from src.utils.hla_loci import hla_loci
+
+
+# Declare the callbacks of one upload, by their outputs, in the order the browser fires them.
+# The callbacks of a step run concurrently, as the browser sends them at once.
+callback_chain = [
+    [("load_data_to_accordion_item1", "..loaded-data.children...upload-digest.data..")],
+    [("create_qc_report", "..qc-report-plot.children.."),
+     ("create_final_table", "..final-report-table.children..")],
+    [("download_excel", "..download-alert.children...download-alert.color..")],
+    [("create_qc_drift_report", "..qc-drift-report.children.."),
+     ("create_qc_sweep_report", "..qc-sweep-report.children..")],
+]
+
+# Declare the columns of a *_bestguess_G.txt file
+bestguess_columns = [
+    "Locus", "Chromosome", "Allele", "Q1", "Q2", "AverageCoverage", "CoverageFirstDecile", "MinimumCoverage",
+    "proportionkMersCovered", "LocusAvgColumnError", "NColumns_UnaccountedAllele_fGT0.2", "perfectG",
+]
+
+repo_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_bestguess(rng) -> str:
+    """ Returns the text of a synthetic *_bestguess_G.txt file, with a few calls failing QC """
+    lines = ["\t".join(bestguess_columns)]
+    for locus in hla_loci:
+        for copy in (1, 2):
+            coverage = rng.uniform(1, 80)
+            lines.append("\t".join(str(value) for value in [
+                f"HLA-{locus}", copy, f"HLA-{locus}*{rng.randint(1, 99):02d}:{rng.randint(1, 99):02d}:01G",
+                rng.choice([1.0, 1.0, 1.0, 0.999, 0.98]), 0.0, round(coverage, 1), round(coverage * 0.9, 1),
+                int(coverage * 0.7), rng.choice([1.0, 1.0, 0.99]), 0.002, 0, 1,
+            ]))
+    return "\n".join(lines) + "\n"
+
+
+def upload_contents(text) -> str:
+    """ Returns a file as the data URL dcc.Upload sends """
+    return "data:text/plain;base64," + base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+
+class CallbackClient:
+    """ Fires Dash callbacks over HTTP like the browser, keeping the component properties of one user """
+
+    def __init__(self, url, dependencies, props):
+        self.url = url
+        self.dependencies = dependencies
+        self.props = dict(props)
+
+    def fire(self, output):
+        """ Fires the callback of `output` and stores the properties it returns """
+        dependency = self.dependencies[output]
+        body = {
+            "output": output,
+            "outputs": [{"id": id_, "property": prop} for id_, prop in _split_output(output)],
+            "inputs": [self._value(item) for item in dependency["inputs"]],
+            "state": [self._value(item) for item in dependency["state"]],
+            "changedPropIds": [f"{item['id']}.{item['property']}" for item in dependency["inputs"]],
+        }
+        request = urllib.request.Request(
+            f"{self.url}/_dash-update-component",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=300) as response:
+            payload = response.read()
+
+        # A callback that returns no update answers 204 without a body
+        if payload:
+            for id_, props in json.loads(payload)["response"].items():
+                for prop, value in props.items():
+                    self.props[(id_, prop)] = value
+
+    def _value(self, item):
+        return {"id": item["id"], "property": item["property"], "value": self.props.get((item["id"], item["property"]))}
+
+
+def run_load_test(url, users, iterations, trials=1, think_time=0.0, seed=0) -> pd.DataFrame:
+    """
+        Replays the upload callback chain of `users` concurrent users against a server.
+
+        Every user uploads `iterations` synthetic samples, spread over `trials` trial
+        workbooks, so a single trial makes all users contend for the same workbook.
+
+        Returns:
+        --------
+        requests : pd.DataFrame
+            One row per callback request: USER, CALLBACK, START, END, LATENCY and ERROR.
+    """
+    with urllib.request.urlopen(f"{url}/_dash-dependencies", timeout=60) as response:
+        dependencies = {dependency["output"]: dependency for dependency in json.load(response)}
+
+    with urllib.request.urlopen(f"{url}/_dash-layout", timeout=60) as response:
+        initial_props = _layout_props(json.load(response))
+
+    missing = [output for step in callback_chain for _, output in step if output not in dependencies]
+    if missing:
+        raise RuntimeError(f"The server has no callbacks for {missing}")
+
+    records = []
+    records_lock = threading.Lock()
+    steps = ThreadPoolExecutor(max_workers=users * max(len(step) for step in callback_chain))
+
+    def timed(user, name, client, output):
+        start = time.perf_counter()
+        error = None
+        try:
+            client.fire(output)
+            # A failed workbook write is answered with a danger alert, not an HTTP error
+            if name == "download_excel" and client.props.get(("download-alert", "color")) == "danger":
+                error = "Write failed"
+        except urllib.error.HTTPError as e:
+            error = f"HTTP {e.code}"
+        except Exception as e:
+            error = type(e).__name__
+        end = time.perf_counter()
+        with records_lock:
+            records.append({"USER": user, "CALLBACK": name, "START": start, "END": end, "LATENCY": end - start, "ERROR": error})
+        return error
+
+    def user_session(user):
+        rng = random.Random(seed * 100003 + user)
+        for iteration in range(iterations):
+            client = CallbackClient(url, dependencies, initial_props)
+            sample_id = f"LT{user % trials:02d}_U{user:03d}S{iteration:04d}"
+            client.props[("upload-data", "filename")] = f"{sample_id}_R1_bestguess_G.txt"
+            client.props[("upload-data", "contents")] = upload_contents(synthetic_bestguess(rng))
+            client.props[("download-button", "n_clicks")] = 1
+
+            for step in callback_chain:
+                futures = [steps.submit(timed, user, name, client, output) for name, output in step]
+                if any(future.result() for future in futures):
+                    break  # The browser stops the chain when a callback fails
+            time.sleep(think_time)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as sessions:
+        list(sessions.map(user_session, range(users)))
+    steps.shutdown()
+
+    requests = pd.DataFrame(records, columns=["USER", "CALLBACK", "START", "END", "LATENCY", "ERROR"])
+    requests[["START", "END"]] -= started
+    return requests
+
+
+def latency_report(requests) -> pd.DataFrame:
+    """ Returns the request count, error rate and p50, p95 and p99 latency in ms per callback """
+    rows = []
+    for name, group in list(requests.groupby("CALLBACK", sort=False)) + [("All", requests)]:
+        ok = group.loc[group["ERROR"].isna(), "LATENCY"].to_numpy() * 1000
+        rows.append({
+            "CALLBACK": name,
+            "REQUESTS": len(group),
+            "ERROR_RATE": group["ERROR"].notna().mean(),
+            "P50_MS": np.percentile(ok, 50) if len(ok) else None,
+            "P95_MS": np.percentile(ok, 95) if len(ok) else None,
+            "P99_MS": np.percentile(ok, 99) if len(ok) else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def worker_saturation(requests, workers) -> dict:
+    """
+        Returns how busy `workers` server workers were, from the requests in flight over time.
+
+        "utilization" is the mean share of workers busy, counting at most `workers` requests
+        in flight, and "saturated" the share of the run with every worker busy, when further
+        requests queue. "max_in_flight" is the highest number of concurrent requests.
+    """
+    if requests.empty:
+        return {"utilization": 0.0, "saturated": 0.0, "max_in_flight": 0}
+
+    # Sweep the start and end events in time order
+    times = np.concatenate([requests["START"].to_numpy(), requests["END"].to_numpy()])
+    deltas = np.concatenate([np.ones(len(requests)), -np.ones(len(requests))])
+    order = np.lexsort((deltas, times))  # Ends before starts at equal times
+    times, in_flight = times[order], np.cumsum(deltas[order])
+
+    durations = np.diff(times)
+    span = times[-1] - times[0]
+    return {
+        "utilization": float((np.minimum(in_flight[:-1], workers) * durations).sum() / (workers * span)) if span else 0.0,
+        "saturated": float(durations[in_flight[:-1] >= workers].sum() / span) if span else 0.0,
+        "max_in_flight": int(in_flight.max()),
+    }
+
+
+def start_server(workers, port):
+    """ Starts the app in a temporary working directory and returns the process, the directory and the URL """
+    workdir = tempfile.mkdtemp(prefix="hla_load_test_")
+    os.makedirs(os.path.join(workdir, "data", "outputs", "output"), exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=repo_path + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+    if importlib.util.find_spec("gunicorn"):
+        command = [sys.executable, "-m", "gunicorn", "app:server", "--workers", str(workers), "--bind", f"127.0.0.1:{port}", "--timeout", "300"]
+    else:
+        print("gunicorn is not installed, using the threaded development server", file=sys.stderr)
+        command = [sys.executable, "-c", f"from app import app; app.run(host='127.0.0.1', port={port}, debug=False, threaded=True)"]
+
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Wait for the server to answer
+    deadline = time.time() + 60
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_dash-dependencies", timeout=5).read()
+            return process, workdir, f"http://127.0.0.1:{port}"
+        except (urllib.error.URLError, ConnectionError):
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                shutil.rmtree(workdir, ignore_errors=True)
+                raise RuntimeError("The server did not start")
+            time.sleep(0.5)
+
+
+def _layout_props(node, props=None) -> dict:
+    """ Returns the initial (id, property) values of the components in a serialized Dash layout """
+    props = {} if props is None else props
+    if isinstance(node, list):
+        for child in node:
+            _layout_props(child, props)
+    elif isinstance(node, dict) and "props" in node:
+        component_id = node["props"].get("id")
+        for prop, value in node["props"].items():
+            if isinstance(component_id, str) and prop != "children":
+                props[(component_id, prop)] = value
+            _layout_props(value, props)
+    return props
+
+
+def _split_output(output):
+    """ Returns the (id, property) pairs of a Dash multi-output string like "..a.children...b.color.." """
+    return [tuple(item.rsplit(".", 1)) for item in output.strip(".").split("...")] if output.startswith("..") else [tuple(output.rsplit(".", 1))]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays the upload callback chain of many users against a local server.")
+    parser.add_argument("--url", help="The URL of a running server. A local server is started when missing.")
+    parser.add_argument("--users", type=int, default=30, help="The number of concurrent users.")
+    parser.add_argument("--iterations", type=int, default=5, help="The number of samples each user uploads.")
+    parser.add_argument("--workers", type=int, default=4, help="The number of server workers.")
+    parser.add_argument("--trials", type=int, default=1, help="The number of trial workbooks the samples are spread over.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="The seconds a user waits between uploads.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this file as JSON.")
+    args = parser.parse_args()
+
+    process, workdir, url = (None, None, args.url) if args.url else start_server(args.workers, _free_port())
+
+    try:
+        started = time.perf_counter()
+        requests = run_load_test(url.rstrip("/"), args.users, args.iterations, args.trials, args.think_time, args.seed)
+        elapsed = time.perf_counter() - started
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = latency_report(requests)
+    saturation = worker_saturation(requests, args.workers)
+    uploads = requests[requests["CALLBACK"] == "download_excel"]
+
+    print(report.round(3).to_string(index=False))
+    print(f"\n{len(uploads)} uploads in {elapsed:.1f} s ({len(uploads) / elapsed:.2f} per s) by {args.users} users")
+    print(f"Worker utilization {saturation['utilization']:.0%}, all {args.workers} workers busy {saturation['saturated']:.0%} "
+          f"of the time, at most {saturation['max_in_flight']} requests in flight")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"callbacks": report.to_dict("records"), "saturation": saturation, "elapsed": elapsed}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# This file contains the HTTP API routes served next to the Dash app
+
+# Third party imports
+from flask import jsonify, request, Response
+
+# Built in imports
+import gzip
+
+# Local imports
+from src.utils.cohort_table import load_cohort_table
+from src.utils.hla_matching import find_matches, matching_loci
+from src.utils.cohort_index import load_cohort_index
+from src.utils.output_path import output_path
+from src.utils.imgt_lookup import load_imgt_lookup, annotate_alleles, expand_g_group
+from src.utils.cohort_snapshot import cohort_snapshot
+from src.utils.genotype_fingerprint import cohort_fingerprint_check, fingerprint_loci, fingerprint_resolution, max_discordant_loci
+from src.utils.chunked_upload import UploadError, start_upload, upload_status, write_chunk, complete_upload
+
+
+def register_api(server):
+    """ Registers the API routes on the Flask server of the Dash app """
+
+    @server.route("/api/match/<patient_id>")
+    def match(patient_id):
+        """
+            Returns the best matching cohort candidates for a patient.
+
+            Query parameters: loci (comma separated, default A,B,C,DRB1,DQB1), level
+            (allele or antigen, default allele), top_k (default 10) and qc_passed
+            (1 to leave out candidates failing QC, default 1).
+        """
+        loci = request.args.get("loci")
+        loci = loci.split(",") if loci else matching_loci
+
+        try:
+            encoded = load_cohort_index(output_path)
+            matches = find_matches(
+                encoded, patient_id, loci,
+                level=request.args.get("level", "allele"),
+                top_k=int(request.args.get("top_k", 10)),
+                require_qc_passed=request.args.get("qc_passed", "1") == "1",
+            )
+        except KeyError as e:
+            return jsonify({"error": str(e)}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        return jsonify({"patient_id": patient_id, "loci": loci, "matches": matches.to_dict("records")})
+
+    @server.route("/api/alleles/<allele>")
+    def allele(allele):
+        """ Returns the G group members, P group and serological equivalent of an allele or G group """
+        lookup = load_imgt_lookup()
+        if lookup is None:
+            return jsonify({"error": "No IMGT/HLA release is provided"}), 404
+
+        members = expand_g_group(allele, lookup)
+        if not members:
+            return jsonify({"error": f"Unknown allele '{allele}'"}), 404
+
+        annotations = annotate_alleles([allele], lookup).iloc[0]
+        return jsonify({
+            "allele": allele,
+            "g_group": annotations["G_GROUP"],
+            "p_group": annotations["P_GROUP"],
+            "serology": annotations["SEROLOGY"],
+            "members": members,
+        })
+
+    @server.route("/api/fingerprints/check")
+    def fingerprint_check():
+        """
+            Returns the pairs of cohort patients with the same or nearly the same genotype.
+
+            Query parameters: loci (comma separated, default A,B,C,DRB1,DQB1), resolution
+            (allele, two_field or antigen, default two_field) and max_discordant (default 2).
+        """
+        loci = request.args.get("loci")
+        loci = loci.split(",") if loci else fingerprint_loci
+
+        try:
+            pairs = cohort_fingerprint_check(
+                load_cohort_table(output_path), loci,
+                resolution=request.args.get("resolution", fingerprint_resolution),
+                max_discordant=int(request.args.get("max_discordant", max_discordant_loci)),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        return jsonify({"loci": loci, "pairs": pairs.to_dict("records")})
+
+    @server.route("/api/cohort/<view>")
+    def cohort(view):
+        """
+            Returns a cohort view as {"version", "rowData", "columnDefs", "errors"}, materialized once per data version.
+
+            Query parameters: grouping (allele, p_group or serology, default allele). The
+            response carries an ETag and must be revalidated, so an unchanged view is
+            answered with 304. It is sent gzip compressed when the client accepts it.
+        """
+        try:
+            snapshot = cohort_snapshot(output_path, view, request.args.get("grouping", "allele"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Each encoding has its own ETag, as the bytes differ
+        if "gzip" in request.accept_encodings:
+            response = Response(snapshot["body"], mimetype="application/json")
+            response.headers["Content-Encoding"] = "gzip"
+            response.set_etag(f"{snapshot['etag']}-gzip")
+        else:
+            response = Response(gzip.decompress(snapshot["body"]), mimetype="application/json")
+            response.set_etag(snapshot["etag"])
+
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        return response.make_conditional(request)
+
+    @server.route("/api/uploads", methods=["POST"])
+    def create_upload():
+        """
+            Starts a chunked upload of a HLA-LA output file or an archive of a whole plate.
+
+            JSON body: filename, size, chunk_size (optional) and sha256 of the whole file (optional).
+        """
+        body = request.get_json(silent=True) or {}
+        try:
+            status = start_upload(body.get("filename"), body.get("size", 0), body.get("chunk_size"), body.get("sha256"))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+
+        return jsonify(status), 201
+
+    @server.route("/api/uploads/<upload_id>")
+    def get_upload(upload_id):
+        """ Returns the received and missing chunks of an upload, to resume it """
+        try:
+            return jsonify(upload_status(upload_id))
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+
+    @server.route("/api/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+    def put_chunk(upload_id, index):
+        """ Stores one chunk, the raw body, checked against the X-Chunk-SHA256 header """
+        try:
+            return jsonify(write_chunk(upload_id, index, request.stream, request.headers.get("X-Chunk-SHA256")))
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+
+    @server.route("/api/uploads/<upload_id>/complete", methods=["POST"])
+    def finish_upload(upload_id):
+        """ Ingests a fully received upload and returns the added, replaced, skipped and failed samples """
+        try:
+            return jsonify(complete_upload(upload_id, output_path))
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
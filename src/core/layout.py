@@ -1,20 +1,29 @@
 # This file contains the app layout
 
 # Third party imports
-from dash import html, dcc, callback
-from dash.dependencies import Input, Output, State
+from dash import html, dcc, callback, clientside_callback
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
+import dash_ag_grid as dag
+import numpy as np
 
 # Local imports
-from src.utils.load_data import load_data
+from src.utils.load_data import load_data, sample_digest
 from src.utils.qc_report import qc_report
 from src.utils.filter_data import filter_data
 from src.utils.final_table import final_table
 from src.utils.download_report_table import generate_excel_download_link
 from src.utils.data_descriptions import analysis_strategy, further_analysis_strategy
-from src.utils.output_path import output_path, folder_in_output_path
-from src.utils.fill_hla_types_per_patient import fill_hla_types_per_patient
-from src.utils.fill_hla_types_per_patient_concatinated import fill_hla_types_per_patient_concatinated
+from src.utils.output_path import output_path
+from src.utils.cohort_index import load_cohort_index
+from src.utils.hla_loci import hla_loci
+from src.utils.hla_matching import matching_loci
+from src.utils.match_table import match_table
+from src.utils.qc_monitor import monitored_metrics
+from src.utils.qc_drift_report import qc_drift_report
+from src.utils.qc_rules import qc_rules
+from src.utils.qc_sweep import qc_sweep_grid, qc_rule_metrics
+from src.utils.qc_sweep_report import qc_sweep_report
 
 
 def layout():
@@ -24,13 +33,14 @@ def layout():
             dbc.Row([
                 dbc.Col([
                     html.H1("HLA TYPING REPORT", id="title1"),
-                    html.H3("Upload the *R1_bestGuess_G.txt file from the HLA-LA output"),
+                    html.H3("Upload the typing output of HLA-LA (*R1_bestGuess_G.txt), OptiType, HLA-HD or arcasHLA"),
                     dcc.Upload(
                         id='upload-data',
                         children=html.Div(['Drag and Drop or ', html.A('Select Files')]),
                         className="upload-field",
                         multiple=False  # True allows multiple files to be uploaded
                     ),
+                    dcc.Store(id="upload-digest"),  # Content hash of the uploaded file, computed once per upload
                     dbc.Accordion([
                         dbc.AccordionItem(
                             id="loaded-data",
@@ -54,7 +64,7 @@ def layout():
                         # ),
                         dbc.AccordionItem(
                             id="filtered-data",
-                            children=[],
+                            children=[filter_data()],
                             title="Filtered Data"
                         ),
                         dbc.AccordionItem(
@@ -71,142 +81,288 @@ def layout():
                     dbc.Alert(id="download-alert", is_open=False, dismissable=True, color="", children=[]),
                 ])
             ]),
-            # dbc.Row([
-            #     dbc.Col([
-
-            #         html.H3("HLA Types per Patient - Chromosome Copies Concatinated"),
-            #         dbc.Accordion([
-            #             dbc.AccordionItem([
-            #                 dag.AgGrid(
-            #                     id="ag-grid2",
-            #                     rowData=[],
-            #                     columnDefs=[],
-            #                     defaultColDef={
-            #                         "resizable": True, "sortable": True, "filter": True, "hide": False,
-            #                         "flex": 1,  # Let columns grow
-            #                         "minWidth": 200,  # Set minimum column width
-            #                     },  # Default column properties
-            #                     style={"height": "400px", "width": "100%"},  # Style grid dimensions
-            #                     # exportDataAsCsv=True,
-            #                     # csvExportParams={"allColumns":True, "fileName": "filtered_patients_hla_types.csv", "columnSeparator":","},
-            #                 ),
-            #             ], title="HLA Types per Patient - Chromosome Copies Concatinated"),
-            #         ], always_open=True, style={"margin-bottom":"2rem"}),
-
-            #         html.H3("HLA Types per Patient - Chromosome Copies Separated"),
-            #         dbc.Accordion([
-            #             dbc.AccordionItem([
-            #                 dag.AgGrid(
-            #                     id="ag-grid",
-            #                     rowData=[],
-            #                     columnDefs=[],
-            #                     defaultColDef={
-            #                         "resizable": True, "sortable": True, "filter": True, "hide": False,
-            #                         "flex": 1,  # Let columns grow
-            #                         "minWidth": 120,  # Set minimum column width
-            #                     },  # Default column properties
-            #                     style={"height": "400px", "width": "100%"},  # Style grid dimensions
-            #                     # exportDataAsCsv=True,
-            #                     # csvExportParams={"allColumns":True, "fileName": "filtered_patients_hla_types.csv", "columnSeparator":","},
-            #                 ),
-            #             ], title="HLA Types per Patient - Chromosome Copies Separated"),
-            #         ], start_collapsed=True, always_open=True, style={"margin-bottom":"2rem"}),
-            #     ])
-            # ], style={"margin-bottom":"6rem"})
+            dbc.Row([
+                dbc.Col([
+                    html.H3("Upload a whole plate"),
+                    html.P("A typing output file or a .zip, .tar or .tar.gz archive of them, uploaded in resumable chunks and added to the trial workbooks."),
+                    html.Button("Select a file or archive", id="chunked-upload-button", className="download-excel-btn"),
+                    html.Div(id="chunked-upload-status", children=[], style={"margin-bottom":"2rem"}),
+                    dcc.Store(id="chunked-upload-summary"),  # Ingest summary of the last chunked upload, set by assets/chunked_upload.js
+                ])
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    html.H3("QC Drift Monitor"),
+                    dbc.Accordion([
+                        dbc.AccordionItem([
+                            dcc.Dropdown(id="qc-drift-metric", options=list(monitored_metrics), value="AverageCoverage", clearable=False),
+                            html.Div(id="qc-drift-report", children=[]),
+                        ], title="Per-locus QC metrics per batch"),
+                    ], start_collapsed=True, always_open=True, style={"margin-bottom":"2rem"}),
+                ])
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    html.H3("QC Threshold Explorer"),
+                    dbc.Accordion([
+                        dbc.AccordionItem([
+                            html.Div([
+                                html.Label(f"{qc_rule_metrics[rule]} threshold"),
+                                dcc.Slider(
+                                    id=f"qc-sweep-{rule.replace('_', '-')}",
+                                    min=float(qc_sweep_grid[rule][0]),
+                                    max=float(qc_sweep_grid[rule][-1]),
+                                    step=None,  # Snap to the thresholds of the grid
+                                    marks={float(value): (f"{value:g}" if i % 5 == 0 else "") for i, value in enumerate(qc_sweep_grid[rule])},
+                                    value=qc_rules[rule],
+                                    tooltip={"placement": "bottom"},
+                                ),
+                            ]) for rule in qc_rule_metrics
+                        ] + [
+                            html.Div(id="qc-sweep-report", children=[]),
+                        ], title="Pass rates of the cohort under other QC thresholds"),
+                    ], start_collapsed=True, always_open=True, style={"margin-bottom":"2rem"}),
+                ])
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    html.H3("Donor Matching"),
+                    dbc.Accordion([
+                        dbc.AccordionItem([
+                            dcc.Dropdown(id="match-patient", options=[], placeholder="Search for a patient ID"),
+                            dcc.Checklist(
+                                id="match-loci",
+                                options=hla_loci,
+                                value=matching_loci,
+                                inline=True,
+                                inputStyle={"margin-left": "1rem", "margin-right": "0.25rem"},
+                            ),
+                            dcc.RadioItems(
+                                id="match-level",
+                                options=[{"label": "Allele level", "value": "allele"}, {"label": "Antigen level", "value": "antigen"}],
+                                value="allele",
+                                inline=True,
+                                inputStyle={"margin-left": "1rem", "margin-right": "0.25rem"},
+                            ),
+                            dcc.Checklist(
+                                id="match-qc",
+                                options=[{"label": "Only candidates passing QC", "value": "qc_passed"}],
+                                value=["qc_passed"],
+                                inputStyle={"margin-left": "1rem", "margin-right": "0.25rem"},
+                            ),
+                            html.Div([
+                                "Number of matches: ",
+                                dcc.Input(id="match-top-k", type="number", min=1, max=1000, value=10),
+                                html.Button("Search", id="match-button", className="download-excel-btn"),
+                            ]),
+                            html.Div(id="match-results", children=[]),
+                        ], title="Find the best matching patients in the cohort"),
+                    ], always_open=True, style={"margin-bottom":"2rem"}),
+                ])
+            ]),
+            dbc.Row([
+                dbc.Col([
+
+                    html.H3("HLA Types per Patient - Chromosome Copies Concatinated"),
+                    dbc.Accordion([
+                        dbc.AccordionItem([
+                            dag.AgGrid(
+                                id="ag-grid2",
+                                rowData=[],
+                                columnDefs=[],
+                                defaultColDef={
+                                    "resizable": True, "sortable": True, "filter": True, "hide": False,
+                                    "flex": 1,  # Let columns grow
+                                    "minWidth": 200,  # Set minimum column width
+                                },  # Default column properties
+                                style={"height": "400px", "width": "100%"},  # Style grid dimensions
+                                # exportDataAsCsv=True,
+                                # csvExportParams={"allColumns":True, "fileName": "filtered_patients_hla_types.csv", "columnSeparator":","},
+                            ),
+                        ], title="HLA Types per Patient - Chromosome Copies Concatinated"),
+                    ], always_open=True, style={"margin-bottom":"2rem"}),
+
+                    html.H3("HLA Types per Patient - Chromosome Copies Separated"),
+                    dbc.Accordion([
+                        dbc.AccordionItem([
+                            dag.AgGrid(
+                                id="ag-grid",
+                                rowData=[],
+                                columnDefs=[],
+                                defaultColDef={
+                                    "resizable": True, "sortable": True, "filter": True, "hide": False,
+                                    "flex": 1,  # Let columns grow
+                                    "minWidth": 120,  # Set minimum column width
+                                },  # Default column properties
+                                style={"height": "400px", "width": "100%"},  # Style grid dimensions
+                                # exportDataAsCsv=True,
+                                # csvExportParams={"allColumns":True, "fileName": "filtered_patients_hla_types.csv", "columnSeparator":","},
+                            ),
+                        ], title="HLA Types per Patient - Chromosome Copies Separated"),
+                    ], start_collapsed=True, always_open=True, style={"margin-bottom":"2rem"}),
+                ])
+            ], style={"margin-bottom":"6rem"})
         ])
     ]
 
 
 # Callback for upload-data
 @callback(
-    [Output(component_id="loaded-data", component_property="children")],
+    [Output(component_id="loaded-data", component_property="children"),
+    Output(component_id="upload-digest", component_property="data")],
     [Input(component_id="upload-data", component_property="contents")],
     [State(component_id="upload-data", component_property="filename")],
     prevent_initial_call=True,
 )
 def load_data_to_accordion_item1(uploaded_data, filename):
     """  """
-    return [load_data(uploaded_data, filename)]
+    return [load_data(uploaded_data, filename), sample_digest(uploaded_data)]
 
 
 # Callback for the Quality Control Report
 @callback(
     [Output(component_id="qc-report-plot", component_property="children")],
     [Input(component_id="loaded-data", component_property="children")],
-    [State(component_id="upload-data", component_property="filename")],
+    [State(component_id="upload-data", component_property="filename"),
+    State(component_id="upload-digest", component_property="data")],
     prevent_initial_call=True,
 )
-def create_qc_report(data, filename):
+def create_qc_report(data, filename, digest):
     """  """
 
-    # Create report plot
-    report = qc_report(data, filename)
+    # Create report plot, repeat views of a sample are read from the render cache
+    report = qc_report(data, filename, digest)
 
     return [report]
 
 
-# Callback for filtered-data
-@callback(
-    [Output(component_id="filtered-data", component_property="children")],
-    [Input(component_id="loaded-data", component_property="children")],
-    prevent_initial_call=True,
+# Callback for filtered-data, filtered in the browser on the records of the loaded data
+clientside_callback(
+    ClientsideFunction(namespace="hla", function_name="filter_qc"),
+    [Output(component_id="qc-filter-table", component_property="data"),
+    Output(component_id="qc-filter-table", component_property="columns"),
+    Output(component_id="qc-filter-count", component_property="children")],
+    [Input(component_id="loaded-data", component_property="children"),
+    Input(component_id="qc-filter-show", component_property="value"),
+    Input(component_id="qc-filter-loci", component_property="value"),
+    Input(component_id="qc-filter-min-q1", component_property="value"),
+    Input(component_id="qc-filter-min-kmers", component_property="value"),
+    Input(component_id="qc-filter-min-coverage", component_property="value")],
+    [State(component_id="qc-caller-metrics", component_property="data")],
 )
-def create_filter_data(uploaded_data):
-    """  """
-    return [filter_data(uploaded_data)]
 
 
 # Callback for final-report-table
 @callback(
     [Output(component_id="final-report-table", component_property="children")],
     [Input(component_id="loaded-data", component_property="children")],
-    [State(component_id="upload-data", component_property="filename")],
+    [State(component_id="upload-data", component_property="filename"),
+    State(component_id="upload-digest", component_property="data")],
     prevent_initial_call=True,
 )
-def create_final_table(uploaded_data, filename):
+def create_final_table(uploaded_data, filename, digest):
     """  """
-    return [final_table(uploaded_data, filename)]
+    return [final_table(uploaded_data, filename, digest)]
 
 
 @callback(
     [Output(component_id="download-alert", component_property="children"),
-    Output(component_id="download-alert", component_property="color"),
-    Output(component_id="download-alert", component_property="is_open")],
+    Output(component_id="download-alert", component_property="color")],
     [Input(component_id="download-button", component_property="n_clicks")],
     [State(component_id="final-report-table", component_property="children"),
-    State(component_id="upload-data", component_property="filename")],
+    State(component_id="upload-data", component_property="filename"),
+    State(component_id="upload-data", component_property="contents"),
+    State(component_id="upload-digest", component_property="data")],
     prevent_initial_call=True,
 )
-def download_excel(n_clicks, data, filename):
+def download_excel(n_clicks, data, filename, contents, digest):
 
     if n_clicks:
-        list_output = generate_excel_download_link(data, filename, output_path)
+        list_output = generate_excel_download_link(data, filename, output_path, contents, digest)
 
         # Extract data from output
         alert = list_output[0]
         color = list_output[1]
-        # Set whether Alert component is visible or not.
-        is_open = True
 
-        return [alert, color, is_open] 
+        return [alert, color]
 
-        
-# @callback(
-#     [
-#         Output(component_id="ag-grid", component_property="rowData"),
-#         Output(component_id="ag-grid", component_property="columnDefs"),
-#         Output(component_id="ag-grid2", component_property="rowData"),
-#         Output(component_id="ag-grid2", component_property="columnDefs")
-#     ],
-#     [Input(component_id="title1", component_property="children")],
-#     prevent_initial_call=False,
-# )
-# def create_patient_hla_types(trigger):
-#     """  """
-    
-#     # Load data from output_path
-#     rowData1, columnDefs1 = fill_hla_types_per_patient(output_path, folder_in_output_path)  # Returns rowData and columnDefs
-#     rowData2, columnDefs2 = fill_hla_types_per_patient_concatinated(output_path, folder_in_output_path)
-
-#     return  [rowData1, columnDefs1, rowData2, columnDefs2]
 
+# Callback for download-alert, opened in the browser when a new message arrives
+clientside_callback(
+    ClientsideFunction(namespace="hla", function_name="open_alert"),
+    Output(component_id="download-alert", component_property="is_open"),
+    Input(component_id="download-alert", component_property="children"),
+    prevent_initial_call=True,
+)
+
+
+# Callback for qc-drift-report, refreshed when a sample is added
+@callback(
+    [Output(component_id="qc-drift-report", component_property="children")],
+    [Input(component_id="qc-drift-metric", component_property="value"),
+    Input(component_id="download-alert", component_property="children"),
+    Input(component_id="chunked-upload-summary", component_property="data")],
+)
+def create_qc_drift_report(metric, alert, summary):
+    """  """
+    return [qc_drift_report(output_path, metric)]
+
+
+# Callback for qc-sweep-report, refreshed when a sample is added
+@callback(
+    [Output(component_id="qc-sweep-report", component_property="children")],
+    [Input(component_id=f"qc-sweep-{rule.replace('_', '-')}", component_property="value") for rule in qc_rule_metrics]
+    + [Input(component_id="download-alert", component_property="children"),
+    Input(component_id="chunked-upload-summary", component_property="data")],
+)
+def create_qc_sweep_report(*values):
+    """  """
+    rules = dict(zip(qc_rule_metrics, values))
+    return [qc_sweep_report(output_path, rules)]
+
+
+# Callback for the patient options of the donor matching search
+@callback(
+    [Output(component_id="match-patient", component_property="options")],
+    [Input(component_id="match-patient", component_property="search_value")],
+    [State(component_id="match-patient", component_property="value")],
+    prevent_initial_call=True,
+)
+def update_match_patient_options(search_value, value):
+    """  """
+    if not search_value:
+        return [[value] if value else []]
+
+    # Offer the first patients containing the search value
+    patients = load_cohort_index(output_path)["patients"]
+    return [patients[np.char.find(np.char.lower(patients), search_value.lower()) >= 0][:50].tolist()]
+
+
+# Callback for match-results
+@callback(
+    [Output(component_id="match-results", component_property="children")],
+    [Input(component_id="match-button", component_property="n_clicks")],
+    [State(component_id="match-patient", component_property="value"),
+    State(component_id="match-loci", component_property="value"),
+    State(component_id="match-level", component_property="value"),
+    State(component_id="match-top-k", component_property="value"),
+    State(component_id="match-qc", component_property="value")],
+    prevent_initial_call=True,
+)
+def create_match_table(n_clicks, patient_id, loci, level, top_k, qc):
+    """  """
+    return [match_table(patient_id, loci, level, top_k, "qc_passed" in (qc or []))]
+
+        
+# Callback for the cohort grids, fetched by the browser from the snapshots of the current data version.
+# The snapshots are revalidated with their ETag, so reloading an unchanged cohort transfers no rows.
+clientside_callback(
+    ClientsideFunction(namespace="hla", function_name="load_cohort_grids"),
+    [Output(component_id="ag-grid", component_property="rowData"),
+    Output(component_id="ag-grid", component_property="columnDefs"),
+    Output(component_id="ag-grid2", component_property="rowData"),
+    Output(component_id="ag-grid2", component_property="columnDefs")],
+    [Input(component_id="title1", component_property="children"),
+    Input(component_id="download-alert", component_property="children"),
+    Input(component_id="chunked-upload-summary", component_property="data")],
+)
@@ -0,0 +1,290 @@
+# This file contains the chunked, resumable upload of HLA typing output files and archives
+
+# Built in imports
+import os
+import re
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import tarfile
+import zipfile
+
+# Local imports
+from src.utils.output_path import spool_path
+from src.utils.file_lock import locked, write_json_atomic
+from src.utils.ingest_directory import ingest_files
+from src.utils.typing_parsers import is_typing_file
+
+
+# Declare the chunk size bounds, the client picks a size within them
+default_chunk_size = 4 * 1024 * 1024
+max_chunk_size = 16 * 1024 * 1024
+max_upload_size = int(os.environ.get("HLA_MAX_UPLOAD_BYTES", 4 * 1024 ** 3))
+
+# Declare the seconds an upload may sit without a new chunk before its spool files are removed
+upload_max_age = int(os.environ.get("HLA_UPLOAD_MAX_AGE", 24 * 60 * 60))
+
+# Declare the size of the blocks streamed from the request to the spool file
+_block_size = 64 * 1024
+
+_upload_id_pattern = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """ Raised for invalid upload requests, with the HTTP status to answer """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def start_upload(filename, size, chunk_size=None, sha256=None) -> dict:
+    """
+        Creates an upload and its empty spool file.
+
+        Parameters:
+        -----------
+        filename : str
+            The name of the uploaded file, a typing output file, a gzipped one, or a .zip,
+            .tar, .tar.gz or .tgz archive of them.
+
+        size : int
+            The size of the file in bytes.
+
+        chunk_size : int, optional
+            The size of every chunk but the last. Defaults to `default_chunk_size`.
+
+        sha256 : str, optional
+            The hex digest of the whole file, verified when the upload completes.
+
+        Returns:
+        --------
+        status : dict
+            As returned by `upload_status`.
+    """
+    filename = os.path.basename(str(filename or ""))
+    size = int(size)
+    chunk_size = int(chunk_size or default_chunk_size)
+
+    if not filename:
+        raise UploadError("The file name is missing")
+    if not 0 < size <= max_upload_size:
+        raise UploadError(f"The file size must be between 1 and {max_upload_size} bytes")
+    if not 0 < chunk_size <= max_chunk_size:
+        raise UploadError(f"The chunk size must be between 1 and {max_chunk_size} bytes")
+
+    upload_id = uuid.uuid4().hex
+    os.makedirs(spool_path, exist_ok=True)
+    _remove_expired_uploads()
+
+    # Reserve the spool file, chunks are written at their offset in any order
+    with open(_part_path(upload_id), "wb") as f:
+        f.truncate(size)
+
+    manifest = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "size": size,
+        "chunk_size": chunk_size,
+        "chunks": -(-size // chunk_size),
+        "sha256": sha256,
+        "received": [],
+    }
+    write_json_atomic(_manifest_path(upload_id), manifest)
+
+    return upload_status(upload_id)
+
+
+def upload_status(upload_id) -> dict:
+    """ Returns the upload manifest, whose "received" chunk indices let a client resume """
+    manifest = _read_manifest(upload_id)
+    manifest["missing"] = sorted(set(range(manifest["chunks"])) - set(manifest["received"]))
+    return manifest
+
+
+def write_chunk(upload_id, index, stream, sha256) -> dict:
+    """
+        Streams one chunk from the request into the spool file and marks it received.
+
+        The chunk is written at its offset while it is hashed, so it is never held in memory
+        as a whole. A chunk whose length or SHA-256 does not match is not marked received
+        and can be sent again.
+
+        Parameters:
+        -----------
+        upload_id : str
+        index : int
+            The position of the chunk, from 0.
+        stream : file-like
+            The request body.
+        sha256 : str
+            The hex digest of the chunk.
+
+        Returns:
+        --------
+        status : dict
+            As returned by `upload_status`.
+    """
+    manifest = _read_manifest(upload_id)
+    index = int(index)
+
+    if not 0 <= index < manifest["chunks"]:
+        raise UploadError(f"Chunk {index} is out of range, the upload has {manifest['chunks']} chunks")
+    if not sha256:
+        raise UploadError("The chunk checksum is missing")
+
+    offset = index * manifest["chunk_size"]
+    expected = min(manifest["chunk_size"], manifest["size"] - offset)
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(_part_path(upload_id), "r+b") as f:
+        f.seek(offset)
+        while written <= expected:
+            block = stream.read(min(_block_size, expected + 1 - written))
+            if not block: break
+            if written + len(block) <= expected:
+                f.write(block)
+            digest.update(block)
+            written += len(block)
+
+    if written != expected:
+        raise UploadError(f"Chunk {index} has {written} bytes, expected {expected}")
+    if digest.hexdigest() != sha256.lower():
+        raise UploadError(f"Chunk {index} does not match its checksum", status=422)
+
+    # Mark the chunk received, other workers may write other chunks of the same upload
+    with locked(_manifest_path(upload_id)):
+        manifest = _read_manifest(upload_id)
+        manifest["received"] = sorted(set(manifest["received"]) | {index})
+        write_json_atomic(_manifest_path(upload_id), manifest)
+
+    return upload_status(upload_id)
+
+
+def complete_upload(upload_id, output_path) -> dict:
+    """
+        Verifies a fully received upload and ingests it from the spool file.
+
+        Archives are read member by member, so only one typing output file is in memory at a
+        time, and parsed in the calling process. The cohort index is published in the
+        background instead of before the response. The samples of the upload form one batch
+        of the QC drift monitor. The spool file is removed once ingested, along with the
+        spool files of uploads abandoned for longer than `upload_max_age`.
+
+        Parameters:
+        -----------
+        upload_id : str
+        output_path : str
+            The directory where the trial Excel files and the sample index are stored.
+
+        Returns:
+        --------
+        summary : dict
+            As returned by `ingest_directory.ingest_files`.
+    """
+    status = upload_status(upload_id)
+    if status["missing"]:
+        raise UploadError(f"{len(status['missing'])} chunks are missing", status=409)
+
+    part_path = _part_path(upload_id)
+    if status["sha256"]:
+        digest = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        if digest.hexdigest() != status["sha256"].lower():
+            raise UploadError("The file does not match its checksum", status=422)
+
+    # Parsed in the calling process, a pool per web worker would oversubscribe the server,
+    # and the cohort index is published after the response
+    summary = ingest_files(
+        _spooled_files(part_path, status["filename"]), output_path,
+        max_workers=1, batch_id=_batch_id(status), background_publish=True,
+    )
+
+    for path in (part_path, _manifest_path(upload_id), _manifest_path(upload_id) + ".lock"):
+        if os.path.exists(path):
+            os.remove(path)
+    _remove_expired_uploads()
+
+    return summary
+
+
+def _remove_expired_uploads():
+    """ Removes the spool files of uploads that received nothing for longer than `upload_max_age` """
+    uploads = {}
+    for file_name in os.listdir(spool_path):
+        upload_id = file_name.split(".")[0]
+        if not _upload_id_pattern.match(upload_id): continue
+        try:
+            mtime = os.stat(os.path.join(spool_path, file_name)).st_mtime
+        except FileNotFoundError:
+            continue
+        uploads.setdefault(upload_id, []).append((file_name, mtime))
+
+    # An upload is as recent as its newest file, every chunk rewrites the manifest
+    expiry = time.time() - upload_max_age
+    for files in uploads.values():
+        if max(mtime for _, mtime in files) >= expiry: continue
+        for file_name, _ in files:
+            try:
+                os.remove(os.path.join(spool_path, file_name))
+            except FileNotFoundError:
+                pass  # Removed by another worker
+
+
+def _batch_id(status) -> str:
+    """ Returns the QC monitor batch of an upload, its file name and the start of its ID """
+    return f"{status['filename']} {status['upload_id'][:8]}"
+
+
+def _spooled_files(part_path, filename):
+    """ Yields the name and content of the typing output files in a spooled upload """
+    name = filename.lower()
+
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(part_path) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not is_typing_file(member.filename): continue
+                yield os.path.basename(member.filename), archive.read(member)
+
+    elif name.endswith((".tar", ".tar.gz", ".tgz")):
+        with tarfile.open(part_path, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not is_typing_file(member.name): continue
+                yield os.path.basename(member.name), archive.extractfile(member).read()
+
+    elif name.endswith(".gz"):
+        with gzip.open(part_path, "rb") as f:
+            yield filename[:-len(".gz")], f.read()
+
+    else:
+        with open(part_path, "rb") as f:
+            yield filename, f.read()
+
+
+def _read_manifest(upload_id) -> dict:
+    """ Returns the manifest of an upload """
+    try:
+        with open(_manifest_path(upload_id), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError(f"Unknown upload '{upload_id}'", status=404)
+
+
+def _manifest_path(upload_id) -> str:
+    return os.path.join(spool_path, f"{_checked(upload_id)}.json")
+
+
+def _part_path(upload_id) -> str:
+    return os.path.join(spool_path, f"{_checked(upload_id)}.part")
+
+
+def _checked(upload_id) -> str:
+    """ Returns the upload ID, refusing anything that is not one, so it is safe in a path """
+    if not _upload_id_pattern.match(str(upload_id)):
+        raise UploadError(f"Unknown upload '{upload_id}'", status=404)
+    return upload_id
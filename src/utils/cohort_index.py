@@ -0,0 +1,222 @@
+# This file contains the read-only cohort index, built once per data version and memory mapped by every worker
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Built in imports
+import os
+import json
+import hashlib
+import logging
+import threading
+
+# Local imports
+from src.utils.output_path import cache_path
+from src.utils.cohort_table import load_cohort_table
+from src.utils.hla_matching import encode_cohort
+from src.utils.qc_metrics import load_qc_metrics, qc_metric_columns
+from src.utils.sample_index import data_version
+from src.utils.mmap_bundle import write_bundle, read_bundle
+from src.utils.file_lock import locked, write_json_atomic
+
+
+logger = logging.getLogger(__name__)
+
+# Declare the folder of the indexes, one subfolder per output path with one file per data version
+cohort_index_path = os.path.join(cache_path, "cohort_index")
+
+# Declare the file naming the published version, swapped atomically when a new version is built
+pointer_file_name = "current.json"
+
+# Declare the layout of the index files, indexes of another layout are built again
+index_format = 2
+
+# Declare the attempts at mapping an index that is removed for a newer version meanwhile
+index_retries = 3
+
+# Indexes attached by this process, per output path
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Output paths published by a thread of this process, and the ones changed again meanwhile
+_publishing = set()
+_republish = set()
+_publishing_lock = threading.Lock()
+
+
+def load_cohort_index(output_path) -> dict:
+    """
+        Returns the published cohort index, memory mapped read-only.
+
+        The index is published when samples are ingested (see `publish_cohort_index`), so a
+        request only maps the published file. Every worker maps the same file, so the pages
+        are shared instead of each worker holding its own copy, and a new worker attaches
+        without reading any workbook or QC metrics file. An index older than the data version, e.g. after the
+        workbooks were edited outside the app, is served while a new one is published in the
+        background. It is only built in the request when none was ever published.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory path where the trial Excel files are located.
+
+        Returns:
+        --------
+        index : dict
+            The encoded cohort of `hla_matching.encode_cohort` ("patients", "loci", "allele",
+            "antigen" and "qc_passed") and the recorded QC metrics ("qc_metrics", one row per
+            call and a column per `qc_metric_columns`, with the "qc_locus" and "qc_trial" codes
+            of the calls into "qc_loci" and "qc_trials"), as read-only arrays, with "version",
+            the data version the index was built from.
+    """
+    version = data_version(output_path)
+    with _indexes_lock:
+        index = _indexes.get(output_path)
+    if index is not None and index["version"] >= version:
+        return index
+
+    folder = os.path.join(cohort_index_path, _output_key(output_path))
+    pointer_path = os.path.join(folder, pointer_file_name)
+
+    # A newer version may be published and an older file removed between reading the pointer
+    # and mapping its file, so a missing file is retried with the pointer read again
+    for attempt in range(index_retries):
+        pointer = _read_pointer(pointer_path)
+        if pointer is None or pointer.get("format") != index_format:
+            pointer = publish_cohort_index(output_path)
+        try:
+            arrays, meta = read_bundle(os.path.join(folder, pointer["file"]))
+            break
+        except FileNotFoundError:
+            if attempt == index_retries - 1:
+                raise
+
+    index = dict(
+        arrays, loci=meta["loci"], version=meta["version"],
+        qc_metric_columns=meta["qc_metric_columns"], qc_loci=meta["qc_loci"], qc_trials=meta["qc_trials"],
+    )
+    if index["version"] < version:
+        publish_in_background(output_path)
+
+    with _indexes_lock:
+        current = _indexes.get(output_path)
+        if current is None or current["version"] < index["version"]:
+            _indexes[output_path] = index
+        return _indexes[output_path]
+
+
+def publish_cohort_index(output_path, max_workers=1) -> dict:
+    """
+        Builds the index of the current data version, unless it is published, and swaps the pointer to it.
+
+        Called after samples are ingested, see `publish_in_background` for the web requests.
+        The build runs under a lock, so concurrent workers build a version only once, and
+        only the workbooks changed since the last build are read again (see `cohort_table`). The file of the previous version is kept for workers that
+        read the pointer before the swap, and older files are removed. Workers that mapped a
+        removed file keep reading it, its pages are freed when the last mapping is closed.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory path where the trial Excel files are located.
+
+        max_workers : int, optional
+            The number of processes used to read the changed workbooks. Defaults to 1, reading
+            them in the calling process, as web workers must not start a process pool.
+
+        Returns:
+        --------
+        pointer : dict
+            "version" and "file", the bundle file name in the index folder of the output path.
+    """
+    folder = os.path.join(cohort_index_path, _output_key(output_path))
+    pointer_path = os.path.join(folder, pointer_file_name)
+    os.makedirs(folder, exist_ok=True)
+
+    with locked(pointer_path):
+        version = data_version(output_path)
+        previous = _read_pointer(pointer_path)
+        if previous is not None and previous.get("format") == index_format and previous["version"] >= version:
+            return previous
+
+        encoded = encode_cohort(load_cohort_table(output_path, max_workers))
+
+        # The QC metrics are recorded before the data version is bumped, so they match the workbooks
+        metrics = load_qc_metrics(output_path)
+        locus_codes, qc_loci = pd.factorize(metrics["LOCUS"], sort=True)
+        trial_codes, qc_trials = pd.factorize(metrics["TRIAL_ID"], sort=True)
+
+        file_name = f"{version}.bin"
+        write_bundle(os.path.join(folder, file_name), {
+            "patients": encoded["patients"],
+            "allele": encoded["allele"],
+            "antigen": encoded["antigen"],
+            "qc_passed": encoded["qc_passed"],
+            "qc_metrics": metrics[qc_metric_columns].to_numpy(dtype=np.float64),
+            "qc_locus": locus_codes.astype(np.int32),
+            "qc_trial": trial_codes.astype(np.int32),
+        }, meta={
+            "version": version,
+            "loci": encoded["loci"],
+            "qc_metric_columns": qc_metric_columns,
+            "qc_loci": [str(locus) for locus in qc_loci],
+            "qc_trials": [str(trial) for trial in qc_trials],
+        })
+
+        pointer = {"version": version, "file": file_name, "format": index_format}
+        write_json_atomic(pointer_path, pointer)
+
+        # Keep the current and the previous version
+        kept = previous["version"] if previous is not None else version
+        for name in os.listdir(folder):
+            stem = name.split(".")[0]
+            if name.endswith(".bin") and stem.isdigit() and int(stem) < kept:
+                os.remove(os.path.join(folder, name))
+
+    return pointer
+
+
+def publish_in_background(output_path):
+    """
+        Publishes the index of the current data version in a thread, so a request does not wait for the build.
+
+        Calls are debounced per output path: while a build runs, further calls only mark the
+        data as changed again, and one more build follows the running one to pick up all of them.
+    """
+    with _publishing_lock:
+        if output_path in _publishing:
+            _republish.add(output_path)
+            return
+        _publishing.add(output_path)
+
+    threading.Thread(target=_publish_until_current, args=(output_path,), daemon=True).start()
+
+
+def _publish_until_current(output_path):
+    """ Publishes the index until no further change was announced during the build """
+    while True:
+        try:
+            publish_cohort_index(output_path)
+        except Exception as e:
+            logger.warning("Could not publish the cohort index: %s", e)
+
+        with _publishing_lock:
+            if output_path not in _republish:
+                _publishing.discard(output_path)
+                return
+            _republish.discard(output_path)
+
+
+def _read_pointer(pointer_path):
+    """ Returns the published version and file, or None before the first build """
+    try:
+        with open(pointer_path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _output_key(output_path) -> str:
+    """ Returns a folder name identifying the output path """
+    return hashlib.sha256(os.path.abspath(output_path).encode("utf-8")).hexdigest()[:16]
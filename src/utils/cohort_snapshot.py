@@ -0,0 +1,133 @@
+# This file contains the cohort views materialized once per data version, ready to serve
+
+# Built in imports
+import os
+import json
+import gzip
+import time
+import shutil
+import hashlib
+import threading
+
+# Local imports
+from src.utils.output_path import cache_path
+from src.utils.cohort_table import cohort_view, cohort_errors, cohort_views, cohort_groupings
+from src.utils.sample_index import data_version
+from src.utils.file_lock import locked
+
+
+# Declare the folder of the snapshots, one subfolder per output path and data version
+snapshot_path = os.path.join(cache_path, "cohort")
+
+# Declare the seconds the snapshots of an older version are kept, for workers still reading them
+snapshot_grace_period = 60
+
+# Declare the attempts at reading a snapshot that is removed for a newer version meanwhile
+snapshot_retries = 3
+
+# Snapshots per output path, view and grouping, kept until the data version changes
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cohort_snapshot(output_path, view, grouping="allele") -> dict:
+    """
+        Returns a cohort view as a gzip compressed JSON payload, built once per data version.
+
+        The first request after an ingestion builds the view from the cohort table and
+        stores it on disk, under a lock so concurrent workers build it only once. Later
+        requests in any worker read the stored payload, and requests in the same process
+        get it from memory. Snapshots of older versions are removed when a new one is built,
+        once they are older than `snapshot_grace_period`. The data version also changes when
+        the workbooks are edited outside the app (see `sample_index.data_version`).
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory path where the trial Excel files are located.
+
+        view : str
+            One of `cohort_table.cohort_views`.
+
+        grouping : str
+            One of `cohort_table.cohort_groupings`.
+
+        Returns:
+        --------
+        snapshot : dict
+            "version", "etag" (the hash of the payload) and "body", the gzip compressed JSON
+            {"version": ..., "rowData": [...], "columnDefs": [...], "errors": [...]}, where the
+            errors are the workbooks that could not be read (see `cohort_table.cohort_errors`).
+    """
+    if view not in cohort_views:
+        raise ValueError(f"Unknown cohort view '{view}', expected one of {cohort_views}")
+    if grouping not in cohort_groupings:
+        raise ValueError(f"Unknown cohort grouping '{grouping}', expected one of {cohort_groupings}")
+
+    key = (output_path, view, grouping)
+    folder = os.path.join(snapshot_path, _output_key(output_path))
+
+    # Another worker may publish a newer version between reading the version and opening its
+    # snapshot, and eventually remove the older one, so a missing snapshot is retried
+    for attempt in range(snapshot_retries):
+        version = data_version(output_path)
+
+        with _cache_lock:
+            snapshot = _cache.get(key)
+        if snapshot is not None and snapshot["version"] == version:
+            return snapshot
+
+        file_path = os.path.join(folder, str(version), f"{view}-{grouping}.json.gz")
+        try:
+            if not os.path.exists(file_path):
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with locked(file_path):
+                    if not os.path.exists(file_path):
+                        _write_snapshot(file_path, output_path, view, grouping, version)
+                        _remove_older_versions(folder, version)
+
+            with open(file_path, "rb") as f:
+                body = f.read()
+            break
+        except FileNotFoundError:
+            if attempt == snapshot_retries - 1:
+                raise
+
+    snapshot = {"version": version, "etag": hashlib.sha256(body).hexdigest()[:32], "body": body}
+    with _cache_lock:
+        _cache[key] = snapshot
+
+    return snapshot
+
+
+def _write_snapshot(file_path, output_path, view, grouping, version):
+    """ Builds a view and writes it compressed to a temporary file that is swapped in """
+    cohort = cohort_view(output_path, view, grouping=grouping)
+    payload = {
+        "version": version,
+        "rowData": cohort.to_dict("records") if not cohort.empty else [],
+        "columnDefs": [{"field": x, } for x in cohort.columns] if not cohort.empty else [],
+        "errors": cohort_errors(output_path),
+    }
+
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(gzip.compress(json.dumps(payload).encode("utf-8"), mtime=0))
+    os.replace(tmp_path, file_path)
+
+
+def _remove_older_versions(folder, version):
+    """ Removes the snapshot folders of versions before `version` that are older than `snapshot_grace_period` """
+    expiry = time.time() - snapshot_grace_period
+    for name in os.listdir(folder):
+        if not name.isdigit() or int(name) >= version: continue
+        try:
+            if os.stat(os.path.join(folder, name)).st_mtime < expiry:
+                shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+        except FileNotFoundError:
+            pass  # Removed by another worker
+
+
+def _output_key(output_path) -> str:
+    """ Returns a folder name identifying the output path """
+    return hashlib.sha256(os.path.abspath(output_path).encode("utf-8")).hexdigest()[:16]
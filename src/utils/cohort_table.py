@@ -0,0 +1,207 @@
+# This file contains the long-format cohort table and the views derived from it
+
+# Third party imports
+import pandas as pd
+
+# Built in imports
+import os
+import threading
+
+# Local imports
+from src.utils.map_workbook_sheets import map_workbook_sheets
+from src.utils.hla_loci import hla_loci, chromosome_copies, normalize_locus
+from src.utils.imgt_lookup import annotate_alleles
+
+
+# Declare the columns of the long-format cohort table
+cohort_columns = ["PATIENT_ID", "LOCUS", "CLASS", "ALLELE", "CHROMOSOME_COPY", "QC_PASSED"]
+
+# Declare the views that can be derived from the cohort table
+cohort_views = ["separated", "concatenated"]
+
+# Declare how the alleles can be grouped in the views
+cohort_groupings = ["allele", "p_group", "serology"]
+
+# Cohort tables per output path, reused until a workbook in the folder changes
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_cohort_table(output_path, max_workers=None) -> pd.DataFrame:
+    """
+        Returns the long-format cohort table of every trial workbook in `output_path`.
+
+        The table has one row per patient, locus and chromosome copy, with the columns in
+        `cohort_columns`. It is parsed once and cached in the process, and when a workbook
+        in the folder is added, removed or modified only that workbook is parsed again.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory path where the trial Excel files are located.
+
+        max_workers : int, optional
+            The number of processes used to read the workbooks.
+
+        Returns:
+        --------
+        cohort : pd.DataFrame
+            The long-format cohort table. Loci are named without the 'HLA-' prefix and
+            QC_PASSED is a boolean.
+    """
+    return _cache_entry(output_path, max_workers)["cohort"]
+
+
+def cohort_errors(output_path, max_workers=None) -> list:
+    """ Returns the {"file": ..., "error": ...} reports of the workbooks left out of the cached cohort table """
+    return _cache_entry(output_path, max_workers)["errors"]
+
+
+def cohort_view(output_path, view, max_workers=None, grouping="allele") -> pd.DataFrame:
+    """
+        Returns a wide view of the cohort table, one row per patient.
+
+        Views are computed from the cached cohort table the first time they are requested
+        and reused until the cohort changes.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory path where the trial Excel files are located.
+
+        view : str
+            "separated" for one column per locus and chromosome copy (e.g. A_1, A_2),
+            "concatenated" for one column per locus with both copies joined by "_".
+
+        max_workers : int, optional
+            The number of processes used to read the workbooks.
+
+        grouping : str
+            "allele" to show the alleles as reported, "p_group" or "serology" to show their
+            P group or serological equivalent from the IMGT/HLA lookup (see `imgt_lookup`).
+
+        Returns:
+        --------
+        view : pd.DataFrame
+            The PATIENT_ID column followed by the allele columns.
+    """
+    if view not in cohort_views:
+        raise ValueError(f"Unknown cohort view '{view}', expected one of {cohort_views}")
+    if grouping not in cohort_groupings:
+        raise ValueError(f"Unknown cohort grouping '{grouping}', expected one of {cohort_groupings}")
+
+    entry = _cache_entry(output_path, max_workers)
+    views = entry["views"]
+
+    if (view, grouping) not in views:
+        wide = _wide_alleles(_grouped(entry["cohort"], grouping))
+        if view == "separated":
+            views[(view, grouping)] = separated_view(wide)
+        else:
+            views[(view, grouping)] = concatenated_view(wide)
+
+    return views[(view, grouping)]
+
+
+def separated_view(wide) -> pd.DataFrame:
+    """ Returns the alleles with one column per locus and chromosome copy """
+    separated = wide.copy()
+    separated.columns = [f"{locus}_{copy}" for locus, copy in wide.columns]
+    return _with_patient_id(separated)
+
+
+def concatenated_view(wide) -> pd.DataFrame:
+    """ Returns the alleles with both chromosome copies joined by "_" in one column per locus """
+    # Join every locus in one vectorized pass, a missing copy leaves the locus empty
+    concatenated = wide.xs(1, axis=1, level=1) + "_" + wide.xs(2, axis=1, level=1)
+    return _with_patient_id(concatenated)
+
+
+def sheet_to_long_format(sheet_name, sheet_rows):
+    """ Returns the report rows of one trial sheet as cohort table rows, keyed by the sheet name """
+    rows = []
+    for row in sheet_rows:
+        rows.append({
+            "PATIENT_ID": sheet_name,
+            "LOCUS": normalize_locus(row.get("LOCUS")),
+            "CLASS": row.get("CLASS"),
+            "ALLELE": row.get("ALLELE"),
+            "CHROMOSOME_COPY": row.get("CHROMOSOME_COPY"),
+            "QC_PASSED": str(row.get("QC_PASSED")) == "True",  # Stored as text in the workbook
+        })
+    return rows
+
+
+def _cache_entry(output_path, max_workers):
+    """ Returns the cache entry of the output path, parsing only the workbooks that were added or changed """
+    file_paths = _workbook_paths(output_path)
+    signature = tuple((path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in file_paths)
+
+    with _cache_lock:
+        entry = _cache.get(output_path)
+        if entry is None or entry["signature"] != signature:
+            # Keep the rows of the unchanged workbooks, removed workbooks are dropped
+            previous = entry["files"] if entry is not None else {}
+            files = {path: previous[path] for path, *stat in signature if path in previous and previous[path]["stat"] == stat}
+
+            changed = [path for path, *stat in signature if path not in files]
+            sheets, errors = map_workbook_sheets(changed, sheet_to_long_format, max_workers=max_workers, by_file=True)
+            for path, *stat in signature:
+                if path in files: continue
+                rows = [row for sheet in sheets.get(path, []) for row in sheet]
+                files[path] = {
+                    "stat": stat,
+                    "cohort": pd.DataFrame(rows, columns=cohort_columns),
+                    "errors": [error for error in errors if error["file"] == os.path.basename(path)],
+                }
+
+            # Concatenate in file order, so the table does not depend on which workbooks changed
+            cohorts = [files[path]["cohort"] for path in file_paths if not files[path]["cohort"].empty]
+            cohort = pd.concat(cohorts, ignore_index=True) if cohorts else pd.DataFrame(columns=cohort_columns)
+            errors = [error for path in file_paths for error in files[path]["errors"]]
+            entry = {"signature": signature, "files": files, "cohort": cohort, "views": {}, "errors": errors}
+            _cache[output_path] = entry
+
+    return entry
+
+
+def _workbook_paths(output_path):
+    """ Returns the sorted paths of the Excel files in the folder, leaving out hidden files being written """
+    return sorted(
+        os.path.join(output_path, file_name) for file_name in os.listdir(output_path)
+        if (file_name.endswith(".xlsx") or file_name.endswith(".xls")) and not file_name.startswith(".")
+    )
+
+
+def _wide_alleles(cohort) -> pd.DataFrame:
+    """ Returns the alleles pivoted to one row per patient and a (locus, copy) column per allele """
+    patients = cohort["PATIENT_ID"].drop_duplicates()
+    columns = pd.MultiIndex.from_product([hla_loci, chromosome_copies], names=["LOCUS", "CHROMOSOME_COPY"])
+
+    # Keep the first allele reported per locus and copy
+    alleles = cohort.drop_duplicates(["PATIENT_ID", "LOCUS", "CHROMOSOME_COPY"])
+    alleles = alleles[alleles["LOCUS"].isin(hla_loci) & alleles["CHROMOSOME_COPY"].isin(chromosome_copies)]
+
+    wide = alleles.pivot(index="PATIENT_ID", columns=["LOCUS", "CHROMOSOME_COPY"], values="ALLELE")
+    return wide.reindex(index=patients, columns=columns).astype("string")
+
+
+def _grouped(cohort, grouping) -> pd.DataFrame:
+    """ Returns the cohort table with the alleles replaced by their group, looking up each distinct allele once """
+    if grouping == "allele":
+        return cohort
+
+    alleles = cohort["ALLELE"].dropna().unique()
+    groups = annotate_alleles(alleles)[grouping.upper()].values
+
+    grouped = cohort.copy()
+    grouped["ALLELE"] = grouped["ALLELE"].map(dict(zip(alleles, groups)))
+    return grouped
+
+
+def _with_patient_id(view) -> pd.DataFrame:
+    """ Returns the view with PATIENT_ID as the first column and missing alleles as None """
+    view = view.astype(object).where(view.notna(), None)
+    view.index.name = "PATIENT_ID"
+    view.columns.name = None
+    return view.reset_index()
@@ -5,60 +5,167 @@ import pandas as pd
 
 # Built in imports
 import os
+import json
+import shutil
+import logging
 from openpyxl import Workbook
 
-def generate_excel_download_link(report, filename, output_path):
+# Local imports
+from src.utils.load_data import decode_contents
+from src.utils.typing_parsers import parse_typing, detect_caller, sample_name, header_size
+from src.utils.sample_index import content_hash, load_sample_index, ingest_status, record_samples
+from src.utils.qc_monitor import update_qc_monitor, upload_batch_id
+from src.utils.qc_metrics import record_qc_metrics
+from src.utils.file_lock import locked
+from src.utils.genotype_fingerprint import sample_genotype, load_fingerprint_index, check_sample, record_genotypes
+from src.utils.cohort_index import publish_in_background
+
+
+logger = logging.getLogger(__name__)
+
+def generate_excel_download_link(report, filename, output_path, contents=None, digest=None):
     """
     Adds a sheet to an existing Excel file or creates a new file and adds the sheet.
-    
+
+    Samples are identified by the hash of their content. Re-adding identical content is a
+    no-op, and changed content replaces the sheet of the previous version instead of
+    adding a renamed duplicate. The genotype is checked against the fingerprint index, and a
+    possible sample swap or duplicate patient is reported in the message.
+
     Parameters:
         report (dict): The data to write, in the format of a Dash DataTable's `data` property.
         filename (str): The base filename to extract sample and trial IDs.
         output_path (str): The directory where the Excel file is stored or created.
+        contents (str): The uploaded file as a dcc.Upload data URL. When missing, the report
+            data is hashed instead.
+        digest (str): The content hash of the upload, when already computed (see `load_data.sample_digest`).
 
     Returns:
-        str: Success message or error message.
+        list: The success or error message and the alert color, "danger" for errors and
+            "warning" for a written sample with genotype check findings.
     """
     try:
-        # Extract sample and trial IDs
-        sample_id = str(filename).split("_R1_")[0]
+        # Extract sample and trial IDs, removing the file name suffix of callers other than HLA-LA
+        content = decode_contents(contents) if contents is not None else None
+        caller = detect_caller(filename, content[:header_size]) if content is not None else None
+        sample_id = sample_name(filename, caller)
         trial_id = sample_id.split("_")[0]
-        
+
         # Declare file_path
         file_path = os.path.join(output_path, f"{trial_id}_hla_typing_report.xlsx")
 
         # Convert report from dict to DataFrame
         report_df = pd.DataFrame.from_dict(report["props"]["data"])
-        
-        # Validate output path
-        if not os.path.exists(file_path):
-            # Set the full file path
-            file_path = os.path.join(output_path, f"{trial_id}_hla_typing_report.xlsx")
-        
+
+        # Hash the sample content, unless the upload was already hashed
+        if digest is None and content is not None:
+            digest = content_hash(content)
+        elif digest is None:
+            digest = content_hash(json.dumps(report["props"]["data"], sort_keys=True))
+
     except Exception as e:
         file_path=""
-        color="warning"  # Set color of alert label
+        color="danger"  # Set color of alert label
         return [f"An error occurred: {str(e)}", color]
-    
+
     try:
-        # If the file path exists
-        if os.path.exists(file_path):
-            # Add sheet to existing file
-            with pd.ExcelWriter(file_path, engine='openpyxl', mode='a') as writer:
-                report_df.to_excel(writer, sheet_name=sample_id, index=False)
-            color="success"  # Set color of alert label
+        # Skip the sample if this content was already added
+        status = ingest_status(load_sample_index(output_path), sample_id, digest)
+        if status == "unchanged" and os.path.exists(file_path):
+            color="info"  # Set color of alert label
+            return [f"The sheet '{sample_id}' is already up to date in the file: {file_path}", color]
+
+        # Check the genotype against the samples already ingested
+        genotype = sample_genotype(report_df)
+        flags = check_sample(load_fingerprint_index(output_path), sample_id, genotype)
+
+        write_report_sheets(file_path, {sample_id: report_df})
+        record_genotypes(output_path, {sample_id: genotype})
+
+        # Add the sample's QC metrics to the QC metrics store before the data version is
+        # bumped, so the cohort index published for the version includes them
+        data = None
+        if content is not None:
+            try:
+                data = parse_typing(content, filename, caller)
+            except Exception as e:
+                logger.warning("Could not read the QC metrics of %s: %s", sample_id, e)
+        if data is not None:
+            try:
+                record_qc_metrics(output_path, trial_id, sample_id, data)
+            except Exception as e:
+                logger.warning("Could not record the QC metrics of %s: %s", sample_id, e)
+
+        record_samples(output_path, {sample_id: {"sha256": digest, "workbook": os.path.basename(file_path), "sheet": sample_id}})
+        color="success"  # Set color of alert label
+
+        # Add new samples to the drift monitor, which keeps the first metrics of a replaced
+        # sample rather than counting it twice
+        if data is not None and status == "new":
+            try:
+                update_qc_monitor(output_path, upload_batch_id(trial_id), trial_id, data)
+            except Exception as e:
+                logger.warning("Could not update the QC monitor with %s: %s", sample_id, e)
+
+        # Publish the cohort index of the new data version, read by the donor matching, without
+        # holding up the response, uploads in quick succession are published together
+        publish_in_background(output_path)
+
+        if status == "changed":
+            message = f"Success! The sheet '{sample_id}' was replaced in the file: {file_path}"
         else:
-            # Create a new file. This will create a default first sheet.
-            wb = Workbook()
-            wb.save(file_path)
-
-            # Add new sheet
-            with pd.ExcelWriter(file_path, engine='openpyxl', mode='a') as writer:
-                report_df.to_excel(writer, sheet_name=sample_id, index=False)
-            color="success"  # Set color of alert label
-        
-        return [f"Success! The sheet '{sample_id}' was added to the file: {file_path}", color]
+            message = f"Success! The sheet '{sample_id}' was added to the file: {file_path}"
+
+        # Warn about possible sample swaps and duplicate patients
+        if flags:
+            color="warning"  # Set color of alert label
+            message += "".join(f" {_flag_message(flag)}" for flag in flags)
+
+        return [message, color]
     except Exception as e:
-        color="warning"  # Set color of alert label
+        color="danger"  # Set color of alert label
         return [f"An error occurred: {str(e)}", color]
-    
+
+
+def write_report_sheets(file_path, reports):
+    """
+    Writes report sheets to an Excel file in one pass, creating the file if needed.
+
+    Existing sheets with the same name are replaced, never renamed. Writers of the same
+    file are serialized, and the sheets are written to a copy that is swapped in, so
+    concurrent uploads never lose each other's sheets and readers never see a partial file.
+
+    Parameters:
+        file_path (str): The Excel file to write to.
+        reports (dict): Sheet name -> report DataFrame.
+    """
+    # Hidden, so the cohort table does not read it as a trial workbook
+    tmp_path = os.path.join(os.path.dirname(file_path), f".{os.path.basename(file_path)}.{os.getpid()}.tmp.xlsx")
+
+    with locked(file_path):
+        # Copy the file, or create a new one. This will create a default first sheet.
+        if os.path.exists(file_path):
+            shutil.copyfile(file_path, tmp_path)
+        else:
+            wb = Workbook()
+            wb.save(tmp_path)
+
+        # Add the sheets, replacing previous versions of the samples
+        try:
+            with pd.ExcelWriter(tmp_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+                for sheet_name, report_df in reports.items():
+                    report_df.to_excel(writer, sheet_name=sheet_name, index=False)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _flag_message(flag) -> str:
+    """ Returns a genotype check finding as a sentence """
+    loci = ", ".join(flag["discordant_loci"])
+    if flag["kind"] == "swap":
+        return f"Possible sample swap: the genotype differs from the earlier sample '{flag['other']}' at {loci}."
+    if flag["kind"] == "duplicate":
+        return f"Possible duplicate patient: the genotype is identical to '{flag['other']}'."
+    return f"Possible duplicate patient: the genotype matches '{flag['other']}' except at {loci}."
@@ -0,0 +1,48 @@
+# This file contains the helpers used to share small state files between workers
+
+# Built in imports
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # Not available on Windows, where the locks are process local only
+except ImportError:
+    fcntl = None
+
+
+# Thread locks per locked path, so sections locking different paths run concurrently
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def locked(path):
+    """ Holds an exclusive lock on `path` across threads and, where supported, processes """
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+
+        with open(f"{path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _thread_lock(path) -> threading.RLock:
+    """ Returns the thread lock of a path, created on first use """
+    key = os.path.abspath(path)
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(key, threading.RLock())
+
+
+def write_json_atomic(path, data, **kwargs):
+    """ Writes `data` as JSON to a temporary file and swaps it in, so readers never see a partial file """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
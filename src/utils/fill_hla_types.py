@@ -46,9 +46,6 @@ def fill_hla_types_per_patient(output_path, folder_in_output_path):
         - The output Excel file will be saved in the specified subfolder under `output_path`.
     """
 
-    # Load data
-    output_path = output_path
-
     # Declare empty list
     rows = []
 
@@ -1,51 +1,81 @@
 # This file contains the filter_data function
 
 # Third party imports
-import pandas as pd
-from dash import dash_table
+from dash import dcc, html, dash_table
+import dash_bootstrap_components as dbc
 
-def filter_data(data) -> dash_table.DataTable:
-    """  """
-    # Extract the data from the data object and set datatypes
-    data = pd.DataFrame.from_dict(data["props"]["data"])
-    data["Chromosome"] = data["Chromosome"].astype(int)
-    data["Locus"] = data["Locus"].astype(str)
-    data["AverageCoverage"] = data["AverageCoverage"].astype(float)
-    data["Q1"] = data["Q1"].astype(float)
-    data["Q2"] = data["Q2"].astype(float)
-    data["proportionkMersCovered"] = data["proportionkMersCovered"].astype(float)
+# Local imports
+from src.utils.qc_rules import qc_rules
+from src.utils.hla_loci import hla_loci
+from src.utils.typing_parsers import caller_metrics
 
-    # Further analysis on the HLA types in question
+def filter_data() -> html.Div:
+    """
+        Returns the QC filter controls and the table of the filtered loaded data.
 
-    min_average_coverage = 2  # ambiguous value
-
-    # Show data where (Q1 is not 1) AND (proportionkMersCovered is not 1)
-    failed_qc = data[ (data["Q1"]!=float(1.0)) | (data["proportionkMersCovered"]!=int(1)) ].copy()
-    failed_qc["QC_PASSED"] = (failed_qc["Q1"].astype(float) == float(1.0)) & (failed_qc["AverageCoverage"].astype(float) > min_average_coverage)  # If Q1 is not 1 and if AverageCoverage < 2, set False
-    failed_qc = failed_qc[failed_qc["QC_PASSED"]==False]  # Filter to contain only the HLA types to fail the QC
-    
-    return dash_table.DataTable(
-        data=failed_qc.to_dict("records"),
-        style_table={
-            'width': '100%',
-            'height': '100%',
-            'borderRadius':'0.5rem',
-            'overflowX': 'auto',
-            'overflowY': 'auto',
-            'maxHeight': '90vh',  # Optional: limit the height to the viewport
-        },
-        style_cell={
-            'textAlign': 'center',
-            'padding': '5px',
-            'fontSize': '14px',
-        },
-        style_header={
-            'height':'2rem',
-            'backgroundColor': 'lightgray',
-            'fontWeight': 'bold',
-            'fontSize':'18'
-        },
-        style_data={
-            'backgroundColor': 'white',
-        }    
-    )
+        The filtering runs in the browser (see assets/clientside.js) on the records of the
+        loaded data table, so changing a threshold costs no server round-trip. The thresholds
+        start at `qc_rules` and the rule is the same as `qc_rules.qc_passed`.
+    """
+    return html.Div([
+        dbc.Row([
+            dbc.Col([
+                html.Label("Show"),
+                dcc.RadioItems(
+                    id="qc-filter-show",
+                    options=[
+                        {"label": " Failing QC", "value": "failed"},
+                        {"label": " Passing QC", "value": "passed"},
+                        {"label": " All", "value": "all"},
+                    ],
+                    value="failed",
+                    inline=True,
+                    inputStyle={"margin-left": "1rem"},
+                ),
+            ], width=3),
+            dbc.Col([
+                html.Label("Loci"),
+                dcc.Dropdown(id="qc-filter-loci", options=hla_loci, value=[], multi=True, placeholder="All loci"),
+            ], width=3),
+            dbc.Col([
+                html.Label("Min. Q1"),
+                dcc.Input(id="qc-filter-min-q1", type="number", value=qc_rules["min_q1"], step=0.001, debounce=True),
+            ], width=2),
+            dbc.Col([
+                html.Label("Min. proportion k-mers covered"),
+                dcc.Input(id="qc-filter-min-kmers", type="number", value=qc_rules["min_proportion_kmers_covered"], step=0.01, debounce=True),
+            ], width=2),
+            dbc.Col([
+                html.Label("Average coverage above"),
+                dcc.Input(id="qc-filter-min-coverage", type="number", value=qc_rules["min_average_coverage"], step=1, debounce=True),
+            ], width=2),
+        ], style={"margin-bottom":"1rem"}),
+        dcc.Store(id="qc-caller-metrics", data=caller_metrics()),  # The metrics each caller reports, for the clientside rule
+        html.P(id="qc-filter-count", children=[]),
+        dash_table.DataTable(
+            id="qc-filter-table",
+            data=[],
+            style_table={
+                'width': '100%',
+                'height': '100%',
+                'borderRadius':'0.5rem',
+                'overflowX': 'auto',
+                'overflowY': 'auto',
+                'maxHeight': '90vh',  # Optional: limit the height to the viewport
+            },
+            style_cell={
+                'textAlign': 'center',
+                'padding': '5px',
+                'fontSize': '14px',
+            },
+            style_header={
+                'height':'2rem',
+                'backgroundColor': 'lightgray',
+                'fontWeight': 'bold',
+                'fontSize':'18'
+            },
+            style_data={
+                'backgroundColor': 'white',
+            }
+        ),
+    ])
@@ -1,46 +1,41 @@
-# This file contains the filter_data function
+# This file contains the final_table function
 
 # Third party imports
 import pandas as pd
 from dash import dash_table
 
+# Built in imports
+import json
 
-def final_table(data, filename) -> dash_table.DataTable:
-    """  """
+# Local imports
+from src.utils.qc_rules import qc_passed
+from src.utils.render_cache import cached_render
+from src.utils.imgt_lookup import load_imgt_lookup, annotate_alleles
+from src.utils.typing_parsers import sample_name, data_caller
 
-    # Extract sample name
-    sample = str(filename).split("_R1")[0]
 
-    # Extract the data from the data object and set datatypes
-    data = pd.DataFrame.from_dict(data["props"]["data"])
-    data["Chromosome"] = data["Chromosome"].astype(int)
-    data["Locus"] = data["Locus"].astype(str)
-    data["AverageCoverage"] = data["AverageCoverage"].astype(float)
-    data["Q1"] = data["Q1"].astype(float)
-    data["Q2"] = data["Q2"].astype(float)
-    data["proportionkMersCovered"] = data["proportionkMersCovered"].astype(float)
+# Bump when the report definition changes in a way the source hash does not capture
+report_version = 1
 
-    # Further analysis on the HLA types in question
 
-    min_average_coverage = 2  # ambiguous value
+def final_table(data, filename, digest=None) -> dash_table.DataTable:
+    """  """
 
-    # Show data where (Q1 is not 1) AND (proportionkMersCovered is not 1)
-    failed_qc = data[ (data["Q1"]!=float(1.0)) | (data["proportionkMersCovered"]!=int(1)) ].copy()
-    failed_qc["QC_PASSED"] = (failed_qc["Q1"].astype(float) == float(1.0)) & (failed_qc["AverageCoverage"].astype(float) > min_average_coverage)  # If Q1 is not 1 and if AverageCoverage < 2, set False
-    failed_qc = failed_qc[failed_qc["QC_PASSED"]==False]  # Filter to contain only the HLA types to fail the QC
-    
-    # Create final report
-    report = data.loc[:,["Locus", "Chromosome", "Allele"]]  # create sub df
-    report.columns = report.columns.str.upper() # rename columns to upper case
-    report["CHROMOSOME_COPY"] = report["CHROMOSOME"]
-    report = report.drop(columns="CHROMOSOME")
-    report["CLASS"] = [2 if len(x) > 1 else 1 for x in report['LOCUS']]
-    report['PATIENT_ID']=sample
-    report['QC_PASSED'] = ~report["LOCUS"].isin(failed_qc["Locus"])  # Add a column representing quality control result
-    report['QC_PASSED'] = report['QC_PASSED'].astype(str)  # Convert to string so excel doesn't translate to danish
+    # Create final report from the data object, or read it from the render cache when the sample content hash is known
+    if digest is None:
+        report = build_final_report(pd.DataFrame.from_dict(data["props"]["data"]), filename)
+    else:
+        report = json.loads(cached_render(
+            "final_report", digest, filename, report_version,
+            lambda: build_final_report(pd.DataFrame.from_dict(data["props"]["data"]), filename).to_json(orient="split", index=False),
+        ))
+        report = pd.DataFrame(data=report["data"], columns=report["columns"])
 
-    # Shuffle columns
-    report = report[["PATIENT_ID", "LOCUS", "CLASS", "ALLELE", "CHROMOSOME_COPY", "QC_PASSED"]]
+    # Add the P group and serological equivalent of the alleles when an IMGT/HLA release is provided
+    lookup = load_imgt_lookup()
+    if lookup is not None:
+        annotations = annotate_alleles(report["ALLELE"], lookup).set_axis(report.index)
+        report[["P_GROUP", "SEROLOGY"]] = annotations[["P_GROUP", "SEROLOGY"]]
     
     return dash_table.DataTable(
         data=report.to_dict("records"),
@@ -67,3 +62,41 @@ def final_table(data, filename) -> dash_table.DataTable:
             'backgroundColor': 'white',
         }    
     )
+
+
+def build_final_report(data, filename) -> pd.DataFrame:
+    """ Returns the final report of the loaded typing output rows, one row per locus and chromosome copy """
+
+    # Extract sample name
+    sample = sample_name(str(filename).split("_R1")[0], data_caller(data))
+
+    # Set datatypes
+    data = data.copy()
+    data["Chromosome"] = data["Chromosome"].astype(int)
+    data["Locus"] = data["Locus"].astype(str)
+    data["AverageCoverage"] = data["AverageCoverage"].astype(float)
+    data["Q1"] = data["Q1"].astype(float)
+    data["Q2"] = data["Q2"].astype(float)
+    data["proportionkMersCovered"] = data["proportionkMersCovered"].astype(float)
+
+    # Further analysis on the HLA types in question
+
+    # Apply the QC rules, see qc_rules for the thresholds
+    failed_qc = data.copy()
+    failed_qc["QC_PASSED"] = qc_passed(failed_qc)
+    failed_qc = failed_qc[failed_qc["QC_PASSED"]==False]  # Filter to contain only the HLA types to fail the QC
+    
+    # Create final report
+    report = data.loc[:,["Locus", "Chromosome", "Allele"]]  # create sub df
+    report.columns = report.columns.str.upper() # rename columns to upper case
+    report["CHROMOSOME_COPY"] = report["CHROMOSOME"]
+    report = report.drop(columns="CHROMOSOME")
+    report["CLASS"] = [2 if len(x) > 1 else 1 for x in report['LOCUS']]
+    report['PATIENT_ID']=sample
+    report['QC_PASSED'] = ~report["LOCUS"].isin(failed_qc["Locus"])  # Add a column representing quality control result
+    report['QC_PASSED'] = report['QC_PASSED'].astype(str)  # Convert to string so excel doesn't translate to danish
+
+    # Shuffle columns
+    report = report[["PATIENT_ID", "LOCUS", "CLASS", "ALLELE", "CHROMOSOME_COPY", "QC_PASSED"]]
+    
+    return report
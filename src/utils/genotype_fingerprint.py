@@ -0,0 +1,365 @@
+# This file contains the genotype fingerprint index used to detect sample swaps and duplicate patients
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Built in imports
+import os
+import json
+import hashlib
+import itertools
+
+# Local imports
+from src.utils.file_lock import locked, write_json_atomic
+from src.utils.hla_loci import hla_loci, normalize_locus
+from src.utils.hla_matching import matching_loci
+
+
+# Declare the loci and allele resolution of the fingerprints
+fingerprint_loci = matching_loci
+fingerprint_resolutions = ["allele", "two_field", "antigen"]
+fingerprint_resolution = "two_field"
+
+# Declare how many discordant loci still count as a near match
+max_discordant_loci = 2
+
+# Declare the index file name, stored next to the trial workbooks
+fingerprint_index_file_name = "fingerprint_index.json"
+
+# Index per output path and fingerprint settings, reloaded only when the file changes
+_cache = {}
+
+
+def sample_genotype(report) -> dict:
+    """
+        Returns the genotype of one sample as {locus: [allele of copy 1, allele of copy 2]}.
+
+        Parameters:
+        -----------
+        report : pd.DataFrame
+            The final report or cohort rows of the sample, with LOCUS, ALLELE and CHROMOSOME_COPY.
+    """
+    genotype = {}
+    for row in report.to_dict("records"):
+        locus = normalize_locus(row["LOCUS"])
+        if locus not in hla_loci or pd.isna(row["ALLELE"]): continue
+        copies = genotype.setdefault(locus, [None, None])
+        copy = int(row["CHROMOSOME_COPY"]) - 1
+        if copy in (0, 1) and copies[copy] is None:
+            copies[copy] = str(row["ALLELE"])
+    return genotype
+
+
+def locus_tokens(genotype, loci=fingerprint_loci, resolution=fingerprint_resolution) -> list:
+    """
+        Returns the canonical token of each locus, or None for an untyped locus.
+
+        The alleles are cut to the resolution and sorted, so the token does not depend on
+        which chromosome copy an allele was reported on. A locus with one reported copy is
+        treated as homozygous.
+    """
+    tokens = []
+    for locus in loci:
+        copies = [_at_resolution(allele, resolution) for allele in genotype.get(locus, []) if allele]
+        if not copies:
+            tokens.append(None)
+            continue
+        tokens.append(f"{locus}:" + "+".join(sorted(copies * 2 if len(copies) == 1 else copies)))
+    return tokens
+
+
+def fingerprint(genotype, loci=fingerprint_loci, resolution=fingerprint_resolution):
+    """ Returns the hash of the genotype at the loci and resolution, or None when a locus is untyped """
+    tokens = locus_tokens(genotype, loci, resolution)
+    if None in tokens:
+        return None
+    return _hash("|".join(tokens))
+
+
+def near_match_keys(tokens, max_discordant=max_discordant_loci) -> list:
+    """
+        Returns the leave-k-out keys of the locus tokens, for k from 1 to `max_discordant`.
+
+        Each key hashes the tokens of all loci but k, with the positions left out. Two
+        genotypes with at most k discordant loci share the key that leaves those loci out,
+        so near matches are found by key lookups instead of pairwise comparisons. A key is
+        only made when every locus it keeps is typed.
+    """
+    keys = []
+    for k in range(1, max_discordant + 1):
+        for left_out in itertools.combinations(range(len(tokens)), k):
+            kept = [token for i, token in enumerate(tokens) if i not in left_out]
+            if kept and None not in kept:
+                keys.append(_hash(f"{left_out}|" + "|".join(kept)))
+    return keys
+
+
+def load_fingerprint_index(output_path, loci=fingerprint_loci, resolution=fingerprint_resolution, max_discordant=max_discordant_loci) -> dict:
+    """
+        Returns the fingerprint index of the output path.
+
+        The file stores the reported genotype of every ingested sample. The fingerprints
+        and near match keys are derived from it for the requested loci and resolution, in
+        one linear pass, and cached until the file changes.
+
+        Returns:
+        --------
+        index : dict
+            "genotypes" : {sample_id: genotype}.
+            "tokens" : {sample_id: locus tokens}.
+            "fingerprints" : {fingerprint: [sample_id, ...]}.
+            "keys" : {near match key: [sample_id, ...]}.
+    """
+    index_path = os.path.join(output_path, fingerprint_index_file_name)
+    mtime = _mtime(index_path)
+
+    cache_key = (index_path, tuple(loci), resolution, max_discordant)
+    cached = _cache.get(cache_key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    genotypes = _read_genotypes(index_path) if mtime is not None else {}
+
+    index = empty_fingerprint_index()
+    for sample_id, genotype in genotypes.items():
+        add_to_index(index, sample_id, genotype, loci, resolution, max_discordant)
+
+    _cache[cache_key] = (mtime, index)
+    return index
+
+
+def check_sample(index, sample_id, genotype, loci=fingerprint_loci, resolution=fingerprint_resolution, max_discordant=max_discordant_loci) -> list:
+    """
+        Compares a new sample against the fingerprint index.
+
+        Returns:
+        --------
+        flags : list of dicts
+            {"sample", "other", "kind", "discordant_loci"} per finding, where kind is
+            "swap" when an earlier sample with the same ID has another genotype,
+            "duplicate" when another ID has the same genotype, and "near_duplicate" when
+            another ID differs at no more than `max_discordant` loci.
+    """
+    tokens = locus_tokens(genotype, loci, resolution)
+    flags = []
+
+    # A repeat of the same ID must have the same genotype
+    previous = index["tokens"].get(sample_id)
+    if previous is not None:
+        discordant = _discordant_loci(previous, tokens, loci)
+        if discordant:
+            flags.append({"sample": sample_id, "other": sample_id, "kind": "swap", "discordant_loci": discordant})
+
+    # Other IDs sharing the fingerprint or a near match key
+    candidates = set()
+    sample_print = fingerprint(genotype, loci, resolution)
+    if sample_print is not None:
+        candidates.update(index["fingerprints"].get(sample_print, []))
+    for key in near_match_keys(tokens, max_discordant):
+        candidates.update(index["keys"].get(key, []))
+    candidates.discard(sample_id)
+
+    for other in sorted(candidates):
+        discordant = _discordant_loci(index["tokens"][other], tokens, loci)
+        if len(discordant) <= max_discordant:
+            flags.append({
+                "sample": sample_id,
+                "other": other,
+                "kind": "near_duplicate" if discordant else "duplicate",
+                "discordant_loci": discordant,
+            })
+
+    return flags
+
+
+def record_genotypes(output_path, genotypes):
+    """
+        Adds or replaces sample genotypes in the fingerprint index of the output path.
+
+        The stored genotypes are re-read under an exclusive lock and replaced atomically, as the
+        sample index, without deriving the fingerprints and near match keys of the cohort. The
+        indexes this process holds are updated with the recorded samples, so the next check
+        does not rebuild them. They are only rebuilt when another writer changed the file.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory where the trial Excel files and the index are stored.
+
+        genotypes : dict
+            Sample ID -> genotype (see `sample_genotype`).
+    """
+    index_path = os.path.join(output_path, fingerprint_index_file_name)
+
+    with locked(index_path):
+        stored = _read_genotypes(index_path)
+        previous_mtime = _mtime(index_path)
+        stored.update(genotypes)
+        write_json_atomic(index_path, stored, sort_keys=True)
+        mtime = _mtime(index_path)
+
+        # Update the cached indexes that match the file before this write
+        for cache_key, (cached_mtime, index) in list(_cache.items()):
+            if cache_key[0] != index_path or cached_mtime != previous_mtime: continue
+            loci, resolution, max_discordant = list(cache_key[1]), cache_key[2], cache_key[3]
+            for sample_id, genotype in genotypes.items():
+                _remove_from_index(index, sample_id, loci, resolution, max_discordant)
+                add_to_index(index, sample_id, genotype, loci, resolution, max_discordant)
+            _cache[cache_key] = (mtime, index)
+
+
+def cohort_fingerprint_check(cohort, loci=fingerprint_loci, resolution=fingerprint_resolution, max_discordant=max_discordant_loci) -> pd.DataFrame:
+    """
+        Returns the pairs of patients in the cohort with the same or nearly the same genotype.
+
+        The locus tokens of all patients are built in one vectorized pass. Every patient
+        is then bucketed by its fingerprint and its leave-k-out keys, and only patients
+        sharing a bucket are paired, so the check is linear in the cohort size instead of
+        comparing every pair.
+
+        Parameters:
+        -----------
+        cohort : pd.DataFrame
+            The long-format cohort table (see `cohort_table.load_cohort_table`).
+
+        Returns:
+        --------
+        pairs : pd.DataFrame
+            PATIENT_ID_1, PATIENT_ID_2, KIND ("duplicate" or "near_duplicate") and DISCORDANT_LOCI.
+    """
+    tokens = _cohort_tokens(cohort, loci, resolution)
+    patients = tokens.index.to_numpy()
+    codes = np.column_stack([pd.factorize(tokens[locus])[0] for locus in loci]) if len(tokens) else np.empty((0, len(loci)), dtype=np.int64)
+    typed = codes >= 0
+
+    # Bucket the patients by their fingerprint and leave-k-out keys, and pair the patients of each bucket
+    first, second = [], []
+    for k in range(max_discordant + 1):
+        for left_out in itertools.combinations(range(len(loci)), k):
+            kept = [i for i in range(len(loci)) if i not in left_out]
+            if not kept: continue
+            rows = np.flatnonzero(typed[:, kept].all(axis=1))
+            if len(rows) < 2: continue
+
+            _, bucket = np.unique(codes[np.ix_(rows, kept)], axis=0, return_inverse=True)
+            bucket = bucket.ravel()
+            order = np.argsort(bucket, kind="stable")
+            rows, bucket = rows[order], bucket[order]
+
+            # Visit only the buckets shared by several patients
+            starts = np.flatnonzero(np.r_[True, np.diff(bucket) != 0])
+            sizes = np.diff(np.r_[starts, len(bucket)])
+            for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+                pair = np.array(list(itertools.combinations(rows[start:start + size], 2)))
+                first.append(pair[:, 0])
+                second.append(pair[:, 1])
+
+    if not first:
+        return pd.DataFrame(columns=["PATIENT_ID_1", "PATIENT_ID_2", "KIND", "DISCORDANT_LOCI"])
+
+    pairs = np.unique(np.column_stack([np.concatenate(first), np.concatenate(second)]), axis=0)
+    discordant = (codes[pairs[:, 0]] != codes[pairs[:, 1]]) & (typed[pairs[:, 0]] | typed[pairs[:, 1]])
+    discordant_loci = [",".join(np.asarray(loci)[row]) for row in discordant]
+
+    return pd.DataFrame({
+        "PATIENT_ID_1": patients[pairs[:, 0]],
+        "PATIENT_ID_2": patients[pairs[:, 1]],
+        "KIND": np.where(discordant.any(axis=1), "near_duplicate", "duplicate"),
+        "DISCORDANT_LOCI": discordant_loci,
+    })
+
+
+def empty_fingerprint_index() -> dict:
+    """ Returns an in-memory index without samples, e.g. to check the samples of one batch against each other """
+    return {"genotypes": {}, "tokens": {}, "fingerprints": {}, "keys": {}}
+
+
+def add_to_index(index, sample_id, genotype, loci=fingerprint_loci, resolution=fingerprint_resolution, max_discordant=max_discordant_loci):
+    """ Adds the fingerprint and near match keys of one sample to an in-memory index """
+    tokens = locus_tokens(genotype, loci, resolution)
+    index["genotypes"][sample_id] = genotype
+    index["tokens"][sample_id] = tokens
+
+    sample_print = fingerprint(genotype, loci, resolution)
+    if sample_print is not None:
+        index["fingerprints"].setdefault(sample_print, []).append(sample_id)
+    for key in near_match_keys(tokens, max_discordant):
+        index["keys"].setdefault(key, []).append(sample_id)
+
+
+def _remove_from_index(index, sample_id, loci, resolution, max_discordant):
+    """ Removes a sample from an in-memory index, if it is in it """
+    genotype = index["genotypes"].pop(sample_id, None)
+    if genotype is None:
+        return
+    tokens = index["tokens"].pop(sample_id)
+
+    entries = [("fingerprints", fingerprint(genotype, loci, resolution))]
+    entries += [("keys", key) for key in near_match_keys(tokens, max_discordant)]
+    for table, key in entries:
+        samples = index[table].get(key)
+        if samples is None or sample_id not in samples: continue
+        samples.remove(sample_id)
+        if not samples:
+            del index[table][key]
+
+
+def _cohort_tokens(cohort, loci, resolution) -> pd.DataFrame:
+    """ Returns the locus tokens of every patient of the cohort table, one column per locus, as `locus_tokens` """
+    rows = cohort[cohort["ALLELE"].notna() & cohort["CHROMOSOME_COPY"].isin([1, 2])]
+    rows = rows.assign(LOCUS=rows["LOCUS"].map(normalize_locus))
+    rows = rows[rows["LOCUS"].isin(loci)].drop_duplicates(["PATIENT_ID", "LOCUS", "CHROMOSOME_COPY"])
+
+    # Cut each distinct allele to the resolution once
+    allele_codes, distinct = pd.factorize(rows["ALLELE"].astype(str))
+    alleles = np.asarray([_at_resolution(allele, resolution) for allele in distinct], dtype=object)[allele_codes]
+
+    wide = rows.assign(ALLELE=alleles).pivot(index="PATIENT_ID", columns=["LOCUS", "CHROMOSOME_COPY"], values="ALLELE")
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([loci, [1, 2]])).astype(object)  # A locus nobody is typed at is all NaN
+
+    # Sort the copies and treat a locus with one reported copy as homozygous
+    tokens = {}
+    for locus in loci:
+        copy1, copy2 = wide[(locus, 1)].fillna(wide[(locus, 2)]), wide[(locus, 2)].fillna(wide[(locus, 1)])
+        low, high = copy1.where(copy1 <= copy2, copy2), copy2.where(copy1 <= copy2, copy1)
+        tokens[locus] = (f"{locus}:" + low + "+" + high).where(copy1.notna(), None)
+    return pd.DataFrame(tokens, index=wide.index)
+
+
+def _discordant_loci(tokens, other_tokens, loci) -> list:
+    """ Returns the loci whose tokens differ, a locus untyped in only one of them counting as discordant """
+    return [locus for locus, a, b in zip(loci, tokens, other_tokens) if a != b]
+
+
+def _at_resolution(allele, resolution) -> str:
+    """ Returns the allele without the HLA- prefix, cut to the resolution """
+    allele = str(allele).replace("HLA-", "")
+    if resolution == "allele":
+        return allele
+    if resolution == "two_field":
+        return ":".join(allele.split(":")[:2]).rstrip("GP")
+    if resolution == "antigen":
+        return allele.split(":")[0]
+    raise ValueError(f"Unknown resolution '{resolution}', expected one of {fingerprint_resolutions}")
+
+
+def _hash(text) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _read_genotypes(index_path) -> dict:
+    """ Returns the stored genotypes of the fingerprint index file, empty if the file is missing """
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _mtime(path):
+    """ Returns the modification time of a file in nanoseconds, or None when it does not exist """
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
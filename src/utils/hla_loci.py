@@ -0,0 +1,11 @@
+# Declare the HLA loci reported per patient, in report column order
+hla_loci = ["A", "B", "C", "DQA1", "DQB1", "DRB1", "DPA1", "DPB1", "DRB3", "DRB4", "E", "F", "G"]
+
+# Declare the chromosome copies reported per locus
+chromosome_copies = [1, 2]
+
+
+def normalize_locus(locus) -> str:
+    """ Returns the locus name without the 'HLA-' prefix HLA-LA writes (e.g. 'HLA-A' -> 'A') """
+    locus = str(locus).strip()
+    return locus[4:] if locus.upper().startswith("HLA-") else locus
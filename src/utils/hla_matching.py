@@ -0,0 +1,185 @@
+# This file contains the donor-recipient HLA mismatch search over the cohort
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Local imports
+from src.utils.hla_loci import hla_loci, chromosome_copies
+
+
+# Declare the loci compared by default, the classic transplant matching loci
+matching_loci = ["A", "B", "C", "DRB1", "DQB1"]
+
+# Declare the matching levels
+matching_levels = ["allele", "antigen"]
+
+
+def encode_cohort(cohort) -> dict:
+    """
+        Encodes the long-format cohort table as integer matrices for vectorized matching.
+
+        Every allele string is replaced by an integer code, once at allele level and once at
+        antigen level (the first field, e.g. 'A*30' for 'HLA-A*30:02:01G'). A locus with only
+        one reported copy is treated as homozygous, and an untyped locus is coded -1.
+
+        Parameters:
+        -----------
+        cohort : pd.DataFrame
+            The long-format cohort table (see `cohort_table.load_cohort_table`).
+
+        Returns:
+        --------
+        encoded : dict
+            "patients" : np.ndarray of str, the PATIENT_ID of each row.
+            "loci" : list of str, the loci of the second axis.
+            "allele" : np.ndarray of int32, shape (patients, loci, copies).
+            "antigen" : np.ndarray of int32, shape (patients, loci, copies).
+            "qc_passed" : np.ndarray of bool, shape (patients, loci). Untyped loci count as passed.
+    """
+    patient_codes, patients = pd.factorize(cohort["PATIENT_ID"])
+    locus_index = {locus: i for i, locus in enumerate(hla_loci)}
+
+    # Keep the rows of the known loci and copies
+    locus_codes = cohort["LOCUS"].map(locus_index)
+    rows = locus_codes.notna().to_numpy() & cohort["CHROMOSOME_COPY"].isin(chromosome_copies).to_numpy()
+    alleles = cohort["ALLELE"][rows].astype("string").str.replace("HLA-", "", regex=False)
+
+    p = patient_codes[rows]
+    l = locus_codes[rows].to_numpy(dtype=np.int64)
+    c = cohort["CHROMOSOME_COPY"][rows].to_numpy(dtype=np.int64) - 1
+
+    shape = (len(patients), len(hla_loci), len(chromosome_copies))
+    encoded = {"patients": np.asarray(patients, dtype=str), "loci": list(hla_loci)}
+
+    for level, values in (("allele", alleles), ("antigen", alleles.str.split(":").str[0])):
+        codes = np.full(shape, -1, dtype=np.int32)
+        codes[p, l, c] = pd.factorize(values, use_na_sentinel=True)[0]
+
+        # Treat a locus with one reported copy as homozygous
+        codes[:, :, 0] = np.where(codes[:, :, 0] < 0, codes[:, :, 1], codes[:, :, 0])
+        codes[:, :, 1] = np.where(codes[:, :, 1] < 0, codes[:, :, 0], codes[:, :, 1])
+        encoded[level] = codes
+
+    qc_passed = np.ones(shape[:2], dtype=bool)
+    failed = ~cohort["QC_PASSED"][rows].to_numpy(dtype=bool)
+    qc_passed[p[failed], l[failed]] = False
+    encoded["qc_passed"] = qc_passed
+
+    return encoded
+
+
+def mismatch_counts(codes, query) -> np.ndarray:
+    """
+        Returns the mismatch count (0, 1 or 2) per candidate and locus, or -1 where either side is untyped.
+
+        The two copies of the query are paired with the candidate copies in the order that
+        gives the most matches, so a homozygous query or candidate counts each copy once.
+
+        Parameters:
+        -----------
+        codes : np.ndarray of int32, shape (candidates, loci, 2)
+        query : np.ndarray of int32, shape (loci, 2)
+    """
+    c1, c2 = codes[:, :, 0], codes[:, :, 1]
+    q1, q2 = query[:, 0], query[:, 1]
+
+    direct = (c1 == q1).astype(np.int8) + (c2 == q2)
+    crossed = (c1 == q2).astype(np.int8) + (c2 == q1)
+    mismatches = 2 - np.maximum(direct, crossed)
+
+    typed = (c1 >= 0) & (q1 >= 0)
+    return np.where(typed, mismatches, -1).astype(np.int8)
+
+
+def find_matches(encoded, patient_id, loci=None, level="allele", top_k=10, require_qc_passed=True) -> pd.DataFrame:
+    """
+        Returns the best matching candidates for a query patient.
+
+        All candidates are scored in one NumPy pass over the encoded cohort.
+
+        Parameters:
+        -----------
+        encoded : dict
+            The encoded cohort (see `encode_cohort` and `cohort_index.load_cohort_index`).
+
+        patient_id : str
+            The PATIENT_ID of the query patient.
+
+        loci : list of str, optional
+            The loci to compare. Defaults to `matching_loci`.
+
+        level : str
+            "allele" or "antigen".
+
+        top_k : int
+            The number of candidates to return, at least 1. Anything else raises a ValueError.
+
+        require_qc_passed : bool
+            Leave out candidates with a failed QC at any of the compared loci.
+
+        Returns:
+        --------
+        matches : pd.DataFrame
+            PATIENT_ID, MISMATCHES (total over the typed loci), TYPED_LOCI and one
+            "<LOCUS>_MISMATCHES" column per locus (-1 where untyped), best match first.
+            Candidates typed at every locus the query is typed at come before the others,
+            and candidates typed at none of the compared loci are left out.
+    """
+    if level not in matching_levels:
+        raise ValueError(f"Unknown matching level '{level}', expected one of {matching_levels}")
+    if not isinstance(top_k, (int, np.integer)) or top_k < 1:
+        raise ValueError(f"top_k must be a whole number of at least 1, got {top_k}")
+
+    loci = matching_loci if loci is None else list(loci)
+    unknown = [locus for locus in loci if locus not in encoded["loci"]]
+    if unknown:
+        raise ValueError(f"Unknown loci {unknown}, expected any of {encoded['loci']}")
+
+    query_rows = np.flatnonzero(encoded["patients"] == patient_id)
+    if len(query_rows) == 0:
+        raise KeyError(f"Unknown patient '{patient_id}'")
+    query_row = query_rows[0]
+
+    # Score every candidate at once
+    locus_columns = [encoded["loci"].index(locus) for locus in loci]
+    codes = encoded[level][:, locus_columns]
+    per_locus = mismatch_counts(codes, codes[query_row])
+    typed = per_locus >= 0
+    total = np.where(typed, per_locus, 0).sum(axis=1)
+    typed_loci = typed.sum(axis=1)
+
+    # Leave out the query itself, candidates typed at none of the compared loci and, when
+    # asked, candidates failing QC at a compared locus
+    candidates = typed_loci > 0
+    candidates[query_row] = False
+    if require_qc_passed:
+        candidates &= encoded["qc_passed"][:, locus_columns].all(axis=1)
+
+    # Rank the candidates typed at every locus the query is typed at first, then by fewest
+    # mismatches, then by most typed loci, and keep the top k
+    candidate_rows = np.flatnonzero(candidates)
+    complete = typed_loci[candidate_rows] == (codes[query_row, :, 0] >= 0).sum()
+    score = (
+        (~complete).astype(np.int64) * (2 * len(loci) + 1) * (len(loci) + 1)
+        + total[candidate_rows].astype(np.int64) * (len(loci) + 1)
+        + (len(loci) - typed_loci[candidate_rows])
+    )
+    top_k = min(top_k, len(candidate_rows))
+    if top_k < len(candidate_rows):
+        top = np.argpartition(score, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(candidate_rows))
+    top = top[np.argsort(score[top], kind="stable")]
+    best = candidate_rows[top]
+
+    matches = pd.DataFrame({
+        "PATIENT_ID": encoded["patients"][best],
+        "MISMATCHES": total[best],
+        "TYPED_LOCI": typed_loci[best],
+    })
+    for i, locus in enumerate(loci):
+        matches[f"{locus}_MISMATCHES"] = per_locus[best, i]
+
+    return matches
+
@@ -0,0 +1,251 @@
+# This file contains the G-group, P-group and serology lookup built from a local IMGT/HLA release
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Built in imports
+import os
+import logging
+import threading
+
+# Local imports
+from src.utils.output_path import cache_path, imgt_release_path
+from src.utils.mmap_bundle import write_bundle, read_bundle
+from src.utils.file_lock import locked
+
+
+logger = logging.getLogger(__name__)
+
+# Declare the release files read, only hla_nom_g.txt is required
+g_file_name = "hla_nom_g.txt"
+p_file_name = "hla_nom_p.txt"
+serology_file_name = "rel_dna_ser.txt"
+
+# Declare the serological names of the loci whose antigens are not named after the locus
+serology_prefixes = {"C": "Cw", "DRB1": "DR", "DRB3": "DR", "DRB4": "DR", "DRB5": "DR", "DQB1": "DQ", "DQA1": "DQA", "DPB1": "DP"}
+
+# Declare the compiled lookup file
+imgt_lookup_path = os.path.join(cache_path, "imgt_lookup.bin")
+
+# Lookup of this process, the arrays are memory mapped from the compiled file
+_lookup = {"lookup": None, "mtime": None}
+_lookup_lock = threading.Lock()
+
+
+def build_imgt_lookup(release_path=None, lookup_path=None):
+    """
+        Compiles the nomenclature files of an IMGT/HLA release into a memory mappable lookup file.
+
+        The lookup holds one sorted table of names, covering every allele and every G group,
+        with the G group, P group and serological equivalent of each name, plus the member
+        alleles of every G group. Names are stored without the 'HLA-' prefix (e.g. 'A*30:02:01G').
+
+        Parameters:
+        -----------
+        release_path : str, optional
+            The folder with hla_nom_g.txt and, optionally, hla_nom_p.txt and rel_dna_ser.txt.
+            Defaults to `imgt_release_path`.
+
+        lookup_path : str, optional
+            The lookup file to write. It is replaced atomically. Defaults to `imgt_lookup_path`.
+    """
+    release_path = release_path or imgt_release_path
+    lookup_path = lookup_path or imgt_lookup_path
+
+    g_groups = _read_groups(os.path.join(release_path, g_file_name))
+    p_groups = _read_groups(os.path.join(release_path, p_file_name))
+    serology = _read_serology(os.path.join(release_path, serology_file_name))
+
+    # Alleles without a G group form their own group
+    g_groups["GROUP"] = g_groups["GROUP"].where(g_groups["GROUP"] != "", g_groups["ALLELE"])
+    alleles = g_groups.set_index("ALLELE")["GROUP"]
+    p_of_allele = p_groups.set_index("ALLELE")["GROUP"].reindex(alleles.index).fillna("")
+    serology_of_allele = serology.reindex(alleles.index).fillna("")
+
+    # A G group takes the P group and serology of its first member with one
+    members = pd.DataFrame({"GROUP": alleles.values, "P": p_of_allele.values, "SEROLOGY": serology_of_allele.values})
+    group_p = members[members["P"] != ""].groupby("GROUP")["P"].first()
+    group_serology = members[members["SEROLOGY"] != ""].groupby("GROUP")["SEROLOGY"].agg(lambda x: "/".join(sorted(set(x))))
+
+    # Build one sorted name table covering alleles and G groups
+    names = pd.Index(alleles.index).union(pd.Index(alleles.unique())).sort_values()
+    is_group = names.isin(alleles.unique())
+    name_group = pd.Series(names, index=names).where(is_group, alleles.reindex(names))
+    name_p = pd.Series(np.where(is_group, group_p.reindex(names).fillna(""), p_of_allele.reindex(names).fillna("")), index=names)
+    name_serology = pd.Series(np.where(is_group, group_serology.reindex(names).fillna(""), serology_of_allele.reindex(names).fillna("")), index=names)
+
+    # Store the G group members as index ranges into the name table, sorted by group
+    name_codes = pd.Series(np.arange(len(names)), index=names)
+    member_groups = name_codes.reindex(alleles.values).to_numpy()
+    member_codes = name_codes.reindex(alleles.index).to_numpy()
+    order = np.lexsort((member_codes, member_groups))
+    group_starts = np.searchsorted(member_groups[order], np.arange(len(names) + 1))
+
+    write_bundle(lookup_path, {
+        "names": _fixed_width(names),
+        "g_group": name_codes.reindex(name_group.values).to_numpy(dtype=np.int32),
+        "p_group": _fixed_width(name_p.values),
+        "serology": _fixed_width(name_serology.values),
+        "member_offsets": group_starts.astype(np.int64),
+        "members": member_codes[order].astype(np.int32),
+    }, meta={"release_path": os.path.abspath(release_path), "alleles": len(alleles)})
+
+
+def load_imgt_lookup():
+    """
+        Returns the lookup of this process, or None when no IMGT/HLA release is provided.
+
+        The compiled file is memory mapped, so workers share one copy of the tables and
+        nothing is parsed at startup. It is compiled on first use when the release files
+        are present but the compiled file is missing or older than them, under a file lock
+        so workers starting together compile it only once.
+    """
+    with _lookup_lock:
+        try:
+            if _needs_build():
+                os.makedirs(os.path.dirname(imgt_lookup_path), exist_ok=True)
+                with locked(imgt_lookup_path):
+                    if _needs_build():
+                        logger.info("Compiling the IMGT/HLA lookup from %s", imgt_release_path)
+                        build_imgt_lookup()
+            mtime = os.stat(imgt_lookup_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        if _lookup["mtime"] != mtime:
+            _lookup["lookup"] = read_bundle(imgt_lookup_path)[0]
+            _lookup["mtime"] = mtime
+
+        return _lookup["lookup"]
+
+
+def annotate_alleles(alleles, lookup=None) -> pd.DataFrame:
+    """
+        Returns the G group, P group and serological equivalent of each allele, in one vectorized lookup.
+
+        Parameters:
+        -----------
+        alleles : iterable of str
+            Alleles or G groups, with or without the 'HLA-' prefix (e.g. 'HLA-A*30:02:01G').
+
+        lookup : dict, optional
+            The compiled lookup. Defaults to `load_imgt_lookup()`.
+
+        Returns:
+        --------
+        annotations : pd.DataFrame
+            G_GROUP, P_GROUP and SEROLOGY columns, in the order of `alleles`. Names missing
+            from the release get None.
+    """
+    lookup = lookup if lookup is not None else load_imgt_lookup()
+    alleles = pd.Series(list(alleles), dtype="string")
+    columns = ["G_GROUP", "P_GROUP", "SEROLOGY"]
+
+    if lookup is None or len(alleles) == 0:
+        return pd.DataFrame({column: [None] * len(alleles) for column in columns})
+
+    codes = _codes(lookup, alleles)
+    found = codes >= 0
+    codes = np.where(found, codes, 0)
+
+    annotations = pd.DataFrame({
+        "G_GROUP": lookup["names"][lookup["g_group"][codes]],
+        "P_GROUP": lookup["p_group"][codes],
+        "SEROLOGY": lookup["serology"][codes],
+    })
+    for column in columns:
+        values = np.char.decode(annotations[column].to_numpy(dtype=bytes), "ascii")
+        annotations[column] = pd.Series(np.where(found & (values != ""), values, None), dtype=object)
+
+    return annotations
+
+
+def expand_g_group(allele, lookup=None) -> list:
+    """ Returns the member alleles of a G group, the allele itself when it is not a G group, or [] when unknown """
+    lookup = lookup if lookup is not None else load_imgt_lookup()
+    if lookup is None:
+        return []
+
+    code = _codes(lookup, pd.Series([allele], dtype="string"))[0]
+    if code < 0:
+        return []
+
+    start, stop = lookup["member_offsets"][code], lookup["member_offsets"][code + 1]
+    if start == stop:
+        return [lookup["names"][code].decode("ascii")]
+    return [name.decode("ascii") for name in lookup["names"][lookup["members"][start:stop]]]
+
+
+def _codes(lookup, alleles) -> np.ndarray:
+    """ Returns the name table position of each allele, or -1 when missing """
+    names = lookup["names"]
+    keys = alleles.fillna("").str.replace(r"^HLA-", "", regex=True).str.strip()
+    fits = (keys.str.len() <= names.dtype.itemsize).to_numpy(dtype=bool)  # Longer keys would be truncated
+    keys = keys.str.encode("ascii", errors="replace").to_numpy(dtype=names.dtype)
+
+    positions = np.searchsorted(names, keys)
+    positions = np.minimum(positions, max(len(names) - 1, 0))
+    found = (len(names) > 0) & fits & (names[positions] == keys)
+    return np.where(found, positions, -1)
+
+
+def _read_groups(file_path) -> pd.DataFrame:
+    """ Returns the ALLELE -> GROUP rows of hla_nom_g.txt or hla_nom_p.txt, empty if the file is missing """
+    if not os.path.exists(file_path) and file_path.endswith(p_file_name):
+        return pd.DataFrame({"ALLELE": pd.Series(dtype=str), "GROUP": pd.Series(dtype=str)})
+
+    # Lines are "<locus>*;<allele>/<allele>/...;<group>", comment lines start with #
+    groups = pd.read_csv(
+        file_path, sep=";", comment="#", header=None, names=["LOCUS", "ALLELES", "GROUP"],
+        usecols=[0, 1, 2], dtype=str, keep_default_na=False,
+    )
+    groups["ALLELES"] = groups["ALLELES"].str.split("/")
+    groups = groups.explode("ALLELES")
+    groups["ALLELE"] = groups["LOCUS"] + groups["ALLELES"]
+    groups["GROUP"] = (groups["LOCUS"] + groups["GROUP"]).where(groups["GROUP"] != "", "")
+
+    return groups.drop_duplicates("ALLELE")[["ALLELE", "GROUP"]].reset_index(drop=True)
+
+
+def _read_serology(file_path) -> pd.Series:
+    """ Returns the serological equivalent per allele from rel_dna_ser.txt, empty if the file is missing """
+    if not os.path.exists(file_path):
+        return pd.Series(dtype=str)
+
+    # Lines are "<locus>*;<allele>;<unambiguous>;<possible>;<assumed>;<expert>"
+    serology = pd.read_csv(
+        file_path, sep=";", comment="#", header=None, usecols=[0, 1, 2, 3, 4, 5],
+        names=["LOCUS", "ALLELE", "UNAMBIGUOUS", "POSSIBLE", "ASSUMED", "EXPERT"],
+        dtype=str, keep_default_na=False,
+    )
+    antigen = serology["UNAMBIGUOUS"]
+    for column in ["POSSIBLE", "ASSUMED", "EXPERT"]:
+        antigen = antigen.where(antigen != "", serology[column])
+    antigen = antigen.where(~antigen.isin(["0", "?"]), "")  # Null and undefined antigens
+
+    # Prefix the antigen with the serological locus name, e.g. A*01:01:01:01 -> A1, DRB1*03:01:01:01 -> DR17
+    locus = serology["LOCUS"].str.rstrip("*")
+    locus = locus.map(serology_prefixes).fillna(locus)
+    antigen = (locus + antigen.str.split("/").str[0]).where(antigen != "", "")
+
+    return pd.Series(antigen.values, index=serology["LOCUS"] + serology["ALLELE"]).groupby(level=0).first()
+
+
+def _fixed_width(values) -> np.ndarray:
+    """ Returns the strings as a fixed-width ASCII byte array, which can be memory mapped """
+    values = [str(value).encode("ascii", errors="replace") for value in values]
+    return np.array(values, dtype=f"S{max([len(value) for value in values] + [1])}")
+
+
+def _needs_build() -> bool:
+    """ Returns whether the compiled lookup is missing or older than the release files """
+    g_path = os.path.join(imgt_release_path, g_file_name)
+    if not os.path.exists(g_path):
+        return False
+    if not os.path.exists(imgt_lookup_path):
+        return True
+
+    compiled = os.stat(imgt_lookup_path).st_mtime_ns
+    release = [os.path.join(imgt_release_path, name) for name in (g_file_name, p_file_name, serology_file_name)]
+    return any(os.stat(path).st_mtime_ns > compiled for path in release if os.path.exists(path))
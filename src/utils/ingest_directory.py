@@ -0,0 +1,277 @@
+# This file contains the ingest_directory function that adds a folder of HLA typing outputs to the trial workbooks
+
+# Built in imports
+import os
+import time
+import logging
+import itertools
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# Local imports
+from src.utils.typing_parsers import parse_typing, detect_caller, sample_name, is_typing_file, header_size
+from src.utils.map_workbook_sheets import default_workers
+from src.utils.final_table import build_final_report
+from src.utils.download_report_table import write_report_sheets
+from src.utils.sample_index import content_hash, load_sample_index, ingest_status, record_samples
+from src.utils.qc_monitor import update_qc_monitor
+from src.utils.qc_metrics import record_qc_metrics
+from src.utils.cohort_index import publish_cohort_index, publish_in_background
+from src.utils.genotype_fingerprint import (
+    sample_genotype, load_fingerprint_index, empty_fingerprint_index, add_to_index, check_sample, record_genotypes,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Declare the number of parsed samples held in memory before they are written to the workbooks
+flush_size = 64
+
+
+def ingest_directory(input_path, output_path, max_workers=None, batch_id=None):
+    """
+        Adds every typing output file in a folder to the trial workbooks.
+
+        The files may come from any caller of `typing_parsers.typing_callers`, mixed in one
+        folder. Each file is hashed and looked up in the sample index. Files whose content was
+        already ingested are skipped without touching the workbooks, so re-running over a
+        full folder costs one hash per file. New and changed files are parsed and reported
+        in parallel worker processes. New and changed samples are written with one
+        workbook write per trial for every `flush_size` samples, so memory does not grow
+        with the folder, and their QC metrics are added to the drift monitor. The cohort
+        index of the donor matching is published once the samples are written.
+        Every new or changed sample is checked against the genotype fingerprint index, and
+        against the other samples of the folder, for sample swaps and duplicate patients.
+
+        Parameters:
+        -----------
+        input_path : str
+            The folder with the HLA-LA output files.
+
+        output_path : str
+            The directory where the trial Excel files and the sample index are stored.
+
+        max_workers : int, optional
+            The number of worker processes parsing the files. Defaults to
+            `map_workbook_sheets.default_workers`.
+
+        batch_id : str, optional
+            The batch of the samples in the QC drift monitor. Defaults to the folder name,
+            as a folder usually holds the output of one sequencing run.
+
+        Returns:
+        --------
+        summary : dict
+            Lists of sample IDs under "added", "replaced" and "skipped",
+            {"file": ..., "error": ...} entries under "errors", and the findings of
+            `genotype_fingerprint.check_sample` under "fingerprint_flags".
+    """
+
+    batch_id = batch_id or os.path.basename(os.path.abspath(input_path))
+    return ingest_files(_read_folder(input_path), output_path, max_workers, batch_id)
+
+
+def ingest_files(files, output_path, max_workers=None, batch_id=None, background_publish=False):
+    """
+        Adds HLA typing output files to the trial workbooks, skipping content that was already ingested.
+
+        Parameters:
+        -----------
+        files : iterable of (str, bytes)
+            The file names and contents. Consumed a few files ahead of the workers, so it can
+            stream from a folder or an archive.
+
+        output_path : str
+            The directory where the trial Excel files and the sample index are stored.
+
+        max_workers : int, optional
+            As in `ingest_directory`.
+
+        batch_id : str, optional
+            The batch of the samples in the QC drift monitor. Defaults to one new batch
+            named after the time of the ingestion.
+
+        background_publish : bool, optional
+            Publish the cohort index in a thread (see `cohort_index.publish_in_background`)
+            instead of before returning, for callers answering a web request.
+
+        Returns:
+        --------
+        summary : dict
+            As returned by `ingest_directory`.
+    """
+
+    batch_id = batch_id or time.strftime("%Y-%m-%d %H:%M:%S")
+    index = load_sample_index(output_path)
+    fingerprints = load_fingerprint_index(output_path)
+    batch_fingerprints = empty_fingerprint_index()
+    summary = {"added": [], "replaced": [], "skipped": [], "errors": [], "fingerprint_flags": []}
+
+    # Declare the samples to write per trial workbook, written every `flush_size` samples
+    workbooks = {}
+    buffered = 0
+
+    # Parse and report the new and changed files in the workers, in file order
+    pending = _pending_files(files, index, summary)
+    for (file_name, sample_id, trial_id, digest, status), parsed in _map_files(pending, max_workers or default_workers):
+        try:
+            if isinstance(parsed, Exception):
+                raise parsed
+            data, report = parsed
+            workbook = f"{trial_id}_hla_typing_report.xlsx"
+
+            # Check the genotype against the ingested samples and the earlier samples of this batch
+            genotype = sample_genotype(report)
+            # Samples of the batch that are already written are in both indexes, so each finding is kept once
+            for flag in check_sample(fingerprints, sample_id, genotype) + check_sample(batch_fingerprints, sample_id, genotype):
+                if flag not in summary["fingerprint_flags"]:
+                    summary["fingerprint_flags"].append(flag)
+            add_to_index(batch_fingerprints, sample_id, genotype)
+
+            workbooks.setdefault(workbook, {})[sample_id] = {
+                "trial_id": trial_id, "status": status, "data": data, "report": report, "genotype": genotype,
+                "entry": {"sha256": digest, "workbook": workbook, "sheet": sample_id},
+            }
+            summary["added" if status == "new" else "replaced"].append(sample_id)
+            buffered += 1
+        except Exception as e:
+            summary["errors"].append({"file": file_name, "error": str(e)})
+
+        if buffered >= flush_size:
+            _write_workbooks(output_path, batch_id, workbooks, summary)
+            workbooks = {}
+            buffered = 0
+
+    _write_workbooks(output_path, batch_id, workbooks, summary)
+
+    # Publish the cohort index of the new data version, read by the donor matching
+    if (summary["added"] or summary["replaced"]) and background_publish:
+        publish_in_background(output_path)
+    elif summary["added"] or summary["replaced"]:
+        try:
+            publish_cohort_index(output_path, max_workers or default_workers)
+        except Exception as e:
+            logger.warning("Could not publish the cohort index: %s", e)
+
+    for error in summary["errors"]:
+        logger.warning("Error ingesting file %s: %s", error["file"], error["error"])
+    for flag in summary["fingerprint_flags"]:
+        logger.warning("Genotype check flagged a %s: %s and %s, discordant loci %s", flag["kind"], flag["sample"], flag["other"], flag["discordant_loci"])
+
+    return summary
+
+
+def _write_workbooks(output_path, batch_id, workbooks, summary):
+    """ Writes each trial workbook's buffered samples at once, then records them in the indexes and QC stores """
+    for workbook, samples in workbooks.items():
+        try:
+            write_report_sheets(os.path.join(output_path, workbook), {sample_id: sample["report"] for sample_id, sample in samples.items()})
+            record_genotypes(output_path, {sample_id: sample["genotype"] for sample_id, sample in samples.items()})
+
+            # Add the QC metrics to the QC metrics store before the data version is bumped, so
+            # the cohort index published for the version includes them
+            for sample_id, sample in samples.items():
+                try:
+                    record_qc_metrics(output_path, sample["trial_id"], sample_id, sample["data"])
+                except Exception as e:
+                    logger.warning("Could not record the QC metrics of %s: %s", sample_id, e)
+
+            record_samples(output_path, {sample_id: sample["entry"] for sample_id, sample in samples.items()})
+        except Exception as e:
+            summary["errors"].append({"file": workbook, "error": str(e)})
+            for key in ("added", "replaced"):
+                summary[key] = [sample_id for sample_id in summary[key] if sample_id not in samples]
+            continue
+
+        # Add the QC metrics of the new samples to the drift monitor
+        for sample_id, sample in samples.items():
+            if sample["status"] == "new":
+                try:
+                    update_qc_monitor(output_path, batch_id, sample["trial_id"], sample["data"])
+                except Exception as e:
+                    logger.warning("Could not update the QC monitor with %s: %s", sample_id, e)
+
+
+def _pending_files(files, index, summary):
+    """ Yields the files whose content is new or changed, adding the unchanged samples to the summary as skipped """
+    for file_name, content in files:
+        try:
+            # Extract sample and trial IDs, as for uploaded files
+            caller = detect_caller(file_name, content[:header_size])
+            sample_id = sample_name(file_name, caller)
+            trial_id = sample_id.split("_")[0]
+
+            # Skip content that is already ingested
+            digest = content_hash(content)
+            status = ingest_status(index, sample_id, digest)
+            if status == "unchanged":
+                summary["skipped"].append(sample_id)
+                continue
+        except Exception as e:
+            summary["errors"].append({"file": file_name, "error": str(e)})
+            continue
+
+        yield (file_name, sample_id, trial_id, digest, status), (file_name, content, caller)
+
+
+def _map_files(pending, max_workers):
+    """
+        Yields each pending file's key and its parsed data and report, or the exception raised.
+
+        The files are parsed by a process pool, with at most two files per worker read ahead
+        so memory stays bounded, and yielded in file order. A single file or worker is
+        parsed in the calling process. A pool failure, such as a killed worker or a result
+        that cannot be pickled, is yielded as the exception of the files it affects.
+    """
+    head = list(itertools.islice(pending, 2))
+    if max_workers == 1 or len(head) < 2:
+        for key, task in itertools.chain(head, pending):
+            yield key, _parse_file(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        window = deque()
+        for key, task in itertools.chain(head, pending):
+            window.append((key, _submit(pool, task)))
+            if len(window) >= 2 * max_workers:
+                key, future = window.popleft()
+                yield key, _result(future)
+        while window:
+            key, future = window.popleft()
+            yield key, _result(future)
+
+
+def _submit(pool, task) -> Future:
+    """ Submits a file to the pool, or returns a failed future when the pool is broken """
+    try:
+        return pool.submit(_parse_file, task)
+    except Exception as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+
+def _result(future):
+    """ Returns the parsed data and report of a file, or the exception raised by the worker or the pool """
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
+
+def _parse_file(task):
+    """ Returns the parsed data and final report of one file, or the exception raised, in the worker process """
+    file_name, content, caller = task
+    try:
+        data = parse_typing(content, file_name, caller)
+        return data, build_final_report(data, file_name)
+    except Exception as e:
+        return e
+
+
+def _read_folder(input_path):
+    """ Yields the name and content of the typing output files in a folder """
+    for file_name in sorted(os.listdir(input_path)):
+        if not is_typing_file(file_name): continue
+        with open(os.path.join(input_path, file_name), "rb") as f:
+            yield file_name, f.read()
@@ -1,10 +1,13 @@
 
 # Third party imports
-import pandas as pd
 from dash import dash_table
 # Built in imports
 import base64
 
+# Local imports
+from src.utils.sample_index import content_hash
+from src.utils.typing_parsers import parse_typing, detect_caller, header_size
+
 def load_data(contents, filename) -> dash_table.DataTable:
     """  """
 
@@ -15,19 +18,14 @@ def load_data(contents, filename) -> dash_table.DataTable:
     decoded = base64.b64decode(content_string)
 
     try:
-        if 'text' in content_type or filename.endswith('.txt'):
-            # Process TXT file
-            decoded_text = decoded.decode('utf-8')
-            lines = decoded_text.splitlines()
-            columns = lines[0].split('\t')
-
-            data=[]
-            for line in lines[1:]:
-                # Split the line based on a delimiter or custom logic
-                fields = line.strip().split('\t')
-                data.append(fields)
-
-            df = pd.DataFrame(data=data, columns=columns)
+        try:
+            caller = detect_caller(filename, decoded[:header_size])
+        except ValueError:
+            caller = None
+
+        if caller is not None:
+            # Process the output of any registered HLA caller
+            df = parse_typing(decoded, filename, caller)
             return dash_table.DataTable(
                 data=df.to_dict("records"),
                 style_table={
@@ -59,4 +57,14 @@ def load_data(contents, filename) -> dash_table.DataTable:
         return [f"An error occurred while processing the file: {str(e)}"]
 
 
+def decode_contents(contents) -> bytes:
+    """ Returns the file bytes of a dcc.Upload data URL """
+    content_type, content_string = contents.split(',')
+    return base64.b64decode(content_string)
 
+
+def sample_digest(contents):
+    """ Returns the content hash of a dcc.Upload data URL, or None when nothing is uploaded """
+    if contents is None:
+        return None
+    return content_hash(decode_contents(contents))
@@ -0,0 +1,120 @@
+# This file contains the map_workbook_sheets function that extracts workbook sheets in parallel
+
+# Built in imports
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+# Local imports
+from src.utils.read_workbook import read_workbook, count_sheets
+
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes, overridable per deployment
+default_workers = int(os.environ.get("HLA_INGEST_WORKERS", os.cpu_count() or 1))
+
+# Workbooks above this size are split into sheet ranges instead of one task per file
+split_file_size = 20 * 1024 * 1024  # bytes
+sheets_per_task = 500
+
+
+def map_workbook_sheets(file_paths, sheet_handler, max_workers=None, by_file=False):
+    """
+        Applies `sheet_handler` to every sheet of the given Excel files using a process pool.
+
+        Work is chunked per file, and large files are further split into ranges of
+        `sheets_per_task` sheets so a single huge workbook also spreads across cores.
+        Each worker streams its sheets with `read_workbook`, so memory per worker stays constant.
+
+        Parameters:
+        -----------
+        file_paths : iterable of str
+            The Excel files to process.
+
+        sheet_handler : callable
+            A module level (picklable) function called as `sheet_handler(sheet_name, rows)`
+            for every sheet, where rows is a generator of dicts. Its return value is collected.
+
+        max_workers : int, optional
+            The number of worker processes. Defaults to `default_workers`.
+            With one worker, or a single task, the work runs in the calling process.
+
+        by_file : bool, optional
+            Return the results per file instead of one list.
+
+        Returns:
+        --------
+        results : list or dict
+            The handler results, ordered by file path and then sheet position, independent
+            of which worker finished first. With `by_file`, a dict of file path -> results
+            of the files that were processed.
+
+        errors : list of dicts
+            One {"file": ..., "error": ...} entry per file that could not be processed.
+            Results from the other files are still returned.
+    """
+
+    max_workers = max_workers or default_workers
+
+    # Split the files into (file_path, sheet_range) tasks
+    tasks = []
+    errors = []
+    for file_path in sorted(file_paths):
+        try:
+            tasks.extend(_file_tasks(file_path))
+        except Exception as e:
+            errors.append(_error(file_path, e))
+
+    # Run the tasks, in order of submission
+    outcomes = []
+    if max_workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            try:
+                outcomes.append((task, _process_task(task, sheet_handler)))
+            except Exception as e:
+                outcomes.append((task, e))
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+            futures = [(task, pool.submit(_process_task, task, sheet_handler)) for task in tasks]
+            for task, future in futures:
+                try:
+                    outcomes.append((task, future.result()))
+                except Exception as e:
+                    outcomes.append((task, e))
+
+    # Merge the results, a failing range drops its whole file so no patient is half read
+    failed_files = {task[0] for task, outcome in outcomes if isinstance(outcome, Exception)}
+    results = {}
+    for task, outcome in outcomes:
+        if isinstance(outcome, Exception):
+            errors.append(_error(task[0], outcome))
+        elif task[0] not in failed_files:
+            results.setdefault(task[0], []).extend(outcome)
+
+    for error in errors:
+        logger.warning("Error processing file %s: %s", error["file"], error["error"])
+
+    if not by_file:
+        results = [result for file_results in results.values() for result in file_results]
+    return results, errors
+
+
+def _file_tasks(file_path):
+    """ Returns the (file_path, sheet_range) tasks of one file """
+    if os.path.getsize(file_path) <= split_file_size:
+        return [(file_path, None)]
+
+    n_sheets = count_sheets(file_path)
+    return [(file_path, (start, start + sheets_per_task)) for start in range(0, n_sheets, sheets_per_task)]
+
+
+def _process_task(task, sheet_handler):
+    """ Runs the handler over the sheets of one task, in the worker process """
+    file_path, sheet_range = task
+    return [sheet_handler(sheet_name, rows) for sheet_name, rows in read_workbook(file_path, sheet_range=sheet_range)]
+
+
+def _error(file_path, error):
+    """ Returns the error report of one file """
+    return {"file": os.path.basename(file_path), "error": str(error)}
@@ -0,0 +1,50 @@
+# This file contains the match_table function
+
+# Third party imports
+from dash import dash_table, html
+
+# Local imports
+from src.utils.cohort_index import load_cohort_index
+from src.utils.hla_matching import find_matches
+from src.utils.output_path import output_path
+
+
+def match_table(patient_id, loci, level, top_k, require_qc_passed) -> dash_table.DataTable:
+    """ Returns the best matching cohort candidates for a query patient as a table """
+
+    if not patient_id:
+        return html.P("Select a patient to search for matches.")
+    if not loci:
+        return html.P("Select at least one locus to compare.")
+
+    try:
+        encoded = load_cohort_index(output_path)
+        matches = find_matches(encoded, patient_id, loci, level, top_k, require_qc_passed)
+    except (KeyError, ValueError) as e:
+        return html.P(f"An error occurred while searching for matches: {str(e)}")
+
+    return dash_table.DataTable(
+        data=matches.to_dict("records"),
+        style_table={
+            'width': '100%',
+            'height': '100%',
+            'borderRadius':'0.5rem',
+            'overflowX': 'auto',
+            'overflowY': 'auto',
+            'maxHeight': '90vh',  # Optional: limit the height to the viewport
+        },
+        style_cell={
+            'textAlign': 'center',
+            'padding': '5px',
+            'fontSize': '14px',
+        },
+        style_header={
+            'height':'2rem',
+            'backgroundColor': 'lightgray',
+            'fontWeight': 'bold',
+            'fontSize':'18'
+        },
+        style_data={
+            'backgroundColor': 'white',
+        }
+    )
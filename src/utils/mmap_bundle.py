@@ -0,0 +1,99 @@
+# This file contains the binary bundle format used to share read-only NumPy arrays between processes
+
+# Third party imports
+import numpy as np
+
+# Built in imports
+import os
+import json
+import struct
+
+
+# Declare the file signature and the alignment of the arrays in the file
+_magic = b"HLABNDL1"
+_alignment = 64
+
+
+def write_bundle(path, arrays, meta=None):
+    """
+        Writes NumPy arrays and JSON metadata to one binary file, replacing it atomically.
+
+        The file starts with a signature, the header length and a JSON header describing the
+        dtype, shape and offset of every array, followed by the raw array data. Readers that
+        already opened the previous file keep their mapping until they reopen it.
+
+        Parameters:
+        -----------
+        path : str
+            The file to write.
+
+        arrays : dict
+            Name -> np.ndarray. Object arrays are not supported, use fixed-width 'S' or 'U' dtypes.
+
+        meta : dict, optional
+            JSON-serializable metadata stored in the header.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # Lay out the arrays after the header, each aligned for direct memory mapping
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise TypeError(f"Array '{name}' has an object dtype, which cannot be memory mapped")
+        entries[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // _alignment) * _alignment
+
+    header = json.dumps({"arrays": entries, "meta": meta or {}}).encode("utf-8")
+    data_start = -(-(len(_magic) + 8 + len(header)) // _alignment) * _alignment
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_magic)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_bundle(path):
+    """
+        Memory maps a bundle written by `write_bundle`.
+
+        The arrays are read-only views on the mapped file, so nothing is parsed or copied
+        and every process mapping the same file shares its pages.
+
+        Parameters:
+        -----------
+        path : str
+            The file to read.
+
+        Returns:
+        --------
+        arrays : dict
+            Name -> read-only np.ndarray.
+
+        meta : dict
+            The metadata stored with the arrays.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(_magic)) != _magic:
+            raise ValueError(f"{path} is not an array bundle")
+        header_length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_length))
+
+    data_start = -(-(len(_magic) + 8 + header_length) // _alignment) * _alignment
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + entry["offset"]).reshape(shape)
+
+    return arrays, header["meta"]
@@ -1,2 +1,6 @@
 output_path = "data/outputs"
-folder_in_output_path = "output"
\ No newline at end of file
+folder_in_output_path = "output"
+input_path = "data/bestguess_G"
+cache_path = "data/cache"
+imgt_release_path = "data/imgt"
+spool_path = "data/spool"
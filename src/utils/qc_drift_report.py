@@ -0,0 +1,85 @@
+# This file contains the QC Drift Monitor plot
+
+# Third party imports
+from dash import dcc, html, dash_table
+import plotly.graph_objects as go
+
+# Local imports
+from src.utils.qc_monitor import load_qc_monitor, drift_report
+
+
+def qc_drift_report(output_path, metric) -> html.Div:
+    """ Returns the per-batch trend of a QC metric per locus and the table of flagged batches """
+
+    report = drift_report(load_qc_monitor(output_path))
+    if report.empty:
+        return html.Div([html.P("No samples have been added to the QC monitor yet.")])
+
+    report = report[report["METRIC"] == metric]
+    batches = list(dict.fromkeys(report["BATCH_ID"]))  # Keep the ingest order
+
+    # Create figure
+    fig = go.Figure()
+    fig.update_layout(
+        title=f"{metric} per Batch",
+        xaxis_title="Batch",
+        yaxis_title=metric,
+        template="plotly_white",
+        height=500,
+        legend=dict(
+            orientation='h',  # Horizontal legend
+            x=0.5,  # Position the legend in the center
+            xanchor='center',  # Anchors the legend to the center of x
+            y=-0.3,  # Position the legend below the plot
+            yanchor='bottom',  # Anchors the legend to the bottom of y
+        ),
+    )
+
+    # One line per locus, with the 10th to 90th percentile as error bars and the flagged batches marked
+    for locus, locus_report in report.groupby("LOCUS", sort=True):
+        locus_report = locus_report.set_index("BATCH_ID").reindex(batches)
+        fig.add_trace(
+            go.Scatter(
+                x=batches,
+                y=locus_report["MEAN"],
+                mode="lines+markers",
+                name=locus,
+                error_y=dict(
+                    type="data",
+                    symmetric=False,
+                    array=locus_report["P90"] - locus_report["MEAN"],
+                    arrayminus=locus_report["MEAN"] - locus_report["P10"],
+                    thickness=1,
+                ),
+                marker=dict(
+                    size=[12 if flagged is True else 6 for flagged in locus_report["FLAGGED"]],
+                    symbol=["x" if flagged is True else "circle" for flagged in locus_report["FLAGGED"]],
+                ),
+            )
+        )
+
+    flagged = report[report["FLAGGED"]].round(3)
+
+    return html.Div([
+        dcc.Graph(figure=fig, config={'displaylogo': False}),
+        html.H5(f"Batches flagged for degraded {metric}: {flagged['BATCH_ID'].nunique()}"),
+        dash_table.DataTable(
+            data=flagged.drop(columns=["METRIC", "FLAGGED"]).to_dict("records"),
+            style_table={
+                'width': '100%',
+                'borderRadius':'0.5rem',
+                'overflowX': 'auto',
+            },
+            style_cell={
+                'textAlign': 'center',
+                'padding': '5px',
+                'fontSize': '14px',
+            },
+            style_header={
+                'height':'2rem',
+                'backgroundColor': 'lightgray',
+                'fontWeight': 'bold',
+                'fontSize':'18'
+            },
+        ),
+    ])
@@ -0,0 +1,115 @@
+# This file contains the per-call QC metrics of the ingested samples, kept for re-evaluating the QC rules
+
+# Third party imports
+import pandas as pd
+
+# Built in imports
+import os
+import threading
+
+# Local imports
+from src.utils.file_lock import locked
+from src.utils.hla_loci import normalize_locus
+from src.utils.typing_parsers import reports_metric
+
+
+# Declare the HLA-LA metrics the QC rules are evaluated on
+qc_metric_columns = ["Q1", "proportionkMersCovered", "AverageCoverage"]
+
+# Declare the columns of the stored metrics
+qc_metrics_columns = ["TRIAL_ID", "PATIENT_ID", "LOCUS", "CHROMOSOME_COPY"] + qc_metric_columns
+
+# Declare the folder of the metrics, one CSV per trial next to the trial workbooks
+qc_metrics_folder_name = "qc_metrics"
+
+# Metrics per output path, reused until a trial file changes
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def record_qc_metrics(output_path, trial_id, sample_id, data):
+    """
+        Adds or replaces the QC metrics of one sample in the file of its trial.
+
+        The workbooks only keep the QC outcome, so the metrics are stored here to let the
+        QC thresholds be re-evaluated over the cohort without the original output files.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory where the trial Excel files are stored.
+
+        trial_id : str
+        sample_id : str
+
+        data : pd.DataFrame
+            The HLA-LA output of the sample, with Locus, Chromosome and the `qc_metric_columns`.
+    """
+    folder = os.path.join(output_path, qc_metrics_folder_name)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{_safe_name(trial_id)}.csv")
+
+    rows = pd.DataFrame({
+        "TRIAL_ID": str(trial_id),
+        "PATIENT_ID": str(sample_id),
+        "LOCUS": data["Locus"].map(normalize_locus),
+        "CHROMOSOME_COPY": pd.to_numeric(data["Chromosome"], errors="coerce"),
+        **{column: pd.to_numeric(data[column], errors="coerce") for column in qc_metric_columns},
+    }, columns=qc_metrics_columns)
+
+    # Leave out the calls of callers that do not report the metrics
+    reported = pd.concat([reports_metric(data, column) for column in qc_metric_columns], axis=1).any(axis=1)
+    rows = rows[reported.to_numpy()]
+    if rows.empty and not os.path.exists(path):
+        return
+
+    with locked(path):
+        if os.path.exists(path):
+            trial = pd.read_csv(path, dtype={"TRIAL_ID": str, "PATIENT_ID": str})
+            rows = pd.concat([trial[trial["PATIENT_ID"] != str(sample_id)], rows], ignore_index=True)
+
+        # Swap the file in, so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        rows.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+
+def load_qc_metrics(output_path) -> pd.DataFrame:
+    """
+        Returns the QC metrics of every recorded sample, one row per locus and chromosome copy.
+
+        The table is read once and cached in the process until a trial file is added,
+        removed or modified. Samples ingested before the metrics were recorded are missing
+        until they are ingested again.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory where the trial Excel files are stored.
+
+        Returns:
+        --------
+        metrics : pd.DataFrame
+            The `qc_metrics_columns`, with float metrics.
+    """
+    folder = os.path.join(output_path, qc_metrics_folder_name)
+    file_paths = sorted(
+        os.path.join(folder, file_name) for file_name in os.listdir(folder) if file_name.endswith(".csv")
+    ) if os.path.isdir(folder) else []
+    signature = tuple((path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in file_paths)
+
+    with _cache_lock:
+        entry = _cache.get(output_path)
+        if entry is None or entry[0] != signature:
+            trials = [pd.read_csv(path, dtype={"TRIAL_ID": str, "PATIENT_ID": str}) for path in file_paths]
+            metrics = pd.concat(trials, ignore_index=True) if trials else pd.DataFrame(columns=qc_metrics_columns)
+            metrics[qc_metric_columns] = metrics[qc_metric_columns].astype(float)
+            entry = (signature, metrics)
+            _cache[output_path] = entry
+
+    return entry[1]
+
+
+def _safe_name(trial_id) -> str:
+    """ Returns the trial ID as a file name """
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(trial_id))
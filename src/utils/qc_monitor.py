@@ -0,0 +1,260 @@
+# This file contains the streaming per-locus QC drift monitor
+
+# Third party imports
+import pandas as pd
+
+# Built in imports
+import os
+import json
+import math
+import datetime
+
+# Local imports
+from src.utils.file_lock import locked, write_json_atomic
+from src.utils.hla_loci import normalize_locus
+
+
+# Declare the monitored HLA-LA metrics and the direction in which they degrade
+monitored_metrics = {
+    "AverageCoverage": "low",
+    "CoverageFirstDecile": "low",
+    "MinimumCoverage": "low",
+    "Q1": "low",
+    "LocusAvgColumnError": "high",
+}
+
+# Declare the quantiles tracked per locus and metric
+monitored_quantiles = [0.1, 0.5, 0.9]
+
+# Declare the drift rule, a batch is flagged when its mean is this many standard errors from the baseline
+drift_z_threshold = 3.0
+drift_min_samples = 3
+
+# Declare the state folder, stored next to the trial workbooks
+monitor_folder_name = "qc_monitor"
+
+
+def update_qc_monitor(output_path, batch_id, trial_id, data):
+    """
+        Adds the rows of one sample to the baseline and batch statistics.
+
+        Every row updates a running mean and variance (Welford) and P² quantile sketches per
+        locus and metric, each in constant time and memory. Only the baseline and the file
+        of the sample's batch are read and written, so the cost of an update does not grow
+        with the history. Callers add each sample once, a replaced sample keeps its first rows.
+
+        The statistics are kept per batch, the samples sequenced or ingested together, so a
+        degraded batch is not averaged away in the running mean of a long trial.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory where the trial Excel files are stored.
+
+        batch_id : str
+            The batch the sample was ingested in, whose samples are compared against the baseline.
+
+        trial_id : str
+            The trial the sample belongs to, kept with the batch to group batches by trial.
+
+        data : pd.DataFrame
+            The HLA-LA output of the sample, with a Locus column and the `monitored_metrics`.
+    """
+    folder = os.path.join(output_path, monitor_folder_name)
+    os.makedirs(os.path.join(folder, "batches"), exist_ok=True)
+    baseline_path = os.path.join(folder, "baseline.json")
+    batch_path = os.path.join(folder, "batches", f"{_safe_name(batch_id)}.json")
+
+    with locked(baseline_path):
+        baseline = _read_json(baseline_path, {"samples": 0, "loci": {}})
+        batch = _read_json(batch_path, {"batch_id": str(batch_id), "trial_ids": [], "samples": 0, "first_sample": baseline["samples"], "loci": {}})
+        batch["trial_ids"] = sorted(set(batch["trial_ids"]) | {str(trial_id)})
+
+        for row in data.to_dict("records"):
+            locus = normalize_locus(row["Locus"])
+            for metric in monitored_metrics:
+                value = pd.to_numeric(row.get(metric), errors="coerce")
+                if pd.isna(value): continue
+                for state in (baseline, batch):
+                    update_stats(state["loci"].setdefault(locus, {}).setdefault(metric, new_stats()), float(value))
+
+        batch["samples"] += 1
+        baseline["samples"] += 1
+        write_json_atomic(batch_path, batch)
+        write_json_atomic(baseline_path, baseline)
+
+
+def upload_batch_id(trial_id) -> str:
+    """ Returns the batch of a sample uploaded on its own, the samples of its trial uploaded the same day """
+    return f"{trial_id} {datetime.date.today().isoformat()}"
+
+
+def load_qc_monitor(output_path) -> dict:
+    """ Returns the baseline and the batch states, batches ordered by when their first sample was ingested """
+    folder = os.path.join(output_path, monitor_folder_name)
+    baseline = _read_json(os.path.join(folder, "baseline.json"), {"samples": 0, "loci": {}})
+
+    batches_folder = os.path.join(folder, "batches")
+    batches = []
+    if os.path.isdir(batches_folder):
+        for file_name in os.listdir(batches_folder):
+            if file_name.endswith(".json"):
+                batches.append(_read_json(os.path.join(batches_folder, file_name), None))
+    batches = sorted([batch for batch in batches if batch], key=lambda batch: (batch["first_sample"], batch["batch_id"]))
+
+    return {"baseline": baseline, "batches": batches}
+
+
+def drift_report(state, z_threshold=drift_z_threshold, min_samples=drift_min_samples) -> pd.DataFrame:
+    """
+        Returns the per-batch, per-locus statistics of every monitored metric, with drift flags.
+
+        A batch is compared against the baseline without its own samples. It is flagged when
+        its mean lies more than `z_threshold` standard errors from the baseline mean, in the
+        direction in which the metric degrades.
+
+        Parameters:
+        -----------
+        state : dict
+            The monitor state (see `load_qc_monitor`).
+
+        Returns:
+        --------
+        report : pd.DataFrame
+            BATCH_ID, TRIAL_ID (the trials of the batch, comma separated), LOCUS, METRIC, N,
+            MEAN, STD, P10, P50, P90, BASELINE_MEAN, Z and FLAGGED.
+    """
+    rows = []
+    for batch in state["batches"]:
+        for locus, metrics in batch["loci"].items():
+            for metric, stats in metrics.items():
+                total = state["baseline"]["loci"].get(locus, {}).get(metric)
+                reference = subtract_stats(total, stats) if total else None
+
+                z = None
+                if reference and reference["n"] >= min_samples and stats["n"] >= min_samples:
+                    std = math.sqrt(reference["m2"] / (reference["n"] - 1))
+                    if std > 0:
+                        z = (stats["mean"] - reference["mean"]) / (std / math.sqrt(stats["n"]))
+
+                degraded = z is not None and (z < -z_threshold if monitored_metrics[metric] == "low" else z > z_threshold)
+                rows.append({
+                    "BATCH_ID": batch["batch_id"],
+                    "TRIAL_ID": ", ".join(batch["trial_ids"]),
+                    "LOCUS": locus,
+                    "METRIC": metric,
+                    "N": stats["n"],
+                    "MEAN": stats["mean"],
+                    "STD": math.sqrt(stats["m2"] / (stats["n"] - 1)) if stats["n"] > 1 else 0.0,
+                    "P10": quantile_estimate(stats["quantiles"]["0.1"]),
+                    "P50": quantile_estimate(stats["quantiles"]["0.5"]),
+                    "P90": quantile_estimate(stats["quantiles"]["0.9"]),
+                    "BASELINE_MEAN": reference["mean"] if reference and reference["n"] else None,
+                    "Z": z,
+                    "FLAGGED": degraded,
+                })
+
+    return pd.DataFrame(rows, columns=["BATCH_ID", "TRIAL_ID", "LOCUS", "METRIC", "N", "MEAN", "STD", "P10", "P50", "P90", "BASELINE_MEAN", "Z", "FLAGGED"])
+
+
+def new_stats() -> dict:
+    """ Returns empty running statistics """
+    return {
+        "n": 0, "mean": 0.0, "m2": 0.0, "min": None, "max": None,
+        "quantiles": {str(p): new_quantile_sketch(p) for p in monitored_quantiles},
+    }
+
+
+def update_stats(stats, value):
+    """ Adds a value to running statistics in constant time """
+    stats["n"] += 1
+    delta = value - stats["mean"]
+    stats["mean"] += delta / stats["n"]
+    stats["m2"] += delta * (value - stats["mean"])
+    stats["min"] = value if stats["min"] is None else min(stats["min"], value)
+    stats["max"] = value if stats["max"] is None else max(stats["max"], value)
+    for sketch in stats["quantiles"].values():
+        update_quantile_sketch(sketch, value)
+
+
+def subtract_stats(total, part):
+    """ Returns the count, mean and squared deviations of `total` without the values of `part` """
+    n = total["n"] - part["n"]
+    if n <= 0:
+        return {"n": 0, "mean": 0.0, "m2": 0.0}
+
+    mean = (total["n"] * total["mean"] - part["n"] * part["mean"]) / n
+    delta = part["mean"] - mean
+    m2 = total["m2"] - part["m2"] - delta ** 2 * n * part["n"] / total["n"]
+    return {"n": n, "mean": mean, "m2": max(m2, 0.0)}
+
+
+def new_quantile_sketch(p) -> dict:
+    """ Returns an empty P² sketch of the p-quantile (Jain & Chlamtac), five markers in constant memory """
+    return {"p": p, "count": 0, "q": [], "n": [1, 2, 3, 4, 5], "np": [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]}
+
+
+def update_quantile_sketch(sketch, value):
+    """ Adds a value to a P² sketch in constant time """
+    p, q, n, np_ = sketch["p"], sketch["q"], sketch["n"], sketch["np"]
+    sketch["count"] += 1
+
+    # Fill the markers with the first five values
+    if sketch["count"] <= 5:
+        q.append(value)
+        q.sort()
+        return
+
+    # Find the cell of the value, extending the extreme markers
+    if value < q[0]:
+        q[0] = value
+        k = 0
+    elif value >= q[4]:
+        q[4] = value
+        k = 3
+    else:
+        k = next(i for i in range(4) if q[i] <= value < q[i + 1])
+
+    for i in range(k + 1, 5):
+        n[i] += 1
+    for i, dn in enumerate([0, p / 2, p, (1 + p) / 2, 1]):
+        np_[i] += dn
+
+    # Adjust the middle markers towards their desired positions
+    for i in range(1, 4):
+        d = np_[i] - n[i]
+        if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+            d = 1 if d > 0 else -1
+            parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+            )
+            if q[i - 1] < parabolic < q[i + 1]:
+                q[i] = parabolic
+            else:
+                q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+            n[i] += d
+
+
+def quantile_estimate(sketch):
+    """ Returns the current estimate of a P² sketch, or None when it is empty """
+    q = sketch["q"]
+    if not q:
+        return None
+    if sketch["count"] < 5:
+        return q[min(int(sketch["p"] * len(q)), len(q) - 1)]
+    return q[2]
+
+
+def _read_json(path, default):
+    """ Returns the JSON content of a file, or `default` when it does not exist """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _safe_name(batch_id) -> str:
+    """ Returns the batch ID as a file name """
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(batch_id))
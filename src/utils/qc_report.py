@@ -6,13 +6,45 @@ from dash import dcc
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 
+# Built in imports
+import json
+
 # Local imports
 from src.utils.hovertemplate import hovertemplate1, hovertemplate2
+from src.utils.render_cache import cached_render
+from src.utils.typing_parsers import sample_name, data_caller
+
+# Bump when the figure definition changes in a way the source hash does not capture
+figure_version = 1
 
-def qc_report(data0, filename) -> dcc.Graph:
+
+def qc_report(data0, filename, digest=None) -> dcc.Graph:
     """  """
-    # Extract the data from the data object and set datatypes
-    data = pd.DataFrame.from_dict(data0["props"]["data"])
+    # Build the figure, or read it from the render cache when the sample content hash is known
+    if digest is None:
+        figure = build_qc_figure(pd.DataFrame.from_dict(data0["props"]["data"]), filename)
+    else:
+        figure = json.loads(cached_render(
+            "qc_figure", digest, filename, figure_version,
+            lambda: build_qc_figure(pd.DataFrame.from_dict(data0["props"]["data"]), filename).to_json(),
+        ))
+
+    # Wrap the plot inside a Graph component
+    return dcc.Graph(
+        figure=figure,
+        config={
+            'displayModeBar': True,  # Show the mode bar (zoom, pan, etc.)
+            'scrollZoom': True,      # Enable zooming with mouse scroll
+            'displaylogo': False,    # Hide the Plotly logo
+            'editable': False        # Make the graph non-editable
+        }
+    )
+
+
+def build_qc_figure(data, filename) -> go.Figure:
+    """ Returns the Quality Control Report figure of the loaded typing output rows """
+    # Set datatypes
+    data = data.copy()
     data["Chromosome"] = data["Chromosome"].astype(int)
     data["Locus"] = data["Locus"].astype(str)
     data["AverageCoverage"] = data["AverageCoverage"].astype(float)
@@ -21,7 +53,7 @@ def qc_report(data0, filename) -> dcc.Graph:
     data["proportionkMersCovered"] = data["proportionkMersCovered"].astype(float)
     
     # Extract sample name
-    sample = str(filename).split("_R1")[0]
+    sample = sample_name(str(filename).split("_R1")[0], data_caller(data))
 
     # Create figure
 
@@ -165,14 +197,4 @@ def qc_report(data0, filename) -> dcc.Graph:
                 row=2, col=i+1,
         )
 
-    # Wrap the plot inside a Graph component
-    return dcc.Graph(
-        figure=fig,
-        config={
-            'displayModeBar': True,  # Show the mode bar (zoom, pan, etc.)
-            'scrollZoom': True,      # Enable zooming with mouse scroll
-            'displaylogo': False,    # Hide the Plotly logo
-            'editable': False        # Make the graph non-editable
-        }
-    )
-
+    return fig
@@ -0,0 +1,60 @@
+# This file contains the quality control rules applied to the HLA-LA output
+
+# Third party imports
+import pandas as pd
+
+# Built in imports
+import json
+import hashlib
+
+# Local imports
+from src.utils.typing_parsers import reports_metric
+
+
+# Declare the QC thresholds
+qc_rules = {
+    "min_average_coverage": 2,  # ambiguous value
+    "min_q1": 1.0,
+    "min_proportion_kmers_covered": 1.0,
+}
+
+# Bump when the meaning of the rules changes without the thresholds changing
+qc_rules_revision = 2
+
+
+def qc_passed(data, rules=qc_rules) -> pd.Series:
+    """
+        Returns whether each row of the HLA-LA output passes the quality control.
+
+        A row passes when Q1 is at least `min_q1` and either proportionkMersCovered is at
+        least `min_proportion_kmers_covered` or AverageCoverage is above `min_average_coverage`.
+        With the default rules this is: Q1 is 1, and all k-mers are covered or the average
+        coverage is above 2. Metrics the row's caller does not report (see
+        `typing_parsers.register_caller`) do not fail it, while a missing metric of a caller
+        that reports it, such as a corrupt HLA-LA row, does.
+
+        Parameters:
+        -----------
+        data : pd.DataFrame
+            The HLA-LA output with float Q1, proportionkMersCovered and AverageCoverage columns,
+            and the Caller column of `typing_parsers.parse_typing`. Rows without one are held
+            to all the rules.
+
+        rules : dict, optional
+            The thresholds to apply. Defaults to `qc_rules`.
+
+        Returns:
+        --------
+        passed : pd.Series of bool
+    """
+    q1_passed = (data["Q1"] >= rules["min_q1"]) | ~reports_metric(data, "Q1")
+    kmers_passed = data["proportionkMersCovered"] >= rules["min_proportion_kmers_covered"]
+    coverage_passed = data["AverageCoverage"] > rules["min_average_coverage"]
+    depth_reported = reports_metric(data, "proportionkMersCovered") | reports_metric(data, "AverageCoverage")
+    return q1_passed & (kmers_passed | coverage_passed | ~depth_reported)
+
+
+def qc_rules_version(rules=qc_rules) -> str:
+    """ Returns a short hash identifying the QC rules, used to invalidate cached results """
+    payload = json.dumps({"rules": rules, "revision": qc_rules_revision}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
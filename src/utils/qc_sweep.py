@@ -0,0 +1,143 @@
+# This file contains the what-if sweep of the QC thresholds over the cohort
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Local imports
+from src.utils.qc_rules import qc_rules
+
+
+# Declare the thresholds evaluated per QC rule, in ascending order
+qc_sweep_grid = {
+    "min_q1": np.round(np.linspace(0.9, 1.0, 21), 3),
+    "min_proportion_kmers_covered": np.round(np.linspace(0.9, 1.0, 21), 3),
+    "min_average_coverage": np.arange(0, 41, 2),
+}
+
+# Declare the metric each QC rule applies to
+qc_rule_metrics = {
+    "min_q1": "Q1",
+    "min_proportion_kmers_covered": "proportionkMersCovered",
+    "min_average_coverage": "AverageCoverage",
+}
+
+# Declare the groupings of the calls, and their code array and group labels in the cohort index
+qc_sweep_groupings = {
+    "LOCUS": ("qc_locus", "qc_loci"),
+    "TRIAL_ID": ("qc_trial", "qc_trials"),
+}
+
+# Sweeps of the last cohort index, per grouping
+_cache = {}
+
+
+def qc_threshold_sweep(metrics, by=None, grid=qc_sweep_grid) -> dict:
+    """
+        Returns the number of HLA calls passing the QC for every combination of thresholds in the grid.
+
+        The rule is the one of `qc_rules.qc_passed`: Q1 at least `min_q1`, and either
+        proportionkMersCovered at least `min_proportion_kmers_covered` or AverageCoverage
+        above `min_average_coverage`. Each metric array is broadcast against its thresholds
+        to count how many of them every call clears. The calls are then binned on these
+        counts per group, and suffix sums over the bins give the pass counts of the whole
+        grid. The cost is linear in the cohort size plus the grid size, not their product.
+
+        The metrics are read from the memory-mapped cohort index, so every worker shares one
+        copy and none reads the QC metrics files.
+
+        Parameters:
+        -----------
+        metrics : dict
+            The cohort index (see `cohort_index.load_cohort_index`), with the "qc_metrics"
+            array of one row per call and a column per QC metric.
+
+        by : str, optional
+            The grouping of the calls, one of `qc_sweep_groupings`. All calls form one group
+            when missing.
+
+        grid : dict, optional
+            The ascending thresholds per QC rule. Defaults to `qc_sweep_grid`.
+
+        Returns:
+        --------
+        sweep : dict
+            "groups" (list), "total" (int array of calls per group) and "passed" (int array
+            of shape groups × min_q1 × min_proportion_kmers_covered × min_average_coverage).
+    """
+    q1 = np.asarray(grid["min_q1"], dtype=float)
+    kmers = np.asarray(grid["min_proportion_kmers_covered"], dtype=float)
+    coverage = np.asarray(grid["min_average_coverage"], dtype=float)
+
+    values, columns = metrics["qc_metrics"], metrics["qc_metric_columns"]
+    if by is None:
+        codes, groups = np.zeros(len(values), dtype=np.int64), ["All"]
+    else:
+        codes_name, groups_name = qc_sweep_groupings[by]
+        codes, groups = metrics[codes_name], list(metrics[groups_name])
+
+    # Count the thresholds each call clears, a call clears threshold j of a rule when its count is above j
+    q1_cleared = (values[:, columns.index("Q1")][:, None] >= q1[None, :]).sum(axis=1)
+    kmers_cleared = (values[:, columns.index("proportionkMersCovered")][:, None] >= kmers[None, :]).sum(axis=1)
+    coverage_cleared = (values[:, columns.index("AverageCoverage")][:, None] > coverage[None, :]).sum(axis=1)
+
+    # Bin the calls per group and cleared counts
+    shape = (len(groups), len(q1) + 1, len(kmers) + 1, len(coverage) + 1)
+    bins = np.ravel_multi_index((codes, q1_cleared, kmers_cleared, coverage_cleared), shape)
+    counts = np.bincount(bins, minlength=int(np.prod(shape))).reshape(shape)
+
+    # Calls passing the Q1 threshold, then the k-mer or the coverage threshold
+    q1_passed = _suffix_sum(counts, axis=1)[:, 1:]
+    kmers_passed = _suffix_sum(q1_passed.sum(axis=3), axis=2)[:, :, 1:]
+    coverage_passed = _suffix_sum(q1_passed.sum(axis=2), axis=2)[:, :, 1:]
+    both_passed = _suffix_sum(_suffix_sum(q1_passed, axis=2), axis=3)[:, :, 1:, 1:]
+    passed = kmers_passed[:, :, :, None] + coverage_passed[:, :, None, :] - both_passed
+
+    return {"groups": groups, "total": counts.sum(axis=(1, 2, 3)), "passed": passed}
+
+
+def cached_threshold_sweep(metrics, by=None) -> dict:
+    """ Returns `qc_threshold_sweep` over the default grid, computed once per cohort index and grouping """
+    key = (id(metrics), by)
+    if _cache.get("metrics") is not metrics:
+        _cache.clear()
+        _cache["metrics"] = metrics
+    if key not in _cache:
+        _cache[key] = qc_threshold_sweep(metrics, by)
+    return _cache[key]
+
+
+def sweep_pass_rates(sweep, rules=qc_rules, grid=qc_sweep_grid) -> pd.Series:
+    """ Returns the pass rate per group at the grid thresholds closest to `rules` """
+    index = tuple(grid_index(grid[rule], rules[rule]) for rule in qc_rule_metrics)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = sweep["passed"][(slice(None),) + index] / sweep["total"]
+    return pd.Series(rates, index=sweep["groups"])
+
+
+def sweep_curve(sweep, rule, rules=qc_rules, grid=qc_sweep_grid) -> pd.DataFrame:
+    """
+        Returns the pass rate per group along the thresholds of one rule, the other rules held at `rules`.
+
+        Returns:
+        --------
+        curve : pd.DataFrame
+            One row per threshold of `rule` in the grid and one column per group.
+    """
+    index = tuple(
+        slice(None) if other == rule else grid_index(grid[other], rules[other])
+        for other in qc_rule_metrics
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = sweep["passed"][(slice(None),) + index] / sweep["total"][:, None]
+    return pd.DataFrame(rates.T, index=grid[rule], columns=sweep["groups"])
+
+
+def grid_index(thresholds, value) -> int:
+    """ Returns the index of the threshold closest to `value` """
+    return int(np.abs(np.asarray(thresholds, dtype=float) - float(value)).argmin())
+
+
+def _suffix_sum(array, axis):
+    """ Returns the sums of `array` from every position to the end of `axis` """
+    return np.flip(np.flip(array, axis=axis).cumsum(axis=axis), axis=axis)
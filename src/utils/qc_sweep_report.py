@@ -0,0 +1,90 @@
+# This file contains the QC Threshold Explorer plots
+
+# Third party imports
+import pandas as pd
+from dash import dcc, html, dash_table
+from plotly.subplots import make_subplots
+import plotly.graph_objects as go
+
+# Local imports
+from src.utils.qc_rules import qc_rules
+from src.utils.cohort_index import load_cohort_index
+from src.utils.qc_sweep import cached_threshold_sweep, sweep_curve, sweep_pass_rates, qc_rule_metrics
+
+
+def qc_sweep_report(output_path, rules) -> html.Div:
+    """ Returns the pass rate tradeoff curves and the pass rates per trial under the selected QC thresholds """
+
+    metrics = load_cohort_index(output_path)
+    if len(metrics["qc_metrics"]) == 0:
+        return html.Div([html.P("No QC metrics have been recorded yet, they are added when samples are ingested.")])
+
+    overall = cached_threshold_sweep(metrics)
+    per_locus = cached_threshold_sweep(metrics, "LOCUS")
+    per_trial = cached_threshold_sweep(metrics, "TRIAL_ID")
+
+    # Create figure, one tradeoff curve per rule with the other rules held at the selected thresholds
+    fig = make_subplots(rows=1, cols=len(qc_rule_metrics), shared_yaxes=True, subplot_titles=list(qc_rule_metrics.values()))
+    fig.update_layout(
+        title="Pass Rate per Threshold",
+        yaxis_title="Pass rate",
+        template="plotly_white",
+        height=500,
+        legend=dict(
+            orientation='h',  # Horizontal legend
+            x=0.5,  # Position the legend in the center
+            xanchor='center',  # Anchors the legend to the center of x
+            y=-0.3,  # Position the legend below the plot
+            yanchor='bottom',  # Anchors the legend to the bottom of y
+        ),
+    )
+
+    for col, rule in enumerate(qc_rule_metrics, start=1):
+        curves = pd.concat([sweep_curve(overall, rule, rules), sweep_curve(per_locus, rule, rules)], axis=1)
+        for group in curves.columns:
+            fig.add_trace(
+                go.Scatter(
+                    x=curves.index,
+                    y=curves[group],
+                    mode="lines",
+                    name=group,
+                    legendgroup=group,
+                    showlegend=col == 1,
+                    line=dict(width=4 if group == "All" else 1.5),
+                ),
+                row=1, col=col,
+            )
+        fig.add_vline(x=rules[rule], line_dash="dash", line_color="gray", row=1, col=col)
+
+    # Compare the pass rates per trial with the current rules
+    trials = pd.DataFrame({
+        "TRIAL_ID": per_trial["groups"] + ["All"],
+        "CALLS": list(per_trial["total"]) + list(overall["total"]),
+        "CURRENT_PASS_RATE": list(sweep_pass_rates(per_trial, qc_rules)) + list(sweep_pass_rates(overall, qc_rules)),
+        "SELECTED_PASS_RATE": list(sweep_pass_rates(per_trial, rules)) + list(sweep_pass_rates(overall, rules)),
+    })
+    trials["CHANGE"] = trials["SELECTED_PASS_RATE"] - trials["CURRENT_PASS_RATE"]
+
+    return html.Div([
+        dcc.Graph(figure=fig, config={'displaylogo': False}),
+        html.H5(f"Pass rate per trial, current rules {qc_rules}"),
+        dash_table.DataTable(
+            data=trials.round(4).to_dict("records"),
+            style_table={
+                'width': '100%',
+                'borderRadius':'0.5rem',
+                'overflowX': 'auto',
+            },
+            style_cell={
+                'textAlign': 'center',
+                'padding': '5px',
+                'fontSize': '14px',
+            },
+            style_header={
+                'height':'2rem',
+                'backgroundColor': 'lightgray',
+                'fontWeight': 'bold',
+                'fontSize':'18'
+            },
+        ),
+    ])
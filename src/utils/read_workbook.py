@@ -0,0 +1,78 @@
+# This file contains the read_workbook function that streams the sheets of an Excel file
+
+# Third party imports
+from openpyxl import load_workbook
+
+
+def read_workbook(file_path, skip_sheets=("Sheet",), sheet_range=None):
+    """
+        Streams an Excel file one sheet at a time using openpyxl's read-only mode.
+
+        Only the sheet currently being iterated is parsed, so memory use stays constant
+        regardless of how many sheets the workbook holds. Cell values keep the types
+        openpyxl reads them as (int, float, str, bool, datetime, None).
+
+        Parameters:
+        -----------
+        file_path : str
+            The path of the Excel file to read.
+
+        skip_sheets : tuple of str
+            Sheet names to skip without loading them. Defaults to the "Sheet" sheet
+            openpyxl adds when a new workbook is created.
+
+        sheet_range : tuple of int, optional
+            A (start, stop) slice of sheet positions to read, so one large workbook can be
+            split across workers. Defaults to all sheets.
+
+        Yields:
+        -------
+        sheet_name : str
+            The name of the sheet.
+
+        rows : generator of dicts
+            The rows of the sheet, keyed by the header row. Must be consumed before the
+            next sheet is requested.
+
+        Notes:
+        ------
+        - Sheets without a header row are skipped.
+        - Fully empty rows are skipped.
+    """
+
+    # Open the workbook lazily, nothing but the sheet index is parsed here
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+
+    try:
+        worksheets = wb.worksheets if sheet_range is None else wb.worksheets[slice(*sheet_range)]
+
+        for ws in worksheets:
+            # Skip the default sheet without touching its rows
+            if ws.title in skip_sheets: continue
+
+            values = ws.iter_rows(values_only=True)
+            header = next(values, None)
+
+            # Skip the empty sheet
+            if header is None: continue
+
+            yield ws.title, _rows(header, values)
+    finally:
+        # Read-only workbooks keep the file handle open until closed
+        wb.close()
+
+
+def _rows(header, values):
+    """ Yields the sheet rows as dicts keyed by the header """
+    for row in values:
+        if all(value is None for value in row): continue
+        yield dict(zip(header, row))
+
+
+def count_sheets(file_path) -> int:
+    """ Returns the number of sheets in an Excel file without reading any of them """
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        return len(wb.sheetnames)
+    finally:
+        wb.close()
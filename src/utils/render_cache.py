@@ -0,0 +1,136 @@
+# This file contains the disk-backed cache of rendered QC figures and report tables
+
+# Built in imports
+import os
+import uuid
+import hashlib
+import logging
+
+# Local imports
+from src.utils.output_path import cache_path
+from src.utils.qc_rules import qc_rules_version
+
+
+logger = logging.getLogger(__name__)
+
+# Declare the cache folder and its size bound
+render_cache_path = os.path.join(cache_path, "render")
+max_cache_bytes = int(os.environ.get("HLA_RENDER_CACHE_BYTES", 256 * 1024 * 1024))
+
+# Declare the modules whose source decides the rendered output
+_source_files = ["qc_report.py", "final_table.py", "qc_rules.py", "hovertemplate.py", "load_data.py", "typing_parsers.py", "hla_loci.py"]
+
+# Bytes written by this process since the cache size was last checked
+_written_since_eviction = 0
+
+
+def _code_version() -> str:
+    """ Returns a hash of the rendering source files, so code changes invalidate the cache """
+    digest = hashlib.sha256()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for file_name in _source_files:
+        with open(os.path.join(folder, file_name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+code_version = _code_version()
+
+
+def cached_render(kind, digest, filename, version, build) -> str:
+    """
+        Returns a rendered payload from the disk cache, building and storing it on a miss.
+
+        Entries are keyed by the sample content hash, the file name, the QC rule version,
+        the payload version and a hash of the rendering code, so a change to any of them
+        is a miss. The cache is shared by every worker on the host: entries are written to a
+        temporary file and renamed into place, and eviction tolerates files removed by others.
+
+        Parameters:
+        -----------
+        kind : str
+            The kind of payload, e.g. "qc_figure" or "final_report".
+
+        digest : str
+            The content hash of the sample (see `sample_index.content_hash`).
+
+        filename : str
+            The uploaded file name, which the rendered payload depends on.
+
+        version : int
+            The version of the payload definition.
+
+        build : callable
+            Called without arguments on a miss, returns the payload as a str.
+
+        Returns:
+        --------
+        payload : str
+    """
+    key = hashlib.sha256(
+        f"{kind}|{digest}|{filename}|{version}|{qc_rules_version()}|{code_version}".encode("utf-8")
+    ).hexdigest()
+    entry_path = os.path.join(render_cache_path, key[:2], f"{key}.json")
+
+    # Hit, mark the entry as recently used
+    try:
+        with open(entry_path, encoding="utf-8") as f:
+            payload = f.read()
+        os.utime(entry_path)
+        return payload
+    except FileNotFoundError:
+        pass
+
+    # Miss, build and store the payload
+    payload = build()
+    try:
+        _write_entry(entry_path, payload)
+    except OSError as e:
+        logger.warning("Could not write render cache entry %s: %s", entry_path, e)
+
+    return payload
+
+
+def _write_entry(entry_path, payload):
+    """ Writes a cache entry atomically and evicts old entries when the cache is over its bound """
+    global _written_since_eviction
+
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    # Unique per write, as threads of one worker may store the same entry at once
+    tmp_path = f"{entry_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload)
+    os.replace(tmp_path, entry_path)
+
+    # Only scan the cache once a tenth of its bound was written by this process
+    _written_since_eviction += len(payload)
+    if _written_since_eviction >= max_cache_bytes // 10:
+        _written_since_eviction = 0
+        evict(max_cache_bytes)
+
+
+def evict(max_bytes):
+    """ Removes the least recently used entries until the cache is below 90% of `max_bytes` """
+    entries = []
+    for folder, _, file_names in os.walk(render_cache_path):
+        for file_name in file_names:
+            if not file_name.endswith(".json"): continue
+            path = os.path.join(folder, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return
+
+    # Oldest first
+    for _, size, path in sorted(entries):
+        if total <= max_bytes * 0.9: break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
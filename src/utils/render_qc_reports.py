@@ -0,0 +1,214 @@
+# This file contains the offline batch renderer of the QC reports to static images and PDFs for archival
+
+# Third party imports
+import plotly.io as pio
+import plotly.graph_objects as go
+
+# Built in imports
+import os
+import sys
+import atexit
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Optional imports, only needed to render
+try:
+    import kaleido
+except ImportError:
+    kaleido = None
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# Local imports
+from src.utils.typing_parsers import parse_typing, detect_caller, sample_name, is_typing_file, header_size
+from src.utils.qc_report import build_qc_figure
+from src.utils.map_workbook_sheets import default_workers
+
+
+logger = logging.getLogger(__name__)
+
+# Declare the formats rendered per sample
+render_formats = ["png", "svg", "pdf"]
+
+# Declare the resolution of the PNG images, as a multiple of the figure size
+png_scale = 2
+
+
+def render_qc_reports(input_path, archive_path, formats=render_formats, trial_pdf=True, overwrite=False, max_workers=None):
+    """
+        Renders the Quality Control Report of every typing output file in a folder.
+
+        The figure is the one of `qc_report.build_qc_figure`, written per sample to
+        archive_path/<trial>/<sample>.<format>. With `trial_pdf`, the sample PDFs of each
+        trial are merged in sample order into archive_path/<trial>/<trial>_qc_report.pdf,
+        again only when one of the trial's samples is rendered.
+
+        The samples are spread over a process pool. Each worker starts its headless
+        renderer once, when the pool starts it, and reuses it for all its samples, so the
+        start-up cost is paid per worker and not per image.
+
+        Parameters:
+        -----------
+        input_path : str
+            The folder with the typing output files, of any caller in `typing_parsers.typing_callers`.
+
+        archive_path : str
+            The folder the reports are written to.
+
+        formats : list of str, optional
+            The formats rendered per sample, from `render_formats`. PDF is always rendered
+            when `trial_pdf` is set.
+
+        trial_pdf : bool, optional
+            Whether to write the per-trial multi-page PDF. Needs pypdf.
+
+        overwrite : bool, optional
+            Whether to render samples whose reports are newer than their output file.
+
+        max_workers : int, optional
+            The number of worker processes. Defaults to `map_workbook_sheets.default_workers`.
+
+        Returns:
+        --------
+        summary : dict
+            Lists of sample IDs under "rendered" and "skipped", the paths of the trial PDFs
+            under "trial_reports", and {"file": ..., "error": ...} entries under "errors".
+    """
+    if kaleido is None:
+        raise ImportError("Rendering QC reports needs kaleido, install it with: pip install kaleido")
+    if trial_pdf and pypdf is None:
+        raise ImportError("Merging the trial PDFs needs pypdf, install it with: pip install pypdf")
+
+    formats = list(dict.fromkeys(list(formats) + (["pdf"] if trial_pdf else [])))
+    unknown = [fmt for fmt in formats if fmt not in render_formats]
+    if unknown:
+        raise ValueError(f"Unknown formats {unknown}, expected some of {render_formats}")
+
+    summary = {"rendered": [], "skipped": [], "trial_reports": [], "errors": []}
+
+    # Declare the tasks, skipping samples whose reports are up to date
+    tasks = []
+    trials = {}
+    for file_name in sorted(os.listdir(input_path)):
+        if not is_typing_file(file_name): continue
+        source = os.path.join(input_path, file_name)
+        try:
+            with open(source, "rb") as f:
+                caller = detect_caller(file_name, f.read(header_size))
+        except ValueError as e:
+            summary["errors"].append({"file": file_name, "error": str(e)})
+            continue
+
+        sample_id = sample_name(file_name, caller)
+        trial_id = sample_id.split("_")[0]
+        targets = {fmt: os.path.join(archive_path, trial_id, f"{sample_id}.{fmt}") for fmt in formats}
+        trials.setdefault(trial_id, []).append(targets.get("pdf"))
+
+        if not overwrite and _up_to_date(source, targets.values()):
+            summary["skipped"].append(sample_id)
+        else:
+            tasks.append((source, file_name, sample_id, targets))
+
+    # Render the samples, in the calling process when there is a single worker or task
+    max_workers = max_workers or default_workers
+    if max_workers == 1 or len(tasks) <= 1:
+        _start_renderer()
+        outcomes = [_render_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)), initializer=_start_renderer) as pool:
+            outcomes = list(pool.map(_render_task, tasks))
+
+    failed_trials = set()
+    rendered_trials = set()
+    for (source, file_name, sample_id, targets), error in zip(tasks, outcomes):
+        if error is None:
+            summary["rendered"].append(sample_id)
+            rendered_trials.add(sample_id.split("_")[0])
+        else:
+            summary["errors"].append({"file": file_name, "error": error})
+            failed_trials.add(sample_id.split("_")[0])
+
+    # Merge the sample PDFs per trial, leaving out trials with a failed sample and trials
+    # whose merged PDF exists and none of whose samples was rendered again
+    if trial_pdf:
+        for trial_id, pdf_paths in sorted(trials.items()):
+            if trial_id in failed_trials: continue
+            trial_path = os.path.join(archive_path, trial_id, f"{trial_id}_qc_report.pdf")
+            if trial_id not in rendered_trials and os.path.exists(trial_path): continue
+            try:
+                _merge_pdfs(pdf_paths, trial_path)
+                summary["trial_reports"].append(trial_path)
+            except Exception as e:
+                summary["errors"].append({"file": os.path.basename(trial_path), "error": str(e)})
+
+    for error in summary["errors"]:
+        logger.warning("Error rendering %s: %s", error["file"], error["error"])
+
+    return summary
+
+
+def _start_renderer():
+    """ Starts the headless renderer of this process, so every image after the first reuses it """
+    # Kaleido 1.x renders through a browser, kept running between images by the sync server
+    if hasattr(kaleido, "start_sync_server"):
+        kaleido.start_sync_server(silence_warnings=True)
+        atexit.register(kaleido.stop_sync_server, silence_warnings=True)
+
+    # Render an empty figure, so the start-up is not counted against the first sample
+    pio.to_image(go.Figure(), format="png", width=10, height=10)
+
+
+def _render_task(task):
+    """ Renders the report of one sample to every target, in the worker process. Returns the error or None """
+    source, file_name, sample_id, targets = task
+    try:
+        with open(source, "rb") as f:
+            figure = build_qc_figure(parse_typing(f, file_name), file_name)
+
+        for fmt, target in targets.items():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pio.to_image(figure, format=fmt, scale=png_scale if fmt == "png" else 1))
+            os.replace(tmp_path, target)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def _merge_pdfs(pdf_paths, trial_path):
+    """ Writes the pages of the sample PDFs, in order, to one PDF """
+    writer = pypdf.PdfWriter()
+    for pdf_path in pdf_paths:
+        writer.append(pdf_path)
+
+    tmp_path = f"{trial_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        writer.write(f)
+    os.replace(tmp_path, trial_path)
+
+
+def _up_to_date(source, targets) -> bool:
+    """ Returns whether every target exists and is newer than the source """
+    source_mtime = os.path.getmtime(source)
+    return all(os.path.exists(target) and os.path.getmtime(target) >= source_mtime for target in targets)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Renders the QC report of every HLA typing output file in a folder for archival.")
+    parser.add_argument("input_path", help="The folder with the typing output files.")
+    parser.add_argument("archive_path", help="The folder the reports are written to.")
+    parser.add_argument("--formats", nargs="+", default=render_formats, choices=render_formats)
+    parser.add_argument("--no-trial-pdf", action="store_true", help="Do not merge the sample PDFs per trial.")
+    parser.add_argument("--overwrite", action="store_true", help="Render samples whose reports are up to date.")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    summary = render_qc_reports(args.input_path, args.archive_path, args.formats, not args.no_trial_pdf, args.overwrite, args.workers)
+    print(f"{len(summary['rendered'])} rendered, {len(summary['skipped'])} up to date, "
+          f"{len(summary['trial_reports'])} trial PDFs, {len(summary['errors'])} errors")
+    sys.exit(1 if summary["errors"] else 0)
@@ -0,0 +1,150 @@
+# This file contains the content-addressed index of the samples ingested into the trial workbooks
+
+# Built in imports
+import os
+import json
+import hashlib
+
+# Local imports
+from src.utils.file_lock import locked, write_json_atomic
+
+
+# Declare the index file name, stored next to the trial workbooks
+index_file_name = "sample_index.json"
+
+# Declare the data version file name, bumped every time samples are recorded or the workbooks change
+version_file_name = "data_version.json"
+
+# Index per output path, reloaded only when the file changes
+_cache = {}
+
+
+def content_hash(content) -> str:
+    """ Returns the SHA-256 hex digest of the sample file content """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def load_sample_index(output_path) -> dict:
+    """
+        Returns the sample index of the output path.
+
+        The index maps each sample ID to {"sha256": ..., "workbook": ..., "sheet": ...}.
+        It is read from disk only when the file changed since the last call in this process,
+        so repeated lookups cost a dict access.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory where the trial Excel files and the index are stored.
+
+        Returns:
+        --------
+        index : dict
+            The sample index. Treat it as read-only, use `record_samples` to change it.
+    """
+    index_path = os.path.join(output_path, index_file_name)
+
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+
+    cached = _cache.get(index_path)
+    if cached is None or cached[0] != mtime:
+        with open(index_path, encoding="utf-8") as f:
+            cached = (mtime, json.load(f))
+        _cache[index_path] = cached
+
+    return cached[1]
+
+
+def data_version(output_path) -> int:
+    """
+        Returns the data version of the output path, 0 while it holds no workbook.
+
+        The version is bumped by `record_samples` after the trial workbooks are written, and
+        whenever the workbooks no longer match the ones it was recorded for, so workbooks that
+        were there before the index or are edited outside the app also change it. Anything
+        derived from the workbooks can be kept until the version changes.
+    """
+    signature = _workbook_signature(output_path)
+    recorded = _read_version(output_path)
+    if recorded["signature"] == signature:
+        return recorded["version"]
+
+    with locked(os.path.join(output_path, index_file_name)):
+        signature = _workbook_signature(output_path)
+        recorded = _read_version(output_path)
+        if recorded["signature"] != signature:
+            recorded = {"version": recorded["version"] + 1, "signature": signature}
+            write_json_atomic(os.path.join(output_path, version_file_name), recorded)
+
+    return recorded["version"]
+
+
+def ingest_status(index, sample_id, digest) -> str:
+    """ Returns "new", "unchanged" or "changed" for a sample ID and content hash """
+    entry = index.get(sample_id)
+    if entry is None:
+        return "new"
+    return "unchanged" if entry["sha256"] == digest else "changed"
+
+
+def record_samples(output_path, entries):
+    """
+        Adds or replaces samples in the index of the output path.
+
+        The index is re-read under an exclusive lock and replaced atomically, so concurrent
+        workers never lose each other's entries or read a half written file. The data
+        version is bumped under the same lock.
+
+        Parameters:
+        -----------
+        output_path : str
+            The directory where the trial Excel files and the index are stored.
+
+        entries : dict
+            Sample ID -> {"sha256": ..., "workbook": ..., "sheet": ...}.
+    """
+    index_path = os.path.join(output_path, index_file_name)
+
+    with locked(index_path):
+        index = dict(load_sample_index(output_path))
+        index.update(entries)
+        write_json_atomic(index_path, index, indent=1, sort_keys=True)
+        version = {"version": _read_version(output_path)["version"] + 1, "signature": _workbook_signature(output_path)}
+        write_json_atomic(os.path.join(output_path, version_file_name), version)
+
+
+def _read_version(output_path) -> dict:
+    """ Returns the recorded data version and the signature of the workbooks it was recorded for """
+    try:
+        with open(os.path.join(output_path, version_file_name), encoding="utf-8") as f:
+            recorded = json.load(f)
+    except FileNotFoundError:
+        return {"version": 0, "signature": _signature([])}
+    return {"version": recorded["version"], "signature": recorded.get("signature")}
+
+
+def _workbook_signature(output_path) -> str:
+    """ Returns a hash of the name, modification time and size of the trial workbooks, leaving out hidden files being written """
+    try:
+        file_names = sorted(os.listdir(output_path))
+    except FileNotFoundError:
+        file_names = []
+
+    stats = []
+    for file_name in file_names:
+        if not file_name.endswith((".xlsx", ".xls")) or file_name.startswith("."): continue
+        try:
+            stat = os.stat(os.path.join(output_path, file_name))
+        except FileNotFoundError:
+            continue  # Removed while listing
+        stats.append([file_name, stat.st_mtime_ns, stat.st_size])
+    return _signature(stats)
+
+
+def _signature(stats) -> str:
+    return hashlib.sha256(json.dumps(stats).encode("utf-8")).hexdigest()
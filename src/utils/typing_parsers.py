@@ -0,0 +1,218 @@
+# This file contains the registry of HLA typing output parsers, one per caller, normalizing to the HLA-LA layout
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Built in imports
+import io
+import re
+import json
+
+# Local imports
+from src.utils.hla_loci import normalize_locus
+
+
+# Declare the normalized long format, one row per locus and chromosome copy. The column names
+# are the ones of HLA-LA's *_bestguess_G.txt, which the reports, QC rules and monitors read
+typing_columns = ["Caller", "Locus", "Chromosome", "Allele"]
+typing_metric_columns = [
+    "Q1", "Q2", "AverageCoverage", "CoverageFirstDecile", "MinimumCoverage",
+    "proportionkMersCovered", "LocusAvgColumnError",
+]
+
+# Declare the number of bytes read to recognize a file by its header
+header_size = 4096
+
+# Registered callers, in detection order
+typing_callers = {}
+
+
+def register_caller(caller, suffixes, header_pattern, metrics=(), strip_suffix=True):
+    """
+        Registers a parser of a caller's output, used as a decorator.
+
+        Parameters:
+        -----------
+        caller : str
+            The caller name, written to the Caller column.
+
+        suffixes : list of str
+            The file name endings of the caller's output.
+
+        header_pattern : str
+            A regular expression matching the start of the caller's output, used when the
+            file name does not identify the caller.
+
+        metrics : list of str, optional
+            The `typing_metric_columns` the caller reports. The QC rules do not fail a row on
+            a metric its caller does not report.
+
+        strip_suffix : bool, optional
+            Whether the suffix is removed from the file name to get the sample ID.
+
+        Returns:
+        --------
+        register : callable
+            Registers `parse(stream) -> pd.DataFrame`, which reads a binary stream and returns
+            Locus, Chromosome and Allele columns plus any metrics the caller reports.
+    """
+    def register(parse):
+        typing_callers[caller] = {
+            "suffixes": tuple(suffixes),
+            "header": re.compile(header_pattern),
+            "metrics": tuple(metrics),
+            "strip_suffix": strip_suffix,
+            "parse": parse,
+        }
+        return parse
+    return register
+
+
+def detect_caller(file_name, head=b"") -> str:
+    """ Returns the caller of an output file, by its name or else by its first bytes """
+    for caller, entry in typing_callers.items():
+        if str(file_name).endswith(entry["suffixes"]):
+            return caller
+
+    text = head.decode("utf-8", errors="ignore") if isinstance(head, bytes) else str(head)
+    for caller, entry in typing_callers.items():
+        if entry["header"].match(text):
+            return caller
+
+    raise ValueError(f"Unrecognized HLA typing output '{file_name}', expected one of {list(typing_callers)}")
+
+
+def is_typing_file(file_name) -> bool:
+    """ Returns whether a file in a folder or archive should be ingested as a typing output """
+    return str(file_name).endswith(".txt") or any(
+        str(file_name).endswith(entry["suffixes"]) for entry in typing_callers.values()
+    )
+
+
+def sample_name(file_name, caller=None) -> str:
+    """ Returns the sample ID of an output file, the part before '_R1_' or else the name without the caller's suffix """
+    sample = str(file_name).split("_R1_")[0]
+    entry = typing_callers.get(caller or "")
+    if entry is not None and entry["strip_suffix"]:
+        for suffix in entry["suffixes"]:
+            if sample.endswith(suffix):
+                return sample[:-len(suffix)]
+    return sample
+
+
+def data_caller(data):
+    """ Returns the caller of parsed typing output rows, or None for rows without a Caller column """
+    if "Caller" not in data or data.empty:
+        return None
+    return data["Caller"].iloc[0]
+
+
+def reports_metric(data, metric) -> pd.Series:
+    """ Returns whether the caller of each row reports a metric, True for rows of unknown callers or without a Caller column """
+    if "Caller" not in data:
+        return pd.Series(True, index=data.index)
+    reporting = [caller for caller, entry in typing_callers.items() if metric in entry["metrics"]]
+    return data["Caller"].isin(reporting) | ~data["Caller"].isin(list(typing_callers))
+
+
+def caller_metrics() -> dict:
+    """ Returns the metrics each registered caller reports, for the clientside QC filter """
+    return {caller: list(entry["metrics"]) for caller, entry in typing_callers.items()}
+
+
+def parse_typing(source, file_name="", caller=None) -> pd.DataFrame:
+    """
+        Returns the calls of an HLA typing output in the normalized long format.
+
+        The caller is detected from the file name, or else from the header, unless given.
+        Loci and alleles get the 'HLA-' prefix HLA-LA writes, both chromosome copies are
+        listed for homozygous calls, and untyped loci are left out. Metrics the caller does
+        not report are missing, and other caller metrics are kept after the normalized columns.
+
+        Parameters:
+        -----------
+        source : bytes, str or binary file object
+            The output file content, or a seekable stream of it.
+
+        file_name : str, optional
+            The name of the output file.
+
+        caller : str, optional
+            One of `typing_callers`, to skip the detection.
+
+        Returns:
+        --------
+        data : pd.DataFrame
+            The `typing_columns` and `typing_metric_columns`, with int Chromosome and float
+            metrics, followed by the caller's other columns.
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    stream = io.BytesIO(source) if isinstance(source, bytes) else source
+
+    if caller is None:
+        head = stream.read(header_size)
+        stream.seek(0)
+        caller = detect_caller(file_name, head)
+
+    data = typing_callers[caller]["parse"](stream)
+    data = data[data["Allele"].notna()]
+
+    extra_columns = [x for x in data.columns if x not in typing_columns + typing_metric_columns]
+    normalized = pd.DataFrame({
+        "Caller": caller,
+        "Locus": "HLA-" + data["Locus"].map(normalize_locus),
+        "Chromosome": data["Chromosome"].astype(int),
+        "Allele": _with_prefix(data["Allele"].astype(str).str.strip()),
+        **{column: pd.to_numeric(data[column], errors="coerce") if column in data else np.nan for column in typing_metric_columns},
+    }, index=data.index)
+
+    return pd.concat([normalized.astype({x: float for x in typing_metric_columns}), data[extra_columns]], axis=1).reset_index(drop=True)
+
+
+@register_caller("HLA-LA", ["bestguess_G.txt", "bestguess.txt"], r"Locus\tChromosome\tAllele", metrics=typing_metric_columns, strip_suffix=False)
+def parse_hla_la(stream) -> pd.DataFrame:
+    """ Reads an HLA-LA *_bestguess_G.txt table, one row per locus and chromosome copy """
+    return pd.read_csv(stream, sep="\t", dtype={"Locus": str, "Allele": str})
+
+
+@register_caller("OptiType", ["_result.tsv"], r"\tA1\tA2\tB1\tB2\tC1\tC2")
+def parse_optitype(stream) -> pd.DataFrame:
+    """ Reads the best solution of an OptiType *_result.tsv, one column per locus and copy """
+    solution = pd.read_csv(stream, sep="\t", index_col=0).iloc[:1]
+    calls = [x for x in solution.columns if re.fullmatch(r"[A-Z]+[0-9]*[12]", x)]
+
+    data = solution.melt(id_vars=[x for x in solution.columns if x not in calls], value_vars=calls, var_name="Call", value_name="Allele")
+    data["Locus"] = data["Call"].str[:-1]
+    data["Chromosome"] = data["Call"].str[-1].astype(int)
+    return data.drop(columns="Call").sort_values(["Locus", "Chromosome"], kind="stable")
+
+
+@register_caller("HLA-HD", ["_final.result.txt"], r"[A-Z]+[0-9]*\t(HLA-[A-Z]+[0-9]*\*|Not typed)")
+def parse_hla_hd(stream) -> pd.DataFrame:
+    """ Reads an HLA-HD *_final.result.txt, one line per locus with the alleles of both copies """
+    calls = pd.read_csv(stream, sep="\t", header=None, names=["Locus", 1, 2], usecols=[0, 1, 2], index_col=False, dtype=str)
+
+    # A '-' second copy is homozygous, and 'Not typed' is an untyped copy
+    calls[2] = calls[2].mask(calls[2].isna() | (calls[2] == "-"), calls[1])
+    calls[[1, 2]] = calls[[1, 2]].mask(calls[[1, 2]] == "Not typed")
+
+    data = calls.melt(id_vars="Locus", value_vars=[1, 2], var_name="Chromosome", value_name="Allele")
+    return data.sort_values(["Locus", "Chromosome"], kind="stable")
+
+
+@register_caller("arcasHLA", [".genotype.json"], r"\s*\{")
+def parse_arcas_hla(stream) -> pd.DataFrame:
+    """ Reads an arcasHLA *.genotype.json, a list of one (homozygous) or two alleles per locus """
+    genotype = pd.Series(json.load(stream), dtype=object)
+    genotype = genotype.where(genotype.str.len() != 1, genotype * 2)
+
+    data = genotype.rename("Allele").rename_axis("Locus").reset_index().explode("Allele")
+    data["Chromosome"] = data.groupby("Locus").cumcount() + 1
+    return data
+
+
+def _with_prefix(alleles) -> pd.Series:
+    """ Returns the alleles with the 'HLA-' prefix HLA-LA writes """
+    return alleles.where(alleles.str.startswith("HLA-"), "HLA-" + alleles)
@@ -0,0 +1,45 @@
+# This file contains the tests of the cached cohort table
+
+# Third party imports
+import pandas as pd
+
+# Local imports
+from src.utils import cohort_table
+from src.utils.cohort_table import load_cohort_table
+from src.utils.download_report_table import write_report_sheets
+
+
+def _report(allele) -> pd.DataFrame:
+    """ Returns the report of a sample typed at HLA-A only """
+    return pd.DataFrame({
+        "LOCUS": ["HLA-A", "HLA-A"],
+        "CLASS": [1, 1],
+        "ALLELE": [allele, "A*02:01"],
+        "CHROMOSOME_COPY": [1, 2],
+        "QC_PASSED": ["True", "True"],
+    })
+
+
+def test_only_changed_workbooks_are_parsed_again(tmp_path, monkeypatch):
+    output_path = str(tmp_path)
+    write_report_sheets(str(tmp_path / "T1_hla_typing_report.xlsx"), {"P1": _report("A*01:01")})
+    write_report_sheets(str(tmp_path / "T2_hla_typing_report.xlsx"), {"P2": _report("A*03:01")})
+    load_cohort_table(output_path, max_workers=1)
+
+    parsed = []
+    map_workbook_sheets = cohort_table.map_workbook_sheets
+
+    def recording_map(file_paths, *args, **kwargs):
+        parsed.extend(file_paths)
+        return map_workbook_sheets(file_paths, *args, **kwargs)
+
+    monkeypatch.setattr(cohort_table, "map_workbook_sheets", recording_map)
+    write_report_sheets(str(tmp_path / "T2_hla_typing_report.xlsx"), {"P3": _report("A*11:01")})
+    cohort = load_cohort_table(output_path, max_workers=1)
+
+    assert [path.rsplit("/", 1)[-1] for path in parsed] == ["T2_hla_typing_report.xlsx"]
+    assert cohort["PATIENT_ID"].unique().tolist() == ["P1", "P2", "P3"]
+
+    # The updated table equals one parsed from scratch
+    cohort_table._cache.clear()
+    pd.testing.assert_frame_equal(cohort, load_cohort_table(output_path, max_workers=1))
@@ -0,0 +1,60 @@
+# This file contains the tests of the genotype fingerprint index
+
+# Third party imports
+import pandas as pd
+
+# Local imports
+from src.utils import genotype_fingerprint
+from src.utils.genotype_fingerprint import (
+    cohort_fingerprint_check, check_sample, load_fingerprint_index, record_genotypes,
+)
+
+
+def _cohort(genotypes) -> pd.DataFrame:
+    """ Returns a long-format cohort table of {patient: {locus: (allele, allele)}} """
+    rows = [
+        {"PATIENT_ID": patient, "LOCUS": locus, "CLASS": 1, "ALLELE": allele, "CHROMOSOME_COPY": copy, "QC_PASSED": True}
+        for patient, loci in genotypes.items()
+        for locus, alleles in loci.items()
+        for copy, allele in enumerate(alleles, start=1)
+    ]
+    return pd.DataFrame(rows)
+
+
+def _normalized(index) -> dict:
+    """ Returns the index with the sample lists of the fingerprints and keys sorted """
+    return dict(index, **{table: {key: sorted(samples) for key, samples in index[table].items()} for table in ("fingerprints", "keys")})
+
+
+def test_cohort_check_with_a_locus_nobody_is_typed_at():
+    # Typed at A, B and C only, while the default loci include DRB1 and DQB1
+    class_i = {"A": ("A*01:01", "A*02:01"), "B": ("B*07:02", "B*08:01"), "C": ("C*07:01", "C*07:02")}
+    cohort = _cohort({
+        "P1": class_i,
+        "P2": class_i,
+        "P3": {"A": ("A*03:01", "A*11:01"), "B": ("B*35:01", "B*44:02"), "C": ("C*04:01", "C*05:01")},
+    })
+
+    tokens = genotype_fingerprint._cohort_tokens(cohort, ["A", "B", "C", "DRB1", "DQB1"], "two_field")
+    assert tokens["DRB1"].isna().all() and tokens["DQB1"].isna().all()
+
+    pairs = cohort_fingerprint_check(cohort)
+    assert pairs[["PATIENT_ID_1", "PATIENT_ID_2"]].values.tolist() == [["P1", "P2"]]
+
+
+def test_recorded_genotypes_update_the_cached_index(tmp_path):
+    first = {"A": ["A*01:01", "A*02:01"], "B": ["B*07:02", "B*08:01"], "C": ["C*07:01", "C*07:02"], "DRB1": ["DRB1*03:01", "DRB1*15:01"], "DQB1": ["DQB1*02:01", "DQB1*06:02"]}
+    second = dict(first, A=["A*03:01", "A*11:01"])
+
+    record_genotypes(str(tmp_path), {"S1": first})
+    cached = load_fingerprint_index(str(tmp_path))
+    record_genotypes(str(tmp_path), {"S2": first, "S1": second})
+
+    # The cached index is updated in place instead of being rebuilt, and equals a rebuilt one
+    assert load_fingerprint_index(str(tmp_path)) is cached
+    genotype_fingerprint._cache.clear()
+    rebuilt = load_fingerprint_index(str(tmp_path))
+    assert _normalized(cached) == _normalized(rebuilt)
+
+    flags = check_sample(cached, "S3", first)
+    assert [(flag["other"], flag["kind"]) for flag in flags] == [("S1", "near_duplicate"), ("S2", "duplicate")]
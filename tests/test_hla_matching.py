@@ -0,0 +1,49 @@
+# This file contains the tests of the donor-recipient HLA mismatch search
+
+# Third party imports
+import pandas as pd
+import pytest
+
+# Local imports
+from src.utils.hla_matching import encode_cohort, find_matches
+
+
+def _cohort(genotypes) -> pd.DataFrame:
+    """ Returns a long-format cohort table of {patient: {locus: (allele, allele)}} """
+    rows = [
+        {"PATIENT_ID": patient, "LOCUS": locus, "CLASS": 1, "ALLELE": allele, "CHROMOSOME_COPY": copy, "QC_PASSED": True}
+        for patient, loci in genotypes.items()
+        for locus, alleles in loci.items()
+        for copy, allele in enumerate(alleles, start=1)
+    ]
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def encoded():
+    return encode_cohort(_cohort({
+        "query": {"A": ("A*01:01", "A*02:01"), "B": ("B*07:02", "B*08:01"), "C": ("C*07:01", "C*07:02"), "DRB1": ("DRB1*03:01", "DRB1*15:01")},
+        "one_mismatch": {"A": ("A*01:01", "A*03:01"), "B": ("B*07:02", "B*08:01"), "C": ("C*07:01", "C*07:02"), "DRB1": ("DRB1*03:01", "DRB1*15:01")},
+        "only_c": {"C": ("C*07:01", "C*07:02")},
+        "partial": {"A": ("A*01:01", "A*02:01"), "B": ("B*07:02", "B*08:01")},
+    }))
+
+
+def test_untyped_candidates_are_left_out(encoded):
+    matches = find_matches(encoded, "query", ["A", "B", "DRB1"])
+    assert "only_c" not in matches["PATIENT_ID"].tolist()
+
+    matches = find_matches(encoded, "query", ["DRB1"])
+    assert matches["PATIENT_ID"].tolist() == ["one_mismatch"]
+
+
+def test_fully_typed_candidates_rank_first(encoded):
+    matches = find_matches(encoded, "query", ["A", "B", "DRB1"])
+    assert matches["PATIENT_ID"].tolist() == ["one_mismatch", "partial"]
+    assert matches["MISMATCHES"].tolist() == [1, 0]
+
+
+@pytest.mark.parametrize("top_k", [0, -1, None, 2.5])
+def test_invalid_top_k_is_rejected(encoded, top_k):
+    with pytest.raises(ValueError):
+        find_matches(encoded, "query", top_k=top_k)
@@ -0,0 +1,52 @@
+# This file contains the tests of the QC threshold sweep over the cohort index
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Local imports
+from src.utils import cohort_index
+from src.utils.cohort_index import load_cohort_index
+from src.utils.download_report_table import write_report_sheets
+from src.utils.qc_metrics import record_qc_metrics
+from src.utils.qc_sweep import qc_threshold_sweep, qc_sweep_grid
+
+
+def _typing_output(seed) -> pd.DataFrame:
+    """ Returns an HLA-LA output with random QC metrics around the default thresholds """
+    rng = np.random.default_rng(seed)
+    loci = ["A", "A", "B", "B", "DRB1", "DRB1"]
+    return pd.DataFrame({
+        "Locus": loci,
+        "Chromosome": [1, 2] * 3,
+        "Q1": rng.uniform(0.85, 1.0, len(loci)).round(3),
+        "proportionkMersCovered": rng.uniform(0.85, 1.0, len(loci)).round(3),
+        "AverageCoverage": rng.uniform(0, 45, len(loci)).round(1),
+        "Caller": "HLA-LA",
+    })
+
+
+def test_sweep_reads_the_metrics_of_the_cohort_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(cohort_index, "cohort_index_path", str(tmp_path / "index"))
+    output_path = str(tmp_path / "outputs")
+
+    outputs = {}
+    for i, trial_id in enumerate(["T1", "T1", "T2"]):
+        sample_id = f"{trial_id}_S{i}"
+        outputs[sample_id] = (trial_id, _typing_output(i))
+        record_qc_metrics(output_path, trial_id, sample_id, outputs[sample_id][1])
+        report = pd.DataFrame({"LOCUS": ["HLA-A"], "CLASS": [1], "ALLELE": ["A*01:01"], "CHROMOSOME_COPY": [1], "QC_PASSED": ["True"]})
+        write_report_sheets(f"{output_path}/{trial_id}_hla_typing_report.xlsx", {sample_id: report})
+
+    index = load_cohort_index(output_path)
+    assert index["qc_metrics"].shape == (18, 3) and index["qc_trials"] == ["T1", "T2"]
+
+    # Every grid point counts the calls passing the rule, per trial
+    sweep = qc_threshold_sweep(index, "TRIAL_ID")
+    metrics = pd.concat([data.assign(TRIAL_ID=trial_id) for trial_id, data in outputs.values()])
+    q1 = metrics["Q1"].to_numpy()[:, None, None, None] >= qc_sweep_grid["min_q1"][None, :, None, None]
+    kmers = metrics["proportionkMersCovered"].to_numpy()[:, None, None, None] >= qc_sweep_grid["min_proportion_kmers_covered"][None, None, :, None]
+    coverage = metrics["AverageCoverage"].to_numpy()[:, None, None, None] > qc_sweep_grid["min_average_coverage"][None, None, None, :]
+    passed = q1 & (kmers | coverage)
+    for group, trial_id in enumerate(sweep["groups"]):
+        assert (sweep["passed"][group] == passed[(metrics["TRIAL_ID"] == trial_id).to_numpy()].sum(axis=0)).all()
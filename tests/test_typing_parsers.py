@@ -0,0 +1,56 @@
+# This file contains the tests of the HLA typing output parsers and the caller-aware QC rule
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Local imports
+from src.utils.typing_parsers import parse_typing, detect_caller, sample_name, is_typing_file
+from src.utils.qc_rules import qc_passed
+
+
+hla_la = (
+    "Locus\tChromosome\tAllele\tQ1\tQ2\tAverageCoverage\tCoverageFirstDecile\tMinimumCoverage\tproportionkMersCovered\tLocusAvgColumnError\n"
+    "A\t1\tA*01:01:01G\t1\t1\t40\t30\t20\t1\t0.01\n"
+    "A\t2\tA*02:01:01G\t1\t1\t40\t30\t20\t1\t0.01\n"
+    "B\t1\tB*07:02:01G\t\t1\t\t30\t20\t\t0.01\n"
+    "B\t2\tB*08:01:01G\t1\t1\t1\t30\t20\t0.5\t0.01\n"
+)
+optitype = "\tA1\tA2\tB1\tB2\tC1\tC2\tReads\tObjective\n0\tA*01:01\tA*02:01\tB*07:02\tB*07:02\tC*07:01\tC*07:02\t100\t99.5\n"
+hla_hd = "A\tHLA-A*01:01:01\tHLA-A*02:01:01\nB\tHLA-B*07:02:01\t-\nDRB1\tNot typed\tNot typed\n"
+arcas_hla = '{"A": ["A*01:01:01", "A*02:01:01"], "B": ["B*07:02:01"]}'
+
+
+def test_callers_are_detected_by_name_and_header():
+    assert detect_caller("S1_R1_bestguess_G.txt") == "HLA-LA"
+    assert detect_caller("S1_result.tsv") == "OptiType"
+    assert detect_caller("unknown.txt", hla_hd.encode()) == "HLA-HD"
+    assert detect_caller("unknown.txt", arcas_hla.encode()) == "arcasHLA"
+    assert sample_name("T1_S1_result.tsv", "OptiType") == "T1_S1"
+    assert all(is_typing_file(name) for name in ["a.txt", "a_result.tsv", "a.genotype.json"])
+
+
+def test_outputs_are_normalized_to_one_row_per_copy():
+    expected = [("HLA-A", 1, "HLA-A*01:01"), ("HLA-A", 2, "HLA-A*02:01"), ("HLA-B", 1, "HLA-B*07:02"), ("HLA-B", 2, "HLA-B*07:02")]
+    for content, file_name in [(optitype, "S1_result.tsv"), (arcas_hla, "S1.genotype.json")]:
+        data = parse_typing(content, file_name)
+        calls = [(locus, copy, allele[:len("HLA-A*01:01")]) for locus, copy, allele in data[["Locus", "Chromosome", "Allele"]].values.tolist()]
+        assert calls[:4] == expected
+        assert data["Q1"].isna().all()
+
+    # HLA-HD lists a homozygous copy as '-' and leaves out untyped loci
+    data = parse_typing(hla_hd, "S1_final.result.txt")
+    assert data["Locus"].tolist() == ["HLA-A", "HLA-A", "HLA-B", "HLA-B"]
+    assert data["Allele"].tolist()[2:] == ["HLA-B*07:02:01", "HLA-B*07:02:01"]
+
+
+def test_missing_metrics_fail_only_callers_reporting_them():
+    # The HLA-LA row with missing metrics fails, the row with low coverage and k-mers fails
+    assert qc_passed(parse_typing(hla_la, "S1_bestguess_G.txt")).tolist() == [True, True, False, False]
+
+    # Callers without metrics are not failed on them
+    assert qc_passed(parse_typing(optitype, "S1_result.tsv")).all()
+
+    # Rows without a Caller column are held to all the rules
+    rows = pd.DataFrame({"Q1": [np.nan], "proportionkMersCovered": [1.0], "AverageCoverage": [10.0]})
+    assert not qc_passed(rows).any()